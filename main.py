@@ -3,13 +3,14 @@ Surooh Academy - Main FastAPI Application
 نواة النظام الرئيسية للأكاديمية
 """
 import os
+import hmac
 import time
 import uuid
 from typing import Dict, Any, Optional
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 import shutil
@@ -17,7 +18,9 @@ from loguru import logger
 from dotenv import load_dotenv
 
 from server.academy.instructor import instructor
+from server.academy.hedging import hedged_executor, vertex_regional_client
 from server.academy.trainers.customer_support_trainer import trainer
+from server.academy.trainers.support_fast_path import support_fast_path, llm_fallback_from_trainer, load_archive_faqs
 from server.academy.trainers.pricing_engine_trainer import pricing_trainer
 from server.academy.trainers.analytics_reporter_trainer import analytics_trainer
 from server.academy.trainers.order_orchestrator_trainer import order_trainer
@@ -26,10 +29,14 @@ from server.academy.cores.chat_core_trainer import train_chat_core_v2
 from server.academy.cores.chat_core_evaluator import simulate_chat_core_v2, evaluate_chat_core_v2
 from server.core.memory_bridge import bridge_memory, get_archive_stats
 from server.core.memory_search import search_memory, list_archive_files
+from server.core.packed_archive import get_packed_archive
+from server.core.tenant_scheduler import tenant_scheduler, AdmissionRejected
+from server.core.profiler import request_profiler, RequestTimelineMiddleware, TRACE_ID_PATTERN, MAX_TRACE_ID_LENGTH
 from server.core.text_extractor import process_all_archive_files, get_extraction_stats
 from server.core.knowledge_feed import knowledge_feed
 from server.core.context_injector import context_injector
 from server.core.semantic_search import get_search_engine
+from server.core.hybrid_search import get_hybrid_search_engine
 from server.core.auto_archive import get_auto_archive
 from server.academy.orchestrator import get_orchestrator
 from server.core.monitor_daemon import monitor_daemon
@@ -39,10 +46,14 @@ from server.core.ocr_service import ocr_service
 from server.core.audio_service import audio_service
 from server.core.video_service import video_service
 from server.integrations.messaging_hub import messaging_hub
+from server.integrations.inbound_pipeline import (
+    inbound_pipeline, outbound_batcher, parse_webhook, verify_webhook, verify_subscription, bind_messaging_hub
+)
 from server.integrations.email_service import email_service
 from server.integrations.ecommerce_hub import ecommerce_hub
 from server.integrations.accounting_service import accounting_service
 from server.academy.bot_specialization import bot_specialization_engine
+from server.academy.specialization_cache import specialization_compiler
 from server.academy.training_manager import training_manager
 from server.academy.api.replit_bots_routes import router as replit_bots_router
 
@@ -58,6 +69,17 @@ except ImportError:
 
 load_dotenv()
 
+# مجلد الأرشيف الذي يعكسه المخزن المضغوط (/core/list و /core/stats)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Hedged LLM requests (backup call to GCP_HEDGE_LOCATION when the primary is slow)
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+
+hedged_executor.register_backup_factory("instructor", vertex_regional_client)
+hedged_executor.register_backup_factory("trainer", vertex_regional_client)
+backup_instructor = hedged_executor.backup_client("instructor", instructor) if LLM_HEDGING_ENABLED else instructor
+backup_trainer = hedged_executor.backup_client("trainer", trainer) if LLM_HEDGING_ENABLED else trainer
+
 logger.add(
     "logs/surooh_academy_{time}.log",
     rotation="500 MB",
@@ -66,11 +88,19 @@ logger.add(
     format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
 )
 
+async def _llm_call(name: str, primary, backup):
+    """تنفيذ استدعاء النموذج اللغوي مع التحوط عند تفعيله"""
+    if not LLM_HEDGING_ENABLED:
+        return await primary()
+    return await hedged_executor.call(primary, backup, name=name)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("🚀 Surooh Academy starting up...")
     logger.info(f"📍 GCP Project: {os.getenv('GCP_PROJECT', 'Not Set')}")
     logger.info(f"📍 GCP Location: {os.getenv('GCP_LOCATION', 'Not Set')}")
+    if LLM_HEDGING_ENABLED:
+        logger.info(f"🔀 LLM hedging enabled, backup clients: {hedged_executor.backup_clients}")
     
     async def handle_monitor_alert(alert: Dict[str, Any]):
         await action_engine.create_smart_action_from_alert(alert)
@@ -81,10 +111,33 @@ async def lifespan(app: FastAPI):
     monitor_task = asyncio.create_task(monitor_daemon.start())
     logger.info("🔍 Monitor Daemon started in background")
     
+    request_profiler.start()
+    
+    bind_messaging_hub(messaging_hub, inbound_pipeline, outbound_batcher)
+    await inbound_pipeline.start()
+    await outbound_batcher.start()
+    
+    packed_archive = get_packed_archive()
+    packed_archive.add_listener(get_hybrid_search_engine().index_archive_file)
+    get_hybrid_search_engine().start_maintenance(
+        snapshot_interval_seconds=float(os.getenv("HYBRID_SNAPSHOT_INTERVAL", "300")),
+        snapshot_min_log_bytes=int(os.getenv("HYBRID_SNAPSHOT_MIN_LOG_BYTES", str(1024 * 1024)))
+    )
+    packed_archive.start_maintenance(
+        compaction_interval_seconds=float(os.getenv("PACKED_ARCHIVE_COMPACTION_INTERVAL", "300")),
+        sync_directory=ARCHIVE_DIR,
+        sync_interval_seconds=float(os.getenv("PACKED_ARCHIVE_SYNC_INTERVAL", "30"))
+    )
+    
     yield
     
     await monitor_daemon.stop()
     monitor_task.cancel()
+    packed_archive.close()
+    get_hybrid_search_engine().close()
+    request_profiler.stop()
+    await inbound_pipeline.stop()
+    await outbound_batcher.stop()
     logger.info("👋 Surooh Academy shutting down...")
 
 app = FastAPI(
@@ -193,6 +246,9 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Include Replit Bots Router
 app.include_router(replit_bots_router)
 
+# ASGI خالص حتى يعمل المعالج في نفس مهمة asyncio التي يتم أخذ عيناتها
+app.add_middleware(RequestTimelineMiddleware, profiler=request_profiler)
+
 class ProjectIntakeRequest(BaseModel):
     """
     نموذج طلب تحليل مشروع جديد
@@ -231,6 +287,8 @@ class ProjectIntakeRequest(BaseModel):
     trace_id: Optional[str] = Field(
         None, 
         description="معرف التتبع للطلب (اختياري)",
+        max_length=MAX_TRACE_ID_LENGTH,
+        pattern=TRACE_ID_PATTERN,
         example="trace-12345-abc"
     )
 
@@ -288,9 +346,17 @@ class BotTrainingRequest(BaseModel):
             "البوت: بالطبع، سأساعدك في تتبع الطلب..."
         ]
     )
+    tenant: Optional[str] = Field(
+        None, 
+        description="معرف العميل أو المستأجر",
+        max_length=50,
+        example="ecommerce-nl"
+    )
     trace_id: Optional[str] = Field(
         None, 
-        description="معرف التتبع للطلب"
+        description="معرف التتبع للطلب",
+        max_length=MAX_TRACE_ID_LENGTH,
+        pattern=TRACE_ID_PATTERN
     )
 
     class Config:
@@ -318,6 +384,48 @@ class BotTrainingRequest(BaseModel):
             }
         }
 
+class SupportAnswerRequest(BaseModel):
+    """
+    نموذج طلب إجابة سريعة من بوت خدمة العملاء
+    
+    Request model for answering a customer query from the precomputed fast path.
+    """
+    bot_name: str = Field(..., description="اسم البوت المدرب", example="support_bot_v2")
+    tenant: Optional[str] = Field(None, description="المستأجر الذي درّب البوت", max_length=50, example="acme_store")
+    query: str = Field(
+        ...,
+        description="سؤال العميل",
+        min_length=1,
+        max_length=2000,
+        example="أريد تتبع طلبي رقم ORD-12345"
+    )
+    trace_id: Optional[str] = Field(
+        None, description="معرف التتبع للطلب", max_length=MAX_TRACE_ID_LENGTH, pattern=TRACE_ID_PATTERN
+    )
+
+class HybridSearchRequest(BaseModel):
+    """
+    نموذج طلب البحث الهجين
+    
+    Request model for combined keyword (BM25) and semantic search.
+    """
+    query: str = Field(..., description="نص البحث", min_length=1, max_length=1000, example="سياسة الإرجاع")
+    top_k: int = Field(10, description="عدد النتائج", ge=1, le=100)
+    use_semantic: bool = Field(True, description="دمج نتائج البحث الدلالي")
+    rerank: bool = Field(False, description="إعادة ترتيب أفضل النتائج بنموذج cross-encoder محلي")
+    rerank_top_k: int = Field(20, description="عدد المرشحين لإعادة الترتيب", ge=1, le=100)
+
+class HybridDocument(BaseModel):
+    """مستند للفهرسة في البحث الهجين"""
+    id: str = Field(..., description="معرف المستند", min_length=1, max_length=500, example="faq/returns.md")
+    text: str = Field(..., description="نص المستند", min_length=1, max_length=100_000, example="يمكن إرجاع المنتج خلال 14 يوماً")
+    metadata: Optional[Dict[str, Any]] = Field(None, description="بيانات وصفية إضافية")
+
+class HybridIndexRequest(BaseModel):
+    """نموذج طلب فهرسة مستندات في البحث الهجين"""
+    # max_length على القائمة هو max_items في Pydantic v2
+    documents: list[HybridDocument] = Field(..., description="المستندات المطلوب فهرستها", min_length=1, max_length=500)
+
 class BotTrainingResponse(BaseModel):
     """
     نموذج استجابة تدريب البوت
@@ -384,6 +492,10 @@ async def api_info():
                 "chat_simulate": "/academy/cores/chat/simulate",
                 "chat_evaluate": "/academy/cores/chat/evaluate"
             },
+            "support": {
+                "answer": "/academy/support/answer",
+                "fast_path_stats": "/academy/support/fast_path/stats"
+            },
             "orchestration": "/academy/orchestrate",
             "memory": {
                 "upload": "/academy/upload",
@@ -391,6 +503,7 @@ async def api_info():
                 "process": "/core/process_all",
                 "search": "/core/search",
                 "semantic_search": "/core/semantic_search",
+                "hybrid_search": "/core/hybrid_search",
                 "list": "/core/list",
                 "stats": "/core/stats"
             },
@@ -468,6 +581,28 @@ async def health_check():
             "error": str(e)
         }
 
+def _validated_tenant(tenant: Any, trace_id: str) -> str:
+    """معرف المستأجر بعد التحقق، أو 400 إذا كان غير صالح"""
+    try:
+        return tenant_scheduler.tenant_id(tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": "invalid_tenant", "message": str(e), "trace_id": trace_id})
+
+def _admission_rejected_error(error: AdmissionRejected, trace_id: str, start_time: float) -> HTTPException:
+    """تحويل رفض القبول إلى استجابة 429 مع Retry-After"""
+    logger.warning(f"🚦 Tenant {error.tenant} throttled [trace_id={trace_id}]: {error.reason}")
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "tenant_throttled",
+            "message": error.reason,
+            "tenant": error.tenant,
+            "trace_id": trace_id,
+            "processing_time_ms": int((time.time() - start_time) * 1000)
+        },
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 @app.post(
     "/academy/intake", 
     response_model=ProjectIntakeResponse,
@@ -575,23 +710,30 @@ async def academy_intake(request: ProjectIntakeRequest):
     """
     start_time = time.time()
     trace_id = request.trace_id or str(uuid.uuid4())
+    request_profiler.bind_trace_id(trace_id)
     
     logger.info(f"📥 New project intake request [trace_id={trace_id}]")
     logger.info(f"   Project: {request.project_name or 'Unnamed'}")
-    logger.info(f"   Tenant: {request.tenant or 'default'}")
+    tenant = _validated_tenant(request.tenant, trace_id)
+    logger.info(f"   Tenant: {tenant}")
     
     try:
-        bots_plan = await instructor.propose_bots(
-            project_description=request.description,
-            trace_id=trace_id
-        )
+        request_profiler.mark_stage("queued")
+        async with tenant_scheduler.slot(tenant, endpoint="intake"):
+            request_profiler.mark_stage("llm_call")
+            bots_plan = await _llm_call(
+                "intake",
+                lambda: instructor.propose_bots(project_description=request.description, trace_id=trace_id),
+                lambda: backup_instructor.propose_bots(project_description=request.description, trace_id=trace_id)
+            )
         
         processing_time = int((time.time() - start_time) * 1000)
         
+        request_profiler.mark_stage("llm_done")
         logger.info(f"✅ Successfully generated bots plan [trace_id={trace_id}] in {processing_time}ms")
         
-        if processing_time > 10000:
-            logger.warning(f"⚠️ Processing time exceeded 10s: {processing_time}ms")
+        if processing_time > request_profiler.slow_threshold_ms:
+            logger.warning(f"⚠️ Processing time exceeded {request_profiler.slow_threshold_ms:.0f}ms: {processing_time}ms [trace_id={trace_id}]")
         
         return ProjectIntakeResponse(
             status="success",
@@ -601,6 +743,8 @@ async def academy_intake(request: ProjectIntakeRequest):
             message=f"تم تحليل المشروع بنجاح وإنشاء خطة تحتوي على {len(bots_plan.get('bots', []))} بوتات"
         )
         
+    except AdmissionRejected as e:
+        raise _admission_rejected_error(e, trace_id, start_time)
     except Exception as e:
         processing_time = int((time.time() - start_time) * 1000)
         logger.error(f"❌ Failed to process intake [trace_id={trace_id}]: {e}")
@@ -615,6 +759,15 @@ async def academy_intake(request: ProjectIntakeRequest):
             }
         )
 
+async def _compile_specialization(tenant: Optional[str], bot_config: Dict[str, Any], trace_id: str) -> Optional[Dict[str, Any]]:
+    """تجميع التخصيص خارج حلقة الأحداث؛ الفشل لا يوقف التدريب"""
+    import asyncio
+    try:
+        return await asyncio.to_thread(specialization_compiler.get_or_compile, tenant, bot_config)
+    except Exception as e:
+        logger.warning(f"⚠️ Specialization compile skipped [trace_id={trace_id}]: {e}")
+        return None
+
 @app.post("/academy/train", response_model=BotTrainingResponse)
 async def academy_train(request: BotTrainingRequest):
     """
@@ -622,27 +775,78 @@ async def academy_train(request: BotTrainingRequest):
     
     يستقبل إعدادات البوت وأمثلة محادثات، يرسلها لـ Gemini AI، يرجع خطة تدريب كاملة.
     """
+    import asyncio
     start_time = time.time()
     trace_id = request.trace_id or str(uuid.uuid4())
+    request_profiler.bind_trace_id(trace_id)
     
     bot_name = request.bot_config.get('name', 'Unknown Bot')
+    tenant = _validated_tenant(request.tenant or request.bot_config.get('tenant'), trace_id)
     logger.info(f"🎓 New training request [trace_id={trace_id}]")
     logger.info(f"   Bot: {bot_name}")
     logger.info(f"   Config: {request.bot_config.get('type', 'unknown type')}")
     
     try:
-        training_plan = await trainer.generate_training_plan(
-            bot_config=request.bot_config,
-            sample_conversations=request.sample_conversations,
-            trace_id=trace_id
-        )
+        specialization = await _compile_specialization(tenant, request.bot_config, trace_id)
+        bot_config = request.bot_config
+        if specialization:
+            bot_config = {
+                **request.bot_config,
+                "compiled_specialization": {
+                    "system_prompt": specialization["prompt_templates"]["system"],
+                    "capability_schema": specialization["capability_schema"],
+                    "validation_rules": specialization["validation_rules"]
+                }
+            }
+        
+        request_profiler.mark_stage("specialization_ready")
+        async with tenant_scheduler.slot(tenant, endpoint="train"):
+            request_profiler.mark_stage("llm_call")
+            training_plan = await _llm_call(
+                "train",
+                lambda: trainer.generate_training_plan(
+                    bot_config=bot_config,
+                    sample_conversations=request.sample_conversations,
+                    trace_id=trace_id
+                ),
+                lambda: backup_trainer.generate_training_plan(
+                    bot_config=bot_config,
+                    sample_conversations=request.sample_conversations,
+                    trace_id=trace_id
+                )
+            )
         
         processing_time = int((time.time() - start_time) * 1000)
         
+        request_profiler.mark_stage("llm_done")
         logger.info(f"✅ Successfully generated training plan [trace_id={trace_id}] in {processing_time}ms")
         
         num_steps = len(training_plan.get('training_steps', []))
         
+        if request.bot_config.get('type') == "customer_support":
+            fast_path_name = training_plan.get('bot_name', bot_name)
+            archive_faqs = await asyncio.to_thread(load_archive_faqs, get_packed_archive(), tenant, fast_path_name)
+            config_faqs = request.bot_config.get('faqs')
+            fast_path = await asyncio.to_thread(
+                support_fast_path.build_for_bot,
+                tenant=tenant,
+                bot_name=fast_path_name,
+                sample_conversations=request.sample_conversations,
+                faqs=(config_faqs if isinstance(config_faqs, list) else []) + archive_faqs,
+                system_prompt=specialization["prompt_templates"]["system"] if specialization else None
+            )
+            training_plan["fast_path"] = {
+                "entries": len(fast_path.entries),
+                "archive_faqs": len(archive_faqs),
+                "threshold": fast_path.threshold
+            }
+        if specialization:
+            training_plan["specialization"] = {
+                "config_hash": specialization["config_hash"],
+                "version": specialization["version"],
+                "system_prompt": specialization["prompt_templates"]["system"]
+            }
+        
         return BotTrainingResponse(
             status="success",
             training_plan=training_plan,
@@ -651,6 +855,8 @@ async def academy_train(request: BotTrainingRequest):
             message=f"تم إنشاء خطة تدريب كاملة تحتوي على {num_steps} خطوات للبوت: {training_plan.get('bot_name', bot_name)}"
         )
         
+    except AdmissionRejected as e:
+        raise _admission_rejected_error(e, trace_id, start_time)
     except Exception as e:
         processing_time = int((time.time() - start_time) * 1000)
         logger.error(f"❌ Failed to generate training plan [trace_id={trace_id}]: {e}")
@@ -665,6 +871,273 @@ async def academy_train(request: BotTrainingRequest):
             }
         )
 
+@app.post("/academy/support/answer")
+async def academy_support_answer(request: SupportAnswerRequest):
+    """
+    ⚡ الإجابة على استفسار عميل من المسار السريع
+    
+    يطابق السؤال مع فهرس الأسئلة القياسية المبني أثناء التدريب. تحت عتبة الثقة يوجَّه
+    السؤال إلى نموذج مدرب خدمة العملاء؛ وإذا لم يتوفر النموذج يرجع `fallback_required`.
+    """
+    import asyncio
+    
+    trace_id = request.trace_id or str(uuid.uuid4())
+    tenant = _validated_tenant(request.tenant, trace_id)
+    fast_path = await asyncio.to_thread(support_fast_path.get, tenant, request.bot_name)
+    if fast_path is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "fast_path_not_found",
+                "message": f"No fast path index for bot: {request.bot_name} (tenant: {tenant})",
+                "trace_id": trace_id
+            }
+        )
+    
+    primary = llm_fallback_from_trainer(trainer, fast_path.system_prompt)
+    backup = llm_fallback_from_trainer(backup_trainer, fast_path.system_prompt) or primary
+    llm_fallback = None
+    if primary is None:
+        logger.warning(f"⚠️ Support trainer exposes no model; fast path misses are not answered [trace_id={trace_id}]")
+    else:
+        async def llm_fallback(query: str) -> str:
+            async with tenant_scheduler.slot(tenant, endpoint="support_answer"):
+                return await _llm_call("support_answer", lambda: primary(query), lambda: backup(query))
+    
+    try:
+        result = await fast_path.respond(request.query, llm_fallback=llm_fallback)
+    except AdmissionRejected as e:
+        raise _admission_rejected_error(e, trace_id, time.time())
+    except Exception as e:
+        logger.error(f"❌ Support LLM fallback failed [trace_id={trace_id}]: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail={"error": "support_answer_failed", "message": str(e), "trace_id": trace_id}
+        )
+    logger.info(f"⚡ Support answer [trace_id={trace_id}] source={result['source']}")
+    return {**result, "trace_id": trace_id}
+
+@app.get("/academy/support/fast_path/stats")
+async def academy_support_fast_path_stats():
+    """📊 إحصائيات المسار السريع: نسبة الإصابة وزمن الاستجابة لكل بوت"""
+    return support_fast_path.get_stats()
+
+@app.get("/academy/hedging/metrics")
+async def academy_hedging_metrics():
+    """🔀 مقاييس التحوط: نسبة الطلبات الاحتياطية ونسبة فوزها"""
+    return {"enabled": LLM_HEDGING_ENABLED, **hedged_executor.get_metrics()}
+
+@app.get("/academy/scheduler/metrics")
+async def academy_scheduler_metrics():
+    """🚦 مقاييس الطوابير لكل مستأجر: الانتظار، التنفيذ، والرفض"""
+    return tenant_scheduler.get_metrics()
+
+@app.get("/academy/specializations/{tenant}/{bot_type}")
+async def academy_specialization_versions(tenant: str, bot_type: str):
+    """🧩 قائمة إصدارات التخصيص المُجمَّعة لمستأجر ونوع بوت"""
+    import asyncio
+    try:
+        versions = await asyncio.to_thread(specialization_compiler.list_versions, tenant, bot_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": "invalid_specialization_path", "message": str(e)})
+    return {
+        "tenant": tenant,
+        "bot_type": bot_type,
+        "versions": versions,
+        "stats": specialization_compiler.get_stats()
+    }
+
+@app.get("/core/list")
+async def core_list(prefix: str = "", offset: int = 0, limit: int = 100):
+    """📂 قائمة ملفات الأرشيف من الفهرس المضغوط (بدون المرور على المجلد)"""
+    return get_packed_archive().list_files(prefix=prefix, offset=offset, limit=min(limit, 1000))
+
+@app.get("/core/stats")
+async def core_stats():
+    """📊 إحصائيات الأرشيف من الكتالوج المحدّث باستمرار"""
+    return get_packed_archive().get_stats()
+
+@app.post("/core/pack_archive")
+async def core_pack_archive(request: Request):
+    """
+    📦 مزامنة مجلد الأرشيف المُعدّ (ARCHIVE_DIR) مع المخزن المضغوط فوراً
+    
+    تتم المزامنة تلقائياً كل PACKED_ARCHIVE_SYNC_INTERVAL ثانية؛ هذه النقطة للإدارة فقط.
+    """
+    import asyncio
+    
+    _require_admin(request)
+    if not os.path.isdir(ARCHIVE_DIR):
+        raise HTTPException(status_code=404, detail={"error": "directory_not_found", "message": "ARCHIVE_DIR does not exist"})
+    
+    result = await asyncio.to_thread(get_packed_archive().sync_directory, ARCHIVE_DIR)
+    return {"status": "success", **result, "stats": get_packed_archive().get_stats()}
+
+async def _semantic_search_results(query: str, top_k: int) -> list:
+    """نتائج البحث الدلالي بصيغة قائمة قواميس لدمجها في البحث الهجين"""
+    engine = get_search_engine()
+    results = await engine.search(query, top_k=top_k)
+    return results.get("results", []) if isinstance(results, dict) else results
+
+@app.post("/core/hybrid_search")
+async def core_hybrid_search(request: HybridSearchRequest):
+    """
+    🔍 بحث هجين: كلمات مفتاحية (BM25) + بحث دلالي في طلب واحد
+    
+    يدمج النتائج بطريقة Reciprocal Rank Fusion مع إعادة ترتيب اختيارية لأفضل النتائج.
+    """
+    start_time = time.time()
+    result = await get_hybrid_search_engine().search(
+        query=request.query,
+        top_k=request.top_k,
+        vector_search=_semantic_search_results if request.use_semantic else None,
+        rerank=request.rerank,
+        rerank_top_k=request.rerank_top_k
+    )
+    result["processing_time_ms"] = int((time.time() - start_time) * 1000)
+    return result
+
+@app.post("/core/hybrid_search/index")
+async def core_hybrid_search_index(request: HybridIndexRequest, http_request: Request):
+    """
+    📥 فهرسة مستندات في البحث الهجين (تحديث تدريجي)
+    
+    للإدارة فقط (X-Admin-Key)؛ حتى 500 مستند في الطلب و100 ألف حرف لكل مستند.
+    """
+    import asyncio
+    
+    _require_admin(http_request)
+    engine = get_hybrid_search_engine()
+    indexed = await asyncio.to_thread(engine.index_documents, [doc.model_dump() for doc in request.documents])
+    return {"status": "success", "indexed": indexed, "stats": await asyncio.to_thread(engine.get_stats)}
+
+@app.post("/core/hybrid_search/reindex")
+async def core_hybrid_search_reindex(request: Request):
+    """
+    🔁 إعادة فهرسة الملفات النصية في الأرشيف المضغوط داخل البحث الهجين
+    
+    الملفات الجديدة تُفهرس تلقائياً أثناء مزامنة الأرشيف؛ هذه النقطة للإدارة فقط.
+    """
+    import asyncio
+    
+    _require_admin(request)
+    engine = get_hybrid_search_engine()
+    indexed = await asyncio.to_thread(engine.reindex_archive, get_packed_archive())
+    return {"status": "success", "indexed": indexed, "stats": await asyncio.to_thread(engine.get_stats)}
+
+@app.get("/integrations/webhook/{provider}", response_class=PlainTextResponse)
+async def integrations_webhook_verify(provider: str, request: Request):
+    """
+    🔑 تأكيد تسجيل الويب هوك (WhatsApp hub.challenge)
+    
+    يعيد hub.challenge كما هو عندما يطابق hub.verify_token قيمة WHATSAPP_VERIFY_TOKEN.
+    """
+    challenge = verify_subscription(provider, request.query_params)
+    if challenge is None:
+        logger.warning(f"🔒 Rejected {provider} webhook verification request")
+        raise HTTPException(status_code=403, detail={"error": "verification_failed", "provider": provider})
+    return PlainTextResponse(challenge)
+
+@app.post("/integrations/webhook/{provider}")
+async def integrations_webhook(provider: str, request: Request):
+    """
+    📨 استقبال ويب هوك الرسائل (WhatsApp / Telegram / عام)
+    
+    يرد بعد حفظ الرسائل في سجل مشترك بين العمليات (fsync)؛ المعالجة تتم في الخلفية
+    بترتيب كل محادثة. الرسائل المكررة من إعادة الإرسال تُتجاهل حسب معرف الرسالة
+    عبر كل العمليات. يتم التحقق من توقيع المزود أو السر المشترك قبل قراءة الحمولة.
+    """
+    import json
+    import asyncio
+    
+    raw_body = await request.body()
+    if not verify_webhook(provider, request.headers, raw_body):
+        logger.warning(f"🔒 Rejected {provider} webhook with missing or invalid signature")
+        raise HTTPException(status_code=401, detail={"error": "invalid_signature", "provider": provider})
+    
+    if inbound_pipeline.handler is None:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unavailable", "message": "messaging_hub is not connected to the inbound pipeline"},
+            headers={"Retry-After": "60"}
+        )
+    
+    try:
+        messages = parse_webhook(provider, json.loads(raw_body))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": "invalid_payload", "message": str(e)})
+    
+    results = await asyncio.to_thread(inbound_pipeline.accept, messages)
+    if "rejected" in results:
+        logger.warning(f"📨 Inbound pipeline full, asking {provider} to redeliver")
+        return JSONResponse(
+            status_code=503,
+            content={"status": "overloaded", "queued": results.count("queued")},
+            headers={"Retry-After": "5"}
+        )
+    
+    return {
+        "status": "accepted",
+        "queued": results.count("queued"),
+        "duplicates": results.count("duplicate")
+    }
+
+@app.get("/integrations/pipeline/stats")
+async def integrations_pipeline_stats():
+    """📊 إحصائيات خط الرسائل الواردة والصادرة"""
+    return {"inbound": inbound_pipeline.get_stats(), "outbound": outbound_batcher.get_stats()}
+
+def _require_admin(request: Request) -> None:
+    """التحقق من مفتاح الإدارة - نقاط الإدارة مغلقة ما لم يتم تعيين ADMIN_API_KEY"""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=403, detail={"error": "admin_disabled", "message": "ADMIN_API_KEY is not configured"})
+    provided = request.headers.get("X-Admin-Key", "")
+    if not hmac.compare_digest(provided.encode("utf-8"), admin_key.encode("utf-8")):
+        raise HTTPException(status_code=403, detail={"error": "forbidden", "message": "Invalid admin key"})
+
+@app.post("/admin/profile", response_class=PlainTextResponse)
+async def admin_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0):
+    """
+    🔥 تشغيل المُحلل الإحصائي لجميع الخيوط وحلقة الأحداث لمدة N ثانية
+    
+    يرجع النتيجة بصيغة collapsed stacks المتوافقة مع flamegraph.pl و speedscope.
+    """
+    import asyncio
+    
+    _require_admin(request)
+    try:
+        result = await asyncio.to_thread(request_profiler.sampler.profile, seconds, interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail={"error": "profiling_in_progress", "message": str(e)})
+    
+    return PlainTextResponse(
+        result["collapsed"],
+        headers={"X-Profile-Samples": str(result["samples"]), "X-Profile-Duration": str(result["duration_seconds"])}
+    )
+
+@app.get("/admin/slow_requests")
+async def admin_slow_requests(request: Request, limit: int = 50):
+    """🐢 آخر الطلبات التي تجاوزت حد البطء (من جميع العمليات)"""
+    import asyncio
+    
+    _require_admin(request)
+    return {
+        "threshold_ms": request_profiler.slow_threshold_ms,
+        "requests": await asyncio.to_thread(request_profiler.list_slow_requests, limit)
+    }
+
+@app.get("/admin/slow_requests/{trace_id}")
+async def admin_slow_request(request: Request, trace_id: str):
+    """🐢 الخط الزمني وعينات المكدس لطلب بطيء حسب trace_id"""
+    import asyncio
+    
+    _require_admin(request)
+    timeline = await asyncio.to_thread(request_profiler.get_slow_request, trace_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail={"error": "trace_not_found", "trace_id": trace_id})
+    return timeline
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
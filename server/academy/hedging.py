@@ -0,0 +1,270 @@
+"""
+Hedging - طلبات احتياطية لتقليل زمن الذيل
+When a primary LLM call runs past a dynamically tracked latency percentile,
+a backup request is issued to a secondary region or model. The first success
+wins, the loser is cancelled, and a token budget caps the extra load.
+"""
+import os
+import copy
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Any, Optional, Callable, Awaitable, TypeVar
+
+from loguru import logger
+
+
+T = TypeVar("T")
+# (primary_client, location) -> backup client in that location
+BackupFactory = Callable[[Any, str], Any]
+
+
+class LatencyTracker:
+    """نافذة منزلقة لأزمنة الاستجابة لحساب النسب المئوية"""
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, latency_ms: float) -> None:
+        self._samples.append(latency_ms)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class HedgedExecutor:
+    """
+    منفذ الطلبات المتحوطة
+
+    Every request earns budget_ratio hedge tokens (capped at max_tokens) and
+    each backup request spends one, so hedges stay at or below budget_ratio
+    of traffic over time.
+
+    The tracker only sees primary latencies. When the backup wins or the
+    primary is cancelled, the primary's elapsed time is recorded as a
+    censored sample (its true latency is at least that), so slow primaries
+    keep the hedge delay honest instead of dropping out of the window.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget_ratio: float = 0.1,
+        max_tokens: float = 10.0,
+        default_delay_ms: float = 5000.0,
+        min_delay_ms: float = 50.0,
+        window: int = 500,
+        min_samples: int = 20
+    ):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.max_tokens = max_tokens
+        self.default_delay_ms = default_delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.window = window
+        self.min_samples = min_samples
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self._tokens = max_tokens
+        self._backup_factories: Dict[str, BackupFactory] = {}
+        self.backup_clients: Dict[str, Dict[str, Any]] = {}
+        self.stats = {
+            "requests": 0, "hedged": 0, "backup_wins": 0, "primary_wins": 0,
+            "failovers": 0, "budget_exhausted": 0, "losers_cancelled": 0, "failures": 0,
+            "censored_samples": 0,
+        }
+
+    def _tracker(self, name: str) -> LatencyTracker:
+        if name not in self.trackers:
+            self.trackers[name] = LatencyTracker(window=self.window, min_samples=self.min_samples)
+        return self.trackers[name]
+
+    def hedge_delay_ms(self, name: str = "default") -> float:
+        """المهلة قبل إطلاق الطلب الاحتياطي (النسبة المئوية المتتبعة)"""
+        observed = self._tracker(name).percentile(self.percentile)
+        return max(self.min_delay_ms, observed if observed is not None else self.default_delay_ms)
+
+    def _take_token(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        self.stats["budget_exhausted"] += 1
+        return False
+
+    async def call(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        backup: Callable[[], Awaitable[T]],
+        name: str = "default"
+    ) -> T:
+        """
+        تنفيذ طلب مع تحوط
+
+        Args:
+            primary: استدعاء المنطقة/النموذج الأساسي
+            backup: استدعاء المنطقة/النموذج الاحتياطي
+            name: اسم العملية لتتبع أزمنتها بشكل منفصل
+
+        Returns:
+            نتيجة أول استدعاء ناجح
+        """
+        self.stats["requests"] += 1
+        self._tokens = min(self.max_tokens, self._tokens + self.budget_ratio)
+        tracker = self._tracker(name)
+        started = time.perf_counter()
+        primary_task = asyncio.ensure_future(primary())
+        tasks = {primary_task: "primary"}
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay_ms(name) / 1000)
+            if done:
+                if primary_task.exception() is None:
+                    tracker.record((time.perf_counter() - started) * 1000)
+                    self.stats["primary_wins"] += 1
+                    return primary_task.result()
+                if not self._take_token():
+                    self.stats["failures"] += 1
+                    return primary_task.result()
+                self.stats["failovers"] += 1
+                logger.warning(f"🔀 Primary {name} failed, failing over to backup: {primary_task.exception()}")
+            elif not self._take_token():
+                result = await primary_task
+                tracker.record((time.perf_counter() - started) * 1000)
+                self.stats["primary_wins"] += 1
+                return result
+            else:
+                self.stats["hedged"] += 1
+
+            tasks[asyncio.ensure_future(backup())] = "backup"
+            pending = {t for t in tasks if not t.done()}
+            last_error: Optional[BaseException] = primary_task.exception() if primary_task.done() else None
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if tasks[task] == "primary":
+                        tracker.record((time.perf_counter() - started) * 1000)
+                        self.stats["primary_wins"] += 1
+                    else:
+                        self.stats["backup_wins"] += 1
+                    return task.result()
+
+            self.stats["failures"] += 1
+            raise last_error
+        finally:
+            if not primary_task.done():
+                # عينة مقطوعة: زمن الأساسي الحقيقي لا يقل عن الزمن المنقضي
+                tracker.record((time.perf_counter() - started) * 1000)
+                self.stats["censored_samples"] += 1
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    self.stats["losers_cancelled"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        requests = self.stats["requests"]
+        hedged = self.stats["hedged"]
+        return {
+            **self.stats,
+            "hedge_rate": round(hedged / requests, 4) if requests else 0.0,
+            "backup_win_rate": round(self.stats["backup_wins"] / hedged, 4) if hedged else 0.0,
+            "budget_tokens": round(self._tokens, 2),
+            "hedge_delay_ms": {name: round(self.hedge_delay_ms(name), 1) for name in self.trackers},
+            "backup_clients": self.backup_clients,
+        }
+
+    # ------------------------------------------------------- backup clients
+
+    def register_backup_factory(self, name: str, factory: BackupFactory) -> None:
+        """تسجيل طريقة إنشاء العميل الاحتياطي لعميل مسمى"""
+        self._backup_factories[name] = factory
+
+    def backup_client(self, name: str, primary: Any, location: Optional[str] = None) -> Any:
+        """
+        إنشاء عميل احتياطي في منطقة ثانوية عبر المصنع المسجل
+
+        Returns the primary client when GCP_HEDGE_LOCATION is unset, no factory
+        is registered for name, or the factory fails. Hedges then duplicate
+        load on the same endpoint, so this is logged as an error and shown as
+        same_region in get_metrics()["backup_clients"].
+        """
+        location = location or os.getenv("GCP_HEDGE_LOCATION")
+        factory = self._backup_factories.get(name)
+        reason = None
+        backup = primary
+        if not location:
+            reason = "GCP_HEDGE_LOCATION is not set"
+        elif factory is None:
+            reason = f"no backup factory registered for {name}"
+        else:
+            try:
+                backup = factory(primary, location)
+            except Exception as e:
+                reason = f"backup factory failed: {e}"
+
+        if reason:
+            logger.error(
+                f"🚨 Hedge backup for {name} uses the PRIMARY region ({reason}); "
+                f"hedged requests will duplicate load on the same endpoint"
+            )
+            self.backup_clients[name] = {"location": None, "same_region": True, "reason": reason}
+            return primary
+
+        logger.info(f"🔀 Hedge backup client for {name} ready in {location}")
+        self.backup_clients[name] = {"location": location, "same_region": False}
+        return backup
+
+
+def vertex_regional_client(primary: Any, location: str) -> Any:
+    """
+    نسخة من العميل تستخدم نماذج Vertex في منطقة أخرى (دون vertexai.init)
+
+    Shallow-copies primary and replaces every GenerativeModel attribute with
+    a twin addressed by its full resource name,
+    projects/<project>/locations/<location>/publishers/..., carrying the
+    same generation config, safety settings, tools and system instruction.
+    The SDK derives the model's location from that name and opens its
+    prediction clients on <location>-aiplatform.googleapis.com, so the
+    process-wide vertexai configuration is left alone.
+
+    Raises (and the executor falls back to the primary region, loudly) when
+    the SDK is missing, no project is known, the client holds no
+    GenerativeModel attribute, or a model is a region-bound tuned endpoint.
+    """
+    from vertexai.generative_models import GenerativeModel
+    from google.cloud.aiplatform import initializer
+
+    project = os.getenv("GCP_PROJECT") or initializer.global_config.project
+    backup = copy.copy(primary)
+    rebound = []
+    for attr, model in vars(primary).items():
+        if not isinstance(model, GenerativeModel):
+            continue
+        publisher_path = model._model_name[model._model_name.find("publishers/"):]
+        if not publisher_path.startswith("publishers/"):
+            raise ValueError(f"{type(primary).__name__}.{attr} is a region-bound endpoint ({model._model_name})")
+        setattr(backup, attr, GenerativeModel(
+            f"projects/{project}/locations/{location}/{publisher_path}",
+            generation_config=model._generation_config,
+            safety_settings=model._safety_settings,
+            tools=model._tools,
+            tool_config=model._tool_config,
+            system_instruction=model._system_instruction,
+            labels=model._labels,
+        ))
+        rebound.append(attr)
+    if not rebound:
+        raise TypeError(f"{type(primary).__name__} holds no GenerativeModel attribute to move to {location}")
+    return backup
+
+
+hedged_executor = HedgedExecutor(
+    percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+    budget_ratio=float(os.getenv("LLM_HEDGE_BUDGET_RATIO", "0.1"))
+)
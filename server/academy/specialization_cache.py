@@ -0,0 +1,334 @@
+"""
+Specialization Cache - ذاكرة التخصيص المُجمَّعة
+Compiles per-tenant bot specializations (prompt templates, capability schemas,
+validation rules) once, keyed by a hash of the inputs, and stores them on disk
+as versioned, diffable JSON artifacts.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import quote
+
+from loguru import logger
+
+
+COMPILER_VERSION = "1"
+
+LANGUAGE_INSTRUCTIONS = {
+    "arabic": "أجب دائماً باللغة العربية الفصحى الواضحة.",
+    "english": "Always answer in clear English.",
+    "dutch": "Antwoord altijd in duidelijk Nederlands.",
+}
+
+TONE_INSTRUCTIONS = {
+    "formal": "استخدم أسلوباً رسمياً ومهذباً.",
+    "friendly": "استخدم أسلوباً ودوداً وبسيطاً.",
+    "friendly_professional": "استخدم أسلوباً ودوداً مع الحفاظ على الاحترافية.",
+}
+
+# مؤشرات الأداء التي تعني "كلما قلّ كان أفضل"
+LOWER_IS_BETTER_KPIS = {"response_time", "response_time_seconds", "latency_ms", "error_rate"}
+
+
+# أطول اسم مجلد قبل اختصاره ببصمة (حد أنظمة الملفات 255 بايت)
+MAX_DIR_NAME_LENGTH = 120
+
+
+def _dir_name(value: str) -> str:
+    """
+    اسم مجلد فريد لكل قيمة؛ يرفض '.' و'..' وأي مقطع من النقاط فقط
+
+    Percent-encodes everything except ASCII letters, digits, "_" and "-"
+    (so "a/b" -> "a%2Fb" while "a_b" stays "a_b"); the encoding is
+    reversible with urllib.parse.unquote, so distinct values never share a
+    directory. Names longer than MAX_DIR_NAME_LENGTH keep a readable prefix
+    and end in "~" plus a sha256 prefix; "~" never appears in an encoded
+    name, so the two forms cannot collide either.
+    """
+    value = str(value)
+    if not value.strip("."):
+        raise ValueError(f"Invalid path segment: {value!r}")
+    name = quote(value, safe="").replace(".", "%2E").replace("~", "%7E")
+    if len(name) > MAX_DIR_NAME_LENGTH:
+        name = f"{name[:MAX_DIR_NAME_LENGTH - 33]}~{hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]}"
+    return name
+
+
+def normalize_bot_config(bot_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    توحيد شكل الإعدادات قبل التجميع
+
+    BotTrainingRequest.bot_config is free-form; capabilities may arrive as a
+    string or a list of non-strings and kpis as a list, so coerce them into
+    the shapes the renderers expect instead of failing the training request.
+    """
+    config = dict(bot_config)
+    capabilities = config.get("capabilities") or []
+    if isinstance(capabilities, (str, int, float)):
+        capabilities = [capabilities]
+    elif isinstance(capabilities, dict):
+        capabilities = list(capabilities)
+    elif not isinstance(capabilities, (list, tuple, set)):
+        capabilities = []
+    config["capabilities"] = [str(c) for c in capabilities if c is not None and not isinstance(c, (dict, list))]
+
+    kpis = config.get("kpis") or {}
+    if isinstance(kpis, list):
+        kpis = {
+            str(k.get("metric", k.get("name"))): k.get("target", k.get("threshold"))
+            for k in kpis
+            if isinstance(k, dict) and (k.get("metric") or k.get("name"))
+        }
+    elif not isinstance(kpis, dict):
+        kpis = {}
+    config["kpis"] = kpis
+
+    for key in ("name", "type", "language", "tone", "specialization"):
+        if config.get(key) is not None and not isinstance(config[key], str):
+            config[key] = str(config[key])
+    return config
+
+
+def config_hash(tenant: str, bot_config: Dict[str, Any]) -> str:
+    """بصمة ثابتة لمدخلات التخصيص"""
+    payload = json.dumps(
+        {"tenant": tenant, "bot_config": bot_config, "compiler_version": COMPILER_VERSION},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def render_prompt_templates(bot_config: Dict[str, Any]) -> Dict[str, str]:
+    """توليد قوالب التعليمات النظامية من إعدادات البوت"""
+    name = bot_config.get("name", "bot")
+    bot_type = bot_config.get("type", "generic")
+    language = bot_config.get("language", "arabic")
+    tone = bot_config.get("tone", "formal")
+    capabilities = bot_config.get("capabilities", [])
+    specialization = bot_config.get("specialization")
+
+    lines = [f"أنت {name}، بوت من نوع {bot_type}" + (f" متخصص في {specialization}." if specialization else ".")]
+    lines.append(LANGUAGE_INSTRUCTIONS.get(language, f"Always answer in {language}."))
+    lines.append(TONE_INSTRUCTIONS.get(tone, f"Use a {tone} tone."))
+    if capabilities:
+        lines.append("القدرات المسموح بها: " + "، ".join(capabilities) + ".")
+        lines.append("إذا كان الطلب خارج هذه القدرات، اعتذر واقترح التصعيد إلى موظف بشري.")
+
+    return {
+        "system": "\n".join(lines),
+        "user": "{message}",
+        "escalation": "سأحوّل طلبك الآن إلى أحد موظفينا. رقم التذكرة: {ticket_id}" if "escalation" in capabilities else "",
+    }
+
+
+def build_capability_schema(bot_config: Dict[str, Any]) -> Dict[str, Any]:
+    """مخطط JSON لإجراءات البوت المسموح بها"""
+    capabilities = sorted(set(bot_config.get("capabilities", [])))
+    return {
+        "type": "object",
+        "required": ["capability", "response"],
+        "properties": {
+            "capability": {"type": "string", "enum": capabilities},
+            "response": {"type": "string", "minLength": 1},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        },
+        "additionalProperties": False,
+    }
+
+
+def build_validation_rules(bot_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """قواعد التحقق المشتقة من مؤشرات الأداء واللغة"""
+    rules = []
+    for metric, target in sorted(bot_config.get("kpis", {}).items()):
+        if not isinstance(target, (int, float)):
+            continue
+        operator = "<=" if metric in LOWER_IS_BETTER_KPIS else ">="
+        rules.append({"metric": metric, "operator": operator, "threshold": target})
+    if bot_config.get("language"):
+        rules.append({"metric": "response_language", "operator": "==", "threshold": bot_config["language"]})
+    return rules
+
+
+class SpecializationCompiler:
+    """
+    مُجمِّع التخصيصات لكل مستأجر ونوع بوت
+
+    Artifacts live at <storage_dir>/<tenant>/<bot_type>/<config_hash>.json with
+    a manifest.json mapping each hash to a sequential version (directory
+    names encoded by _dir_name). Compiled artifacts are kept in a bounded
+    LRU of max_cached entries; disk work is serialized per (tenant,
+    bot_type), so one slow tenant does not hold up the others.
+    """
+
+    def __init__(self, storage_dir: Optional[str] = None, max_cached: Optional[int] = None):
+        self.storage_dir = storage_dir or os.getenv("SPECIALIZATION_CACHE_DIR", "data/specializations")
+        self.max_cached = max_cached or int(os.getenv("SPECIALIZATION_CACHE_SIZE", "1024"))
+        self._cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # (tenant, bot_type) -> [lock, عدد المستخدمين]؛ يُحذف عند انتهاء آخر مستخدم
+        self._key_locks: Dict[Tuple[str, str], List[Any]] = {}
+        self.stats = {"hits": 0, "disk_hits": 0, "compilations": 0}
+        self.evictions = 0
+
+    def _bot_dir(self, tenant: str, bot_type: str) -> str:
+        root = os.path.realpath(self.storage_dir)
+        bot_dir = os.path.realpath(os.path.join(root, _dir_name(tenant), _dir_name(bot_type)))
+        if os.path.commonpath([root, bot_dir]) != root:
+            raise ValueError(f"Specialization path escapes storage dir: {tenant}/{bot_type}")
+        return bot_dir
+
+    @contextmanager
+    def _dir_lock(self, bot_dir: str):
+        """قفل ملف لكل مجلد حتى لا يتسابق العمّال على manifest.json"""
+        os.makedirs(bot_dir, exist_ok=True)
+        with open(os.path.join(bot_dir, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _key_lock(self, tenant: str, bot_type: str):
+        """قفل لكل (مستأجر، نوع بوت) داخل العملية"""
+        key = (tenant, bot_type)
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def _cache_get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            artifact = self._cache.get(key)
+            if artifact is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+            return artifact
+
+    def _cache_put(self, key: Tuple[str, str, str], artifact: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cache[key] = artifact
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def _read_manifest(self, bot_dir: str) -> Dict[str, Any]:
+        path = os.path.join(bot_dir, "manifest.json")
+        if not os.path.exists(path):
+            return {"versions": []}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_json(self, path: str, data: Dict[str, Any]) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def compile(self, tenant: str, bot_config: Dict[str, Any]) -> Dict[str, Any]:
+        """تجميع التخصيص دون النظر إلى الذاكرة المؤقتة"""
+        normalized = normalize_bot_config(bot_config)
+        return {
+            "tenant": tenant,
+            "bot_type": normalized.get("type") or "generic",
+            "bot_name": normalized.get("name"),
+            "config_hash": config_hash(tenant, bot_config),
+            "compiler_version": COMPILER_VERSION,
+            "inputs": bot_config,
+            "prompt_templates": render_prompt_templates(normalized),
+            "capability_schema": build_capability_schema(normalized),
+            "validation_rules": build_validation_rules(normalized),
+        }
+
+    def get_or_compile(self, tenant: Optional[str], bot_config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        إرجاع التخصيص المُجمَّع، مع إعادة البناء فقط عند تغيّر المدخلات
+
+        Args:
+            tenant: معرف المستأجر (default إذا لم يحدد)
+            bot_config: إعدادات البوت كما في BotTrainingRequest
+
+        Returns:
+            Dict: الأداة المُجمَّعة مع رقم الإصدار
+
+        Raises:
+            ValueError: إذا كان المستأجر أو نوع البوت مساراً غير صالح
+        """
+        tenant = str(tenant or "default")
+        bot_type = str(bot_config.get("type") or "generic")
+        digest = config_hash(tenant, bot_config)
+        key = (tenant, bot_type, digest)
+
+        artifact = self._cache_get(key)
+        if artifact is not None:
+            return artifact
+
+        bot_dir = self._bot_dir(tenant, bot_type)
+        artifact_path = os.path.join(bot_dir, f"{digest}.json")
+
+        with self._key_lock(tenant, bot_type):
+            # قد يكون خيط آخر جمّعها أثناء انتظار القفل
+            artifact = self._cache_get(key)
+            if artifact is not None:
+                return artifact
+
+            with self._dir_lock(bot_dir):
+                manifest = self._read_manifest(bot_dir)
+
+                if os.path.exists(artifact_path):
+                    with open(artifact_path, "r", encoding="utf-8") as f:
+                        artifact = json.load(f)
+                    stat = "disk_hits"
+                else:
+                    artifact = self.compile(tenant, bot_config)
+                    self._write_json(artifact_path, artifact)
+                    stat = "compilations"
+                    logger.info(f"🧩 Compiled specialization {tenant}/{bot_type} [{digest}]")
+
+                versions = {v["config_hash"]: v["version"] for v in manifest["versions"]}
+                if digest not in versions:
+                    versions[digest] = len(manifest["versions"]) + 1
+                    manifest["versions"].append({
+                        "version": versions[digest],
+                        "config_hash": digest,
+                        "compiled_at": time.time(),
+                    })
+                    self._write_json(os.path.join(bot_dir, "manifest.json"), manifest)
+
+            with self._lock:
+                self.stats[stat] += 1
+            artifact = {**artifact, "version": versions[digest]}
+            self._cache_put(key, artifact)
+            return artifact
+
+    def list_versions(self, tenant: str, bot_type: str) -> List[Dict[str, Any]]:
+        """قائمة الإصدارات المُجمَّعة لمستأجر ونوع بوت"""
+        return self._read_manifest(self._bot_dir(tenant, bot_type))["versions"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "cached_artifacts": len(self._cache),
+            "max_cached": self.max_cached,
+            "evictions": self.evictions,
+            "storage_dir": self.storage_dir,
+        }
+
+
+specialization_compiler = SpecializationCompiler()
@@ -0,0 +1,402 @@
+"""
+Support Fast Path - طبقة الإجابة السريعة لبوت خدمة العملاء
+Precomputed intent/FAQ index built at training time so that repetitive
+support queries (order tracking, returns, FAQ) are answered without an LLM call.
+"""
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import threading
+from collections import Counter, deque
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+
+from loguru import logger
+
+from server.core.arabic_text import normalize_arabic
+
+
+CUSTOMER_PREFIXES = ("العميل", "المستخدم", "customer", "user", "client")
+BOT_PREFIXES = ("البوت", "المساعد", "bot", "agent", "assistant")
+
+# أنماط الخانات القابلة للتعبئة في القوالب
+# رقم الطلب: بادئة ORD- أو رقم يسبقه ذكر الطلب مباشرة ("طلبي رقم 12345")، وليس أي رقم
+# (الأسعار والحدود والسنوات تبقى نصاً حرفياً)
+SLOT_PATTERNS: Dict[str, re.Pattern] = {
+    "email": re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"),
+    "order_number": re.compile(
+        r"\b(ORD-?\d{4,})\b|(?:طلب\w*|order)\s*(?:رقم|number|no\.?)?\s*[:#]?\s*(\d{4,})\b",
+        re.IGNORECASE
+    ),
+}
+
+# مسار الأسئلة الشائعة في الأرشيف المضغوط: faqs/<tenant>/[<bot_name>/]*.json
+FAQ_ARCHIVE_PREFIX = "faqs"
+
+
+def extract_slots(text: str) -> Dict[str, str]:
+    """استخراج قيم الخانات (رقم الطلب، البريد...) من النص"""
+    slots: Dict[str, str] = {}
+    remaining = text
+    for name, pattern in SLOT_PATTERNS.items():
+        match = pattern.search(remaining)
+        if match:
+            value = next((group for group in match.groups() if group), match.group(0))
+            slots[name] = value
+            remaining = remaining.replace(value, " ")
+    return slots
+
+
+def _literal_numbers(text: str) -> List[str]:
+    return sorted(re.findall(r"\d+", normalize_arabic(text)))
+
+
+def _templatize(text: str, slots: Dict[str, str]) -> str:
+    for name, value in slots.items():
+        text = text.replace(value, "{" + name + "}")
+    return text
+
+
+def _embed(text: str) -> Dict[str, float]:
+    """تضمين محلي خفيف: كلمات + مقاطع حرفية ثلاثية، مطبّع L2"""
+    normalized = normalize_arabic(text)
+    features: Counter = Counter()
+    for word in normalized.split():
+        features["w:" + word] += 2.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            features["c:" + padded[i:i + 3]] += 1.0
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {k: v / norm for k, v in features.items()}
+
+
+class SupportFastPath:
+    """
+    فهرس الأسئلة القياسية لبوت واحد
+
+    Holds canonical questions (with slot values replaced by placeholders),
+    their templated answers and per-entry confidence thresholds.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.82,
+        min_margin: float = 0.05,
+        latency_window: int = 1000,
+        system_prompt: Optional[str] = None
+    ):
+        self.threshold = threshold
+        self.min_margin = min_margin
+        self.system_prompt = system_prompt
+        self.entries: List[Dict[str, Any]] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._latencies_ms: deque = deque(maxlen=latency_window)
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0}
+
+    def add_entry(
+        self,
+        question: str,
+        answer: str,
+        source: str = "faq",
+        threshold: Optional[float] = None
+    ) -> None:
+        """
+        إضافة سؤال قياسي وإجابته إلى الفهرس
+
+        A slot becomes a placeholder only when the same value appears in both
+        the question and the answer. Any other number stays literal, and a
+        query only matches the entry if it contains exactly those numbers.
+        """
+        slots = {name: value for name, value in extract_slots(question).items() if value in answer}
+        canonical = _templatize(question, slots)
+        template = _templatize(answer, slots)
+        vector = _embed(canonical)
+        entry_id = len(self.entries)
+        self.entries.append({
+            "question": canonical,
+            "answer_template": template,
+            "required_slots": sorted(re.findall(r"{(\w+)}", template)),
+            "literal_numbers": _literal_numbers(canonical),
+            "threshold": threshold if threshold is not None else self.threshold,
+            "source": source,
+            "vector": vector,
+        })
+        for feature in vector:
+            self._postings.setdefault(feature, []).append(entry_id)
+
+    @classmethod
+    def build(
+        cls,
+        sample_conversations: Optional[List[str]] = None,
+        faqs: Optional[List[Dict[str, Any]]] = None,
+        **kwargs: Any
+    ) -> "SupportFastPath":
+        """بناء الفهرس من أمثلة المحادثات والأسئلة الشائعة في الأرشيف"""
+        index = cls(**kwargs)
+        for question, answer in parse_conversation_pairs(sample_conversations or []):
+            index.add_entry(question, answer, source="sample_conversation")
+        for faq in faqs or []:
+            question, answer = faq.get("question"), faq.get("answer")
+            if question and answer:
+                index.add_entry(question, answer, source=faq.get("source", "faq"), threshold=faq.get("threshold"))
+        return index
+
+    def to_dict(self) -> Dict[str, Any]:
+        """تمثيل قابل للحفظ؛ المتجهات تعاد حسابها عند التحميل"""
+        return {
+            "threshold": self.threshold,
+            "min_margin": self.min_margin,
+            "system_prompt": self.system_prompt,
+            "entries": [
+                {key: entry[key] for key in ("question", "answer_template", "threshold", "source")}
+                for entry in self.entries
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SupportFastPath":
+        index = cls(
+            threshold=data.get("threshold", 0.82),
+            min_margin=data.get("min_margin", 0.05),
+            system_prompt=data.get("system_prompt")
+        )
+        for entry in data.get("entries", []):
+            index.add_entry(entry["question"], entry["answer_template"], source=entry.get("source", "faq"), threshold=entry.get("threshold"))
+        return index
+
+    def _rank(self, canonical_query: str) -> List[Tuple[float, int]]:
+        vector = _embed(canonical_query)
+        scores: Dict[int, float] = {}
+        for feature, weight in vector.items():
+            for entry_id in self._postings.get(feature, ()):
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * self.entries[entry_id]["vector"][feature]
+        return sorted(((score, entry_id) for entry_id, score in scores.items()), reverse=True)
+
+    def match(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        محاولة الإجابة من الفهرس
+
+        Returns the filled answer when the best match clears its threshold, is
+        not ambiguous with a different answer, every slot can be filled and
+        the query's remaining numbers equal the entry's literal numbers;
+        otherwise None so the caller falls back to the LLM.
+        """
+        start = time.perf_counter()
+        result = None
+        slots = extract_slots(query)
+        canonical_query = _templatize(query, slots)
+        ranked = self._rank(canonical_query)
+        if ranked:
+            score, entry_id = ranked[0]
+            entry = self.entries[entry_id]
+            ambiguous = any(
+                score - other_score < self.min_margin
+                and self.entries[other_id]["answer_template"] != entry["answer_template"]
+                for other_score, other_id in ranked[1:3]
+            )
+            if (
+                score >= entry["threshold"]
+                and not ambiguous
+                and all(s in slots for s in entry["required_slots"])
+                and _literal_numbers(canonical_query) == entry["literal_numbers"]
+            ):
+                result = {
+                    "answer": entry["answer_template"].format(**slots) if entry["required_slots"] else entry["answer_template"],
+                    "confidence": round(score, 4),
+                    "matched_question": entry["question"],
+                    "slots": slots,
+                    "source": entry["source"],
+                }
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self._latencies_ms.append(latency_ms)
+        self.stats["lookups"] += 1
+        self.stats["hits" if result else "misses"] += 1
+        if result:
+            result["latency_ms"] = round(latency_ms, 3)
+        return result
+
+    async def respond(
+        self,
+        query: str,
+        llm_fallback: Optional[Callable[[str], Awaitable[Any]]] = None
+    ) -> Dict[str, Any]:
+        """الإجابة من المسار السريع أو الرجوع إلى النموذج اللغوي تحت العتبة"""
+        hit = self.match(query)
+        if hit:
+            return {"status": "success", "source": "fast_path", **hit}
+        if llm_fallback is None:
+            return {"status": "fallback_required", "source": "llm"}
+        return {"status": "success", "source": "llm", "answer": await llm_fallback(query)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات نسبة الإصابة وزمن الاستجابة"""
+        latencies = sorted(self._latencies_ms)
+        lookups = self.stats["lookups"]
+        return {
+            "entries": len(self.entries),
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "avg_latency_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p95_latency_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else 0.0,
+        }
+
+
+def parse_conversation_pairs(sample_conversations: List[str]) -> List[Tuple[str, str]]:
+    """تحويل أسطر المحادثة (العميل: ... / البوت: ...) إلى أزواج سؤال/جواب"""
+    pairs = []
+    pending_question: Optional[str] = None
+    for line in sample_conversations:
+        speaker, sep, text = line.partition(":")
+        if not sep:
+            continue
+        speaker, text = speaker.strip().lower(), text.strip()
+        if speaker in CUSTOMER_PREFIXES:
+            pending_question = text
+        elif speaker in BOT_PREFIXES and pending_question:
+            pairs.append((pending_question, text))
+            pending_question = None
+    return pairs
+
+
+def load_archive_faqs(store: Any, tenant: str, bot_name: str) -> List[Dict[str, Any]]:
+    """
+    الأسئلة الشائعة المحفوظة في الأرشيف المضغوط للبوت
+
+    Reads every .json file under faqs/<tenant>/ (shared by the tenant's bots)
+    and faqs/<tenant>/<bot_name>/. A file holds a list of {question, answer}
+    objects or {"faqs": [...]}. Unreadable files are skipped with a warning.
+    """
+    faqs: List[Dict[str, Any]] = []
+    if "/" in tenant or "/" in bot_name:
+        # لا يمكن تمثيلها كمقطع واحد في مفتاح الأرشيف دون التداخل مع مستأجر آخر
+        return faqs
+    prefix = f"{FAQ_ARCHIVE_PREFIX}/{tenant}/"
+    offset = 0
+    while True:
+        page = store.list_files(prefix=prefix, offset=offset, limit=1000)
+        for item in page["files"]:
+            name = item["name"]
+            nested = name[len(prefix):]
+            if not name.endswith(".json") or ("/" in nested and not nested.startswith(f"{bot_name}/")):
+                continue
+            data = store.read(name)
+            if data is None:
+                continue
+            try:
+                content = json.loads(bytes(data).decode("utf-8"))
+            except (UnicodeDecodeError, ValueError) as e:
+                logger.warning(f"⚠️ Skipping unreadable FAQ file {name}: {e}")
+                continue
+            entries = content.get("faqs", []) if isinstance(content, dict) else content
+            if isinstance(entries, list):
+                faqs.extend(dict(entry, source="archive") for entry in entries if isinstance(entry, dict))
+        if page["count"] < 1000:
+            return faqs
+        offset += page["count"]
+
+
+def llm_fallback_from_trainer(
+    support_trainer: Any,
+    system_prompt: Optional[str] = None
+) -> Optional[Callable[[str], Awaitable[str]]]:
+    """
+    بناء دالة الرجوع إلى النموذج اللغوي من مدرب خدمة العملاء
+
+    Uses the trainer's Vertex AI model (``trainer.model.generate_content_async``)
+    with the bot's compiled system prompt. Returns None when the trainer does
+    not expose a model so the caller can report the missing fallback.
+    """
+    model = getattr(support_trainer, "model", None)
+    if model is None or not hasattr(model, "generate_content_async"):
+        return None
+
+    async def fallback(query: str) -> str:
+        prompt = f"{system_prompt}\n\n{query}" if system_prompt else query
+        response = await model.generate_content_async(prompt)
+        return response.text
+
+    return fallback
+
+
+class SupportFastPathRegistry:
+    """
+    سجل فهارس المسار السريع لكل بوت
+
+    Indexes are keyed by (tenant, bot_name), persisted as JSON under
+    storage_dir when built and loaded lazily on lookup, so every worker serves
+    bots trained by any other worker and indexes survive restarts. A changed
+    file mtime triggers a reload.
+    """
+
+    def __init__(self, storage_dir: Optional[str] = None):
+        self.storage_dir = storage_dir or os.getenv("SUPPORT_FAST_PATH_DIR", "data/fast_path")
+        self._indexes: Dict[Tuple[str, str], Tuple[float, SupportFastPath]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, tenant: str, bot_name: str) -> str:
+        digest = hashlib.sha256(f"{tenant}\0{bot_name}".encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.storage_dir, f"{digest}.json")
+
+    def build_for_bot(
+        self,
+        tenant: str,
+        bot_name: str,
+        sample_conversations: Optional[List[str]] = None,
+        faqs: Optional[List[Dict[str, Any]]] = None,
+        threshold: Optional[float] = None,
+        system_prompt: Optional[str] = None
+    ) -> SupportFastPath:
+        """بناء الفهرس وحفظه على القرص (عملية متزامنة تُستدعى خارج حلقة الأحداث)"""
+        kwargs: Dict[str, Any] = {"system_prompt": system_prompt}
+        if threshold is not None:
+            kwargs["threshold"] = threshold
+        index = SupportFastPath.build(sample_conversations, faqs, **kwargs)
+
+        path = self._path(tenant, bot_name)
+        os.makedirs(self.storage_dir, exist_ok=True)
+        # اسم مؤقت لكل خيط: عدة تدريبات لنفس البوت قد تكتب في نفس اللحظة
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"tenant": tenant, "bot_name": bot_name, "built_at": time.time(), **index.to_dict()}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._indexes[(tenant, bot_name)] = (os.stat(path).st_mtime, index)
+        logger.info(f"⚡ Fast path index built for {tenant}/{bot_name}: {len(index.entries)} entries")
+        return index
+
+    def get(self, tenant: str, bot_name: str) -> Optional[SupportFastPath]:
+        """الفهرس المحفوظ لبوت المستأجر، مع إعادة التحميل إذا بناه عامل آخر من جديد"""
+        key = (tenant, bot_name)
+        path = self._path(tenant, bot_name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            cached = self._indexes.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Failed to load fast path index for {tenant}/{bot_name}: {e}")
+            return cached[1] if cached else None
+        index = SupportFastPath.from_dict(data)
+        with self._lock:
+            self._indexes[key] = (mtime, index)
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            indexes = dict(self._indexes)
+        return {f"{tenant}/{name}": index.get_stats() for (tenant, name), (_, index) in indexes.items()}
+
+
+support_fast_path = SupportFastPathRegistry()
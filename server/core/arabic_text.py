@@ -0,0 +1,51 @@
+"""
+Arabic Text - تطبيع وتقطيع النصوص العربية
+Shared normalization and tokenization used by the search and fast-path indexes.
+"""
+import re
+from typing import List
+
+
+ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_ALEF_VARIANTS = re.compile("[آأإٱ]")
+_NON_WORD = re.compile(r"[^\w\s{}]+")
+_ARABIC_INDIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+
+# بادئات التعريف الشائعة (من الأطول إلى الأقصر)
+_DEFINITE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+STOPWORDS = {
+    "في", "من", "الي", "علي", "عن", "مع", "هذا", "هذه", "ذلك", "التي", "الذي", "ما", "هل", "او", "و", "ثم", "ان",
+    "the", "a", "an", "of", "to", "in", "on", "and", "or", "is", "are", "for", "with",
+}
+
+
+def normalize_arabic(text: str) -> str:
+    """
+    تطبيع النص العربي
+
+    Removes diacritics and tatweel, unifies alef/ya/ta-marbuta variants,
+    converts Arabic-Indic digits and lowercases Latin text.
+    """
+    text = ARABIC_DIACRITICS.sub("", text.lower())
+    text = _ALEF_VARIANTS.sub("ا", text)
+    text = text.replace("ى", "ي").replace("ة", "ه").replace("ؤ", "و").replace("ئ", "ي")
+    text = text.translate(_ARABIC_INDIC_DIGITS)
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def strip_definite_article(token: str) -> str:
+    for prefix in _DEFINITE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def tokenize(text: str, remove_stopwords: bool = True) -> List[str]:
+    """تقطيع النص إلى مصطلحات مطبّعة للبحث"""
+    tokens = []
+    for token in normalize_arabic(text).split():
+        if remove_stopwords and token in STOPWORDS:
+            continue
+        tokens.append(strip_definite_article(token))
+    return tokens
@@ -0,0 +1,524 @@
+"""
+Hybrid Search - البحث الهجين (BM25 + دلالي)
+Inverted index with BM25 scoring over Arabic-normalized terms, fused with
+vector results through reciprocal-rank fusion and optionally reranked by a
+local cross-encoder, so clients get one ranked list in one round trip.
+"""
+import os
+import json
+import math
+import time
+import fcntl
+import asyncio
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Iterable
+
+from loguru import logger
+
+from server.core.arabic_text import tokenize
+
+
+VectorSearchFn = Callable[[str, int], Awaitable[List[Dict[str, Any]]]]
+
+
+class InvertedIndex:
+    """
+    فهرس مقلوب مع تقييم BM25
+
+    Posting lists map term -> {doc_id: term frequency} and are updated in
+    place on every add/remove, so no rebuild is needed.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """إضافة مستند أو تحديثه"""
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        terms = tokenize(text)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_lengths[doc_id] = len(terms)
+        self.documents[doc_id] = {"text": text, "metadata": metadata or {}}
+        self._total_length += len(terms)
+
+    def remove(self, doc_id: str) -> bool:
+        """حذف مستند من قوائم النشر"""
+        if doc_id not in self.doc_lengths:
+            return False
+        for term in set(tokenize(self.documents[doc_id]["text"])):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self._total_length -= self.doc_lengths.pop(doc_id)
+        del self.documents[doc_id]
+        return True
+
+    def search(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+        """ترتيب المستندات حسب BM25"""
+        num_docs = len(self.doc_lengths)
+        if not num_docs:
+            return []
+        avg_length = self._total_length / num_docs or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (num_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [{"id": doc_id, "score": score} for doc_id, score in ranked]
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """دمج قوائم النتائج بطريقة Reciprocal Rank Fusion"""
+    fused: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            fused[result["id"]] = fused.get(result["id"], 0.0) + 1.0 / (k + rank)
+    return [
+        {"id": doc_id, "score": score}
+        for doc_id, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+class CrossEncoderReranker:
+    """إعادة ترتيب محلية اختيارية باستخدام cross-encoder"""
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or os.getenv(
+            "RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+        )
+        self._model = None
+        self._lock = threading.Lock()
+        self.available = True
+
+    def _load(self):
+        with self._lock:
+            if self._model is None and self.available:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name)
+                    logger.info(f"🎯 Cross-encoder reranker loaded: {self.model_name}")
+                except Exception as e:
+                    self.available = False
+                    logger.warning(f"⚠️ Cross-encoder reranker disabled: {e}")
+        return self._model
+
+    def score(self, query: str, texts: List[str]) -> Optional[List[float]]:
+        model = self._load()
+        if model is None:
+            return None
+        return [float(s) for s in model.predict([(query, text) for text in texts])]
+
+
+def _result_id(result: Dict[str, Any]) -> Optional[str]:
+    for key in ("id", "doc_id", "file", "filename", "path"):
+        if result.get(key) is not None:
+            return str(result[key])
+    return None
+
+
+# امتدادات ملفات الأرشيف التي تُفهرس نصياً مباشرة
+ARCHIVE_TEXT_EXTENSIONS = {".txt", ".md", ".json", ".csv", ".html", ".htm", ".xml", ".yaml", ".yml"}
+ARCHIVE_MAX_INDEXED_BYTES = 2 * 1024 * 1024
+
+
+def archive_document_text(key: str, data: bytes) -> Optional[str]:
+    """نص ملف الأرشيف القابل للفهرسة، أو None إذا لم يكن ملفاً نصياً"""
+    if os.path.splitext(key)[1].lower() not in ARCHIVE_TEXT_EXTENSIONS or len(data) > ARCHIVE_MAX_INDEXED_BYTES:
+        return None
+    try:
+        text = bytes(data).decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    return text if text.strip() else None
+
+
+class HybridSearchEngine:
+    """
+    محرك البحث الهجين
+
+    When storage_path is set, every add/remove is appended to an operations
+    log shared by all worker processes. Appends and snapshots are serialized
+    with a file lock; each process tails the log and reloads when a snapshot
+    bumps the generation file, so no worker's documents are lost when another
+    one snapshots. A reload builds a new InvertedIndex without holding the
+    search lock and swaps it in; start_maintenance() does this and periodic
+    snapshots in a background thread, so searches on the event loop never
+    re-tokenize the corpus.
+    """
+
+    def __init__(
+        self,
+        storage_path: Optional[str] = None,
+        reranker: Optional[CrossEncoderReranker] = None,
+        refresh_interval_seconds: float = 1.0
+    ):
+        self.index = InvertedIndex()
+        self.reranker = reranker or CrossEncoderReranker()
+        self.storage_path = storage_path
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._log_offset = 0
+        self._generation = -1
+        self._last_refresh = 0.0
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        if storage_path:
+            os.makedirs(os.path.dirname(storage_path) or ".", exist_ok=True)
+            self._refresh(force=True)
+            logger.info(f"🔎 Hybrid search index loaded: {len(self.index)} documents")
+
+    # ---------------------------------------------------------- persistence
+
+    @property
+    def _log_path(self) -> str:
+        return f"{self.storage_path}.log"
+
+    def _read_generation(self) -> int:
+        try:
+            with open(f"{self.storage_path}.gen", "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @contextmanager
+    def _file_lock(self):
+        with open(f"{self.storage_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _apply(index: InvertedIndex, op: Dict[str, Any]) -> None:
+        if op.get("op") == "add":
+            index.add(op["id"], op["text"], op.get("metadata"))
+        elif op.get("op") == "remove":
+            index.remove(op["id"])
+
+    def _refresh_due(self) -> bool:
+        return bool(self.storage_path) and time.monotonic() - self._last_refresh >= self.refresh_interval_seconds
+
+    def _refresh(self, force: bool = False) -> None:
+        """
+        تطبيق العمليات التي أضافتها العمليات الأخرى إلى السجل
+
+        Only complete lines are consumed, so a line still being written is
+        picked up on the next refresh. After a snapshot by another worker
+        the new index is built without the search lock and then swapped in.
+        Blocking: call it from a thread, not the event loop.
+        """
+        if not self.storage_path:
+            return
+        with self._refresh_lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.refresh_interval_seconds:
+                return
+            self._last_refresh = now
+
+            generation = self._read_generation()
+            rebuilt = None
+            offset = self._log_offset
+            if generation != self._generation:
+                rebuilt = InvertedIndex(self.index.k1, self.index.b)
+                offset = 0
+                if os.path.exists(self.storage_path):
+                    with open(self.storage_path, "r", encoding="utf-8") as f:
+                        for doc_id, doc in json.load(f).items():
+                            rebuilt.add(doc_id, doc["text"], doc["metadata"])
+
+            try:
+                with open(self._log_path, "rb") as f:
+                    f.seek(offset)
+                    raw = f.read()
+            except FileNotFoundError:
+                raw = b""
+            complete = raw[:raw.rfind(b"\n") + 1]
+            ops = []
+            for line in complete.splitlines():
+                try:
+                    ops.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+
+            if rebuilt is not None:
+                for op in ops:
+                    self._apply_safely(rebuilt, op)
+                with self._lock:
+                    self.index = rebuilt
+                    self._log_offset = len(complete)
+                    self._generation = generation
+            else:
+                with self._lock:
+                    for op in ops:
+                        self._apply_safely(self.index, op)
+                    self._log_offset += len(complete)
+
+    def _apply_safely(self, index: InvertedIndex, op: Dict[str, Any]) -> None:
+        try:
+            self._apply(index, op)
+        except KeyError:
+            pass
+
+    def _write_ops(self, ops: List[Dict[str, Any]]) -> None:
+        """تطبيق العمليات محلياً وإلحاقها بالسجل المشترك تحت قفل الملف"""
+        if not self.storage_path:
+            with self._lock:
+                for op in ops:
+                    self._apply(self.index, op)
+            return
+        # قفل الملف يسلسل الكتّاب من كل الخيوط والعمليات؛ قفل الذاكرة يُحجز فقط أثناء التطبيق
+        with self._file_lock():
+            self._refresh(force=True)
+            with open(self._log_path, "ab") as f:
+                f.write(b"".join((json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8") for op in ops))
+            self._refresh(force=True)
+
+    def snapshot(self, min_log_bytes: int = 0) -> bool:
+        """
+        حفظ لقطة كاملة للفهرس وتفريغ سجل العمليات
+
+        Under the file lock the whole log is applied first, so the snapshot
+        holds every worker's documents before the log is truncated. Skipped
+        (returns False) when the log is smaller than min_log_bytes, so
+        workers that wake up right after another one's snapshot do nothing.
+        """
+        if not self.storage_path:
+            return False
+        with self._file_lock():
+            try:
+                log_size = os.path.getsize(self._log_path)
+            except FileNotFoundError:
+                log_size = 0
+            if min_log_bytes and log_size < min_log_bytes:
+                return False
+            self._refresh(force=True)
+            tmp_path = f"{self.storage_path}.{os.getpid()}.tmp"
+            with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.index.documents, f, ensure_ascii=False)
+            os.replace(tmp_path, self.storage_path)
+            open(self._log_path, "w").close()
+
+            gen_path = f"{self.storage_path}.gen"
+            with open(f"{gen_path}.{os.getpid()}.tmp", "w") as f:
+                f.write(str(self._generation + 1))
+            os.replace(f"{gen_path}.{os.getpid()}.tmp", gen_path)
+            with self._refresh_lock, self._lock:
+                self._generation += 1
+                self._log_offset = 0
+        return True
+
+    def start_maintenance(
+        self,
+        snapshot_interval_seconds: float = 300.0,
+        snapshot_min_log_bytes: int = 1024 * 1024
+    ) -> None:
+        """
+        تحديث الفهرس ولقطات دورية في خيط خلفي
+
+        Every refresh_interval_seconds the thread tails the log (rebuilding
+        the index after another worker's snapshot), and every
+        snapshot_interval_seconds it snapshots once the log has grown past
+        snapshot_min_log_bytes. All workers run it; the size check under the
+        file lock keeps them from snapshotting back to back.
+        """
+        if not self.storage_path or (self._maintenance_thread and self._maintenance_thread.is_alive()):
+            return
+        self._stop_event.clear()
+
+        def run():
+            last_snapshot = time.monotonic()
+            while True:
+                try:
+                    self._refresh()
+                    if time.monotonic() - last_snapshot >= snapshot_interval_seconds:
+                        if self.snapshot(min_log_bytes=snapshot_min_log_bytes):
+                            logger.info(f"🔎 Hybrid search index snapshot: {len(self.index)} documents")
+                        last_snapshot = time.monotonic()
+                except Exception as e:
+                    logger.error(f"❌ Hybrid search maintenance failed: {e}")
+                if self._stop_event.wait(self.refresh_interval_seconds):
+                    return
+
+        self._maintenance_thread = threading.Thread(target=run, name="hybrid-search-maintenance", daemon=True)
+        self._maintenance_thread.start()
+
+    def close(self) -> None:
+        """إيقاف الصيانة وحفظ لقطة أخيرة"""
+        self._stop_event.set()
+        if self._maintenance_thread and self._maintenance_thread.is_alive():
+            self._maintenance_thread.join(timeout=5)
+        self.snapshot()
+
+    # -------------------------------------------------------------- updates
+
+    def index_document(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """فهرسة مستند (تحديث تدريجي لقوائم النشر)"""
+        self._write_ops([{"op": "add", "id": doc_id, "text": text, "metadata": metadata or {}}])
+
+    def index_documents(self, documents: Iterable[Dict[str, Any]]) -> int:
+        ops = [
+            {"op": "add", "id": doc["id"], "text": doc["text"], "metadata": doc.get("metadata") or {}}
+            for doc in documents
+        ]
+        if ops:
+            self._write_ops(ops)
+        return len(ops)
+
+    def remove_document(self, doc_id: str) -> bool:
+        self._refresh(force=True)
+        with self._lock:
+            if doc_id not in self.index.documents:
+                return False
+        self._write_ops([{"op": "remove", "id": doc_id}])
+        return True
+
+    def index_archive_file(self, key: str, data: Optional[bytes]) -> bool:
+        """
+        مزامنة ملف أرشيف مع الفهرس
+
+        Matches PackedArchiveStore.add_listener: data is None when the file
+        was removed. Non-text files are skipped.
+        """
+        if data is None:
+            return self.remove_document(key)
+        text = archive_document_text(key, data)
+        if text is None:
+            return False
+        self.index_document(key, text, {"source": "archive", "file": key})
+        return True
+
+    def reindex_archive(self, store: Any, batch_size: int = 256) -> int:
+        """فهرسة كل الملفات النصية الموجودة في المخزن المضغوط"""
+        indexed = 0
+        offset = 0
+        while True:
+            page = store.list_files(offset=offset, limit=batch_size)["files"]
+            if not page:
+                return indexed
+            documents = []
+            for entry in page:
+                data = store.read(entry["name"])
+                text = archive_document_text(entry["name"], data) if data is not None else None
+                if text is not None:
+                    documents.append({"id": entry["name"], "text": text, "metadata": {"source": "archive", "file": entry["name"]}})
+            indexed += self.index_documents(documents)
+            offset += len(page)
+
+    # --------------------------------------------------------------- search
+
+    async def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        vector_search: Optional[VectorSearchFn] = None,
+        rerank: bool = False,
+        rerank_top_k: int = 20
+    ) -> Dict[str, Any]:
+        """
+        بحث هجين في طلب واحد
+
+        Args:
+            query: نص الاستعلام
+            top_k: عدد النتائج المطلوبة
+            vector_search: دالة البحث الدلالي (اختيارية)
+            rerank: تفعيل إعادة الترتيب بالـ cross-encoder
+            rerank_top_k: الحد الأقصى للمرشحين الذين تتم إعادة ترتيبهم
+
+        Returns:
+            Dict: النتائج المدمجة مع ترتيب كل مصدر
+        """
+        candidates = max(top_k, rerank_top_k if rerank else top_k)
+        if self._refresh_due():
+            await asyncio.to_thread(self._refresh)
+        with self._lock:
+            keyword_results = self.index.search(query, top_k=candidates)
+
+        vector_results: List[Dict[str, Any]] = []
+        if vector_search is not None:
+            try:
+                raw_results = await vector_search(query, candidates)
+                for result in raw_results or []:
+                    doc_id = _result_id(result)
+                    if doc_id is not None:
+                        vector_results.append({**result, "id": doc_id})
+            except Exception as e:
+                logger.warning(f"⚠️ Vector search failed, using keyword results only: {e}")
+
+        fused = reciprocal_rank_fusion([keyword_results, vector_results])[:candidates]
+        keyword_ranks = {r["id"]: rank for rank, r in enumerate(keyword_results, start=1)}
+        vector_by_id = {r["id"]: (rank, r) for rank, r in enumerate(vector_results, start=1)}
+
+        results = []
+        for item in fused:
+            with self._lock:
+                doc = self.index.documents.get(item["id"])
+            vector_hit = vector_by_id.get(item["id"])
+            text = doc["text"] if doc else (vector_hit[1].get("text") or vector_hit[1].get("content") or "")
+            results.append({
+                "id": item["id"],
+                "score": item["score"],
+                "keyword_rank": keyword_ranks.get(item["id"]),
+                "vector_rank": vector_hit[0] if vector_hit else None,
+                "text": text,
+                "metadata": doc["metadata"] if doc else vector_hit[1].get("metadata", {}),
+            })
+
+        reranked = False
+        if rerank and results:
+            head = results[:rerank_top_k]
+            scores = await asyncio.to_thread(self.reranker.score, query, [r["text"] for r in head])
+            if scores is not None:
+                for result, score in zip(head, scores):
+                    result["rerank_score"] = score
+                results = sorted(head, key=lambda r: r["rerank_score"], reverse=True) + results[rerank_top_k:]
+                reranked = True
+
+        return {
+            "query": query,
+            "results": results[:top_k],
+            "keyword_hits": len(keyword_results),
+            "vector_hits": len(vector_results),
+            "reranked": reranked,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._refresh()
+        return {
+            "documents": len(self.index),
+            "terms": len(self.index.postings),
+            "reranker_available": self.reranker.available,
+        }
+
+
+_hybrid_search_engine: Optional[HybridSearchEngine] = None
+
+
+def get_hybrid_search_engine() -> HybridSearchEngine:
+    """الحصول على محرك البحث الهجين المشترك"""
+    global _hybrid_search_engine
+    if _hybrid_search_engine is None:
+        _hybrid_search_engine = HybridSearchEngine(
+            storage_path=os.getenv("HYBRID_INDEX_PATH", "data/hybrid_index/postings.json")
+        )
+    return _hybrid_search_engine
@@ -0,0 +1,550 @@
+"""
+Packed Archive - أرشيف مضغوط في مقاطع
+Append-only segment files with a compact binary offset index, memory-mapped
+zero-copy reads and an in-memory metadata catalog, so listing and stats do not
+walk the archive directory.
+
+Safe to share between worker processes: writes are serialized by a file lock
+and offsets come from the real file sizes, every process tails the .idx files
+to see the others' writes, and compaction plus directory sync run only in the
+process that holds the maintenance lock.
+"""
+import os
+import mmap
+import time
+import zlib
+import fcntl
+import bisect
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from loguru import logger
+
+
+# رأس السجل في ملف المقطع: magic, flags, key_len, data_len
+_RECORD_HEADER = struct.Struct("<4sBHI")
+_RECORD_MAGIC = b"SAR1"
+# مدخل الفهرس: crc32 ثم flags, key_len, data_offset, data_len, mtime ثم المفتاح
+_INDEX_CRC = struct.Struct("<I")
+_INDEX_BODY = struct.Struct("<BHQId")
+
+FLAG_DATA = 0
+FLAG_TOMBSTONE = 1
+
+# حجم الدفعة الواحدة أثناء مزامنة المجلد (حتى لا يطول حجز قفل الكتابة)
+SYNC_BATCH_FILES = 256
+SYNC_BATCH_BYTES = 32 * 1024 * 1024
+
+
+def _pack_index_entry(flags: int, key_bytes: bytes, offset: int, length: int, mtime: float) -> bytes:
+    body = _INDEX_BODY.pack(flags, len(key_bytes), offset, length, mtime) + key_bytes
+    return _INDEX_CRC.pack(zlib.crc32(body)) + body
+
+
+def _parse_index_entries(raw: bytes) -> Tuple[List[Tuple[str, int, int, int, float]], int]:
+    """
+    تحليل مدخلات الفهرس حتى أول مدخل ناقص أو تالف
+
+    Returns the decoded entries and the number of bytes they span. A torn
+    write (crash or a writer still appending) ends the scan at the last
+    complete entry whose checksum matches.
+    """
+    view = memoryview(raw)
+    entries = []
+    pos = 0
+    header_size = _INDEX_CRC.size + _INDEX_BODY.size
+    while pos + header_size <= len(raw):
+        body_start = pos + _INDEX_CRC.size
+        flags, key_len, offset, length, mtime = _INDEX_BODY.unpack_from(raw, body_start)
+        end = body_start + _INDEX_BODY.size + key_len
+        if end > len(raw):
+            break
+        (crc,) = _INDEX_CRC.unpack_from(raw, pos)
+        if zlib.crc32(view[body_start:end]) != crc:
+            break
+        try:
+            key = bytes(view[body_start + _INDEX_BODY.size:end]).decode("utf-8")
+        except UnicodeDecodeError:
+            break
+        entries.append((key, flags, offset, length, mtime))
+        pos = end
+    return entries, pos
+
+
+class PackedArchiveStore:
+    """
+    مخزن الأرشيف المضغوط
+
+    Each segment is a pair of files: segment-NNNNNN.seg holds the raw records,
+    segment-NNNNNN.idx holds one checksummed entry per record. Only the .idx
+    files are read; file contents are read through mmap on demand. Other
+    processes' writes become visible within refresh_interval_seconds.
+    """
+
+    def __init__(
+        self,
+        root_dir: Optional[str] = None,
+        segment_max_bytes: int = 256 * 1024 * 1024,
+        compaction_dead_ratio: float = 0.3,
+        refresh_interval_seconds: float = 1.0
+    ):
+        self.root_dir = root_dir or os.getenv("PACKED_ARCHIVE_DIR", "data/packed_archive")
+        self.segment_max_bytes = segment_max_bytes
+        self.compaction_dead_ratio = compaction_dead_ratio
+        self.refresh_interval_seconds = refresh_interval_seconds
+
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, int, int, float]] = {}
+        self._sorted_keys: List[str] = []
+        self._segment_sizes: Dict[int, int] = {}
+        self._segment_dead: Dict[int, int] = {}
+        self._idx_consumed: Dict[int, int] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._catalog: Dict[str, Any] = {"total_files": 0, "total_bytes": 0, "by_extension": {}}
+        self._generation = 0
+        self._last_refresh = 0.0
+        self._listeners: List[Callable[[str, Optional[bytes]], None]] = []
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._maintenance_lock_file = None
+        self._stop_event = threading.Event()
+
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._refresh(force=True)
+        logger.info(f"📦 Packed archive loaded: {self._catalog['total_files']} files in {len(self._segment_sizes)} segments")
+
+    # ------------------------------------------------------------------ paths
+
+    def _seg_path(self, segment_id: int) -> str:
+        return os.path.join(self.root_dir, f"segment-{segment_id:06d}.seg")
+
+    def _idx_path(self, segment_id: int) -> str:
+        return os.path.join(self.root_dir, f"segment-{segment_id:06d}.idx")
+
+    def _segment_ids_on_disk(self) -> List[int]:
+        return sorted(
+            int(name[8:14]) for name in os.listdir(self.root_dir)
+            if name.startswith("segment-") and name.endswith(".idx")
+        )
+
+    # ---------------------------------------------------------------- catalog
+
+    def _catalog_add(self, key: str, length: int, sign: int) -> None:
+        ext = os.path.splitext(key)[1].lower() or "<none>"
+        bucket = self._catalog["by_extension"].setdefault(ext, {"files": 0, "bytes": 0})
+        bucket["files"] += sign
+        bucket["bytes"] += sign * length
+        if bucket["files"] == 0:
+            del self._catalog["by_extension"][ext]
+        self._catalog["total_files"] += sign
+        self._catalog["total_bytes"] += sign * length
+
+    def _apply(self, key: str, location: Optional[Tuple[int, int, int, float]]) -> None:
+        previous = self._index.pop(key, None)
+        if previous is not None:
+            self._segment_dead[previous[0]] = self._segment_dead.get(previous[0], 0) + previous[2]
+            self._catalog_add(key, previous[2], -1)
+            if location is None:
+                del self._sorted_keys[bisect.bisect_left(self._sorted_keys, key)]
+        elif location is not None:
+            bisect.insort(self._sorted_keys, key)
+
+        if location is not None:
+            self._index[key] = location
+            self._catalog_add(key, location[2], 1)
+
+    # ---------------------------------------------------------------- refresh
+
+    def _read_generation(self) -> int:
+        try:
+            with open(os.path.join(self.root_dir, "GENERATION"), "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self) -> None:
+        path = os.path.join(self.root_dir, "GENERATION")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._read_generation() + 1))
+        os.replace(tmp_path, path)
+
+    def _reset(self) -> None:
+        self._index.clear()
+        self._sorted_keys.clear()
+        self._segment_sizes.clear()
+        self._segment_dead.clear()
+        self._idx_consumed.clear()
+        self._maps.clear()
+        self._catalog = {"total_files": 0, "total_bytes": 0, "by_extension": {}}
+
+    def _tail_index(self, segment_id: int) -> None:
+        consumed = self._idx_consumed.get(segment_id, 0)
+        try:
+            size = os.path.getsize(self._idx_path(segment_id))
+            if size > consumed:
+                with open(self._idx_path(segment_id), "rb") as f:
+                    f.seek(consumed)
+                    raw = f.read()
+                entries, used = _parse_index_entries(raw)
+                for key, flags, offset, length, mtime in entries:
+                    self._apply(key, None if flags == FLAG_TOMBSTONE else (segment_id, offset, length, mtime))
+                self._idx_consumed[segment_id] = consumed + used
+            self._segment_sizes[segment_id] = os.path.getsize(self._seg_path(segment_id))
+        except FileNotFoundError:
+            return  # حُذف المقطع أثناء الضغط؛ سيتم إعادة التحميل مع تغيّر GENERATION
+        self._segment_dead.setdefault(segment_id, 0)
+
+    def _refresh(self, force: bool = False) -> None:
+        """
+        مزامنة الحالة في الذاكرة مع ما كتبته العمليات الأخرى
+
+        Reads only the new tail of each .idx file. A changed GENERATION (bumped
+        after compaction removes segments) triggers a full reload.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.refresh_interval_seconds:
+                return
+            self._last_refresh = now
+            generation = self._read_generation()
+            if generation != self._generation:
+                self._reset()
+                self._generation = generation
+            for segment_id in self._segment_ids_on_disk():
+                self._tail_index(segment_id)
+
+    # ------------------------------------------------------------------ write
+
+    @contextmanager
+    def _exclusive_writer(self):
+        """كاتب واحد في كل مرة عبر الخيوط والعمليات"""
+        with self._write_lock:
+            with open(os.path.join(self.root_dir, "writer.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh(force=True)
+                    self._truncate_torn_tails()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _truncate_torn_tails(self) -> None:
+        # تحت قفل الكتابة لا يوجد كاتب آخر، فأي بايتات بعد آخر مدخل سليم هي بقايا توقف مفاجئ
+        for segment_id, consumed in list(self._idx_consumed.items()):
+            path = self._idx_path(segment_id)
+            if os.path.exists(path) and os.path.getsize(path) > consumed:
+                logger.warning(f"⚠️ Truncating torn index tail of segment {segment_id} at {consumed} bytes")
+                os.truncate(path, consumed)
+
+    def _append_records(self, records: List[Tuple[str, bytes, int, float]]) -> None:
+        """كتابة السجلات إلى المقطع النشط؛ يُستدعى فقط تحت _exclusive_writer"""
+        segment_id = max(self._segment_sizes, default=1)
+        pending = list(records)
+        while pending:
+            with open(self._seg_path(segment_id), "ab") as seg_file:
+                offset = os.fstat(seg_file.fileno()).st_size
+                if offset >= self.segment_max_bytes:
+                    segment_id += 1
+                    continue
+                seg_buffer, idx_buffer = [], []
+                while pending and offset < self.segment_max_bytes:
+                    key, data, flags, mtime = pending.pop(0)
+                    key_bytes = key.encode("utf-8")
+                    header = _RECORD_HEADER.pack(_RECORD_MAGIC, flags, len(key_bytes), len(data))
+                    data_offset = offset + len(header) + len(key_bytes)
+                    seg_buffer.append(header + key_bytes + data)
+                    idx_buffer.append(_pack_index_entry(flags, key_bytes, data_offset, len(data), mtime))
+                    offset = data_offset + len(data)
+                # البيانات أولاً ثم الفهرس، فلا يرى القارئ مدخلاً يشير إلى بيانات غير مكتوبة
+                seg_file.write(b"".join(seg_buffer))
+                seg_file.flush()
+            with open(self._idx_path(segment_id), "ab") as idx_file:
+                idx_file.write(b"".join(idx_buffer))
+                idx_file.flush()
+            with self._lock:
+                self._tail_index(segment_id)
+
+    def _write(self, records: List[Tuple[str, bytes, int, float]], notify: bool = True) -> None:
+        with self._exclusive_writer():
+            self._append_records(records)
+        if notify:
+            for key, data, flags, _ in records:
+                self._notify(key, None if flags == FLAG_TOMBSTONE else data)
+
+    def put(self, key: str, data: bytes, mtime: Optional[float] = None) -> None:
+        """إضافة ملف أو استبداله في الأرشيف"""
+        self._write([(key, bytes(data), FLAG_DATA, mtime if mtime is not None else time.time())])
+
+    def delete(self, key: str) -> bool:
+        """حذف ملف من الأرشيف (سجل حذف في السجل الإلحاقي)"""
+        if not self.exists(key):
+            return False
+        self._write([(key, b"", FLAG_TOMBSTONE, time.time())])
+        return True
+
+    def sync_directory(self, directory: str) -> Dict[str, int]:
+        """
+        مزامنة المخزن مع مجلد الأرشيف
+
+        Incremental: only files whose size or mtime changed are read and
+        appended, and keys whose file disappeared get a tombstone. The store
+        mirrors the directory, so keys not present there are removed.
+        """
+        if not os.path.isdir(directory):
+            logger.warning(f"⚠️ Archive directory not found, skipping sync: {directory}")
+            return {"updated": 0, "removed": 0}
+
+        self._refresh(force=True)
+        seen = set()
+        batch: List[Tuple[str, bytes, int, float]] = []
+        batch_bytes = 0
+        updated = 0
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, directory).replace(os.sep, "/")
+                try:
+                    stat = os.stat(path)
+                    seen.add(key)
+                    with self._lock:
+                        location = self._index.get(key)
+                    if location and location[2] == stat.st_size and location[3] == stat.st_mtime:
+                        continue
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                batch.append((key, data, FLAG_DATA, stat.st_mtime))
+                batch_bytes += len(data)
+                if len(batch) >= SYNC_BATCH_FILES or batch_bytes >= SYNC_BATCH_BYTES:
+                    self._write(batch)
+                    updated += len(batch)
+                    batch, batch_bytes = [], 0
+        if batch:
+            self._write(batch)
+            updated += len(batch)
+
+        with self._lock:
+            removed = [(key, b"", FLAG_TOMBSTONE, time.time()) for key in self._index if key not in seen]
+        for start in range(0, len(removed), SYNC_BATCH_FILES):
+            self._write(removed[start:start + SYNC_BATCH_FILES])
+
+        if updated or removed:
+            logger.info(f"📦 Synced {directory}: {updated} updated, {len(removed)} removed")
+        return {"updated": updated, "removed": len(removed)}
+
+    # -------------------------------------------------------------- listeners
+
+    def add_listener(self, callback: Callable[[str, Optional[bytes]], None]) -> None:
+        """
+        تسجيل دالة تُستدعى بعد كل كتابة من هذه العملية
+
+        The callback receives the key and the new content, or None on delete.
+        Compaction copies are not reported since the content does not change.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, key: str, data: Optional[bytes]) -> None:
+        for callback in self._listeners:
+            try:
+                callback(key, data)
+            except Exception as e:
+                logger.error(f"❌ Packed archive listener failed for {key}: {e}")
+
+    # ------------------------------------------------------------------- read
+
+    def _map(self, segment_id: int, end: int) -> mmap.mmap:
+        mapped = self._maps.get(segment_id)
+        if mapped is None or len(mapped) < end:
+            with open(self._seg_path(segment_id), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment_id] = mapped
+        return mapped
+
+    def read(self, key: str) -> Optional[memoryview]:
+        """
+        قراءة ملف دون نسخ
+
+        Returns a read-only memoryview over the mapped segment, or None if the
+        key does not exist. Call bytes() on it if the data must outlive the store.
+        """
+        self._refresh()
+        for attempt in range(2):
+            with self._lock:
+                location = self._index.get(key)
+                if location is None:
+                    return None
+                segment_id, offset, length, _ = location
+                try:
+                    return memoryview(self._map(segment_id, offset + length))[offset:offset + length]
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+            # ضغطت عملية أخرى هذا المقطع؛ أعد التحميل وحاول مرة أخرى
+            self._refresh(force=True)
+        return None
+
+    def exists(self, key: str) -> bool:
+        self._refresh()
+        with self._lock:
+            return key in self._index
+
+    # ---------------------------------------------------------- list & stats
+
+    def list_files(self, prefix: str = "", offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """قائمة الملفات من الفهرس المرتب (بدون المرور على المجلد)"""
+        self._refresh()
+        with self._lock:
+            start = bisect.bisect_left(self._sorted_keys, prefix) + offset
+            files = []
+            for key in self._sorted_keys[start:start + limit]:
+                if not key.startswith(prefix):
+                    break
+                _, _, length, mtime = self._index[key]
+                files.append({"name": key, "size": length, "modified": mtime})
+            return {"files": files, "count": len(files), "total_files": self._catalog["total_files"]}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات الأرشيف من الكتالوج المحدّث باستمرار"""
+        self._refresh()
+        with self._lock:
+            return {
+                "total_files": self._catalog["total_files"],
+                "total_bytes": self._catalog["total_bytes"],
+                "by_extension": {ext: dict(v) for ext, v in self._catalog["by_extension"].items()},
+                "segments": len(self._segment_sizes),
+                "dead_bytes": sum(self._segment_dead.values()),
+                "generation": self._generation,
+                "maintenance_leader": self._maintenance_lock_file is not None,
+            }
+
+    # ------------------------------------------------------------- compaction
+
+    def compact(self) -> int:
+        """
+        ضغط المقاطع المغلقة التي تتجاوز نسبة البيانات الميتة فيها الحد
+
+        Live records are re-appended to the active segment, the old segment
+        files are removed and GENERATION is bumped so every process reloads.
+        Runs under the writer lock. Returns the number of segments compacted.
+        """
+        compacted = 0
+        with self._exclusive_writer():
+            active_id = max(self._segment_sizes, default=0)
+            candidates = [
+                segment_id for segment_id, size in sorted(self._segment_sizes.items())
+                if segment_id != active_id and size
+                and self._segment_dead.get(segment_id, 0) / size >= self.compaction_dead_ratio
+            ]
+            for segment_id in candidates:
+                with self._lock:
+                    live = [(key, loc) for key, loc in self._index.items() if loc[0] == segment_id]
+                    # خريطة بطول المقطع كاملاً: خريطة مخزنة من وقت كان فيه المقطع نشطاً تكون أقصر
+                    mapped = self._map(segment_id, self._segment_sizes[segment_id])
+                    records = [
+                        (key, bytes(mapped[offset:offset + length]), FLAG_DATA, mtime)
+                        for key, (_, offset, length, mtime) in live
+                    ]
+                    short = [
+                        key for (key, (_, _, length, _)), (_, data, _, _) in zip(live, records) if len(data) != length
+                    ]
+                    if short:
+                        raise IOError(f"Segment {segment_id} is shorter than its index ({short[0]}), not compacting")
+                    # سجلات الحذف تُنقل أيضاً إذا بقيت مقاطع أقدم قد تحتوي المفتاح نفسه
+                    if any(other < segment_id for other in self._segment_sizes):
+                        with open(self._idx_path(segment_id), "rb") as f:
+                            entries, _ = _parse_index_entries(f.read())
+                        records.extend(
+                            (key, b"", FLAG_TOMBSTONE, mtime)
+                            for key, flags, _, _, mtime in entries
+                            if flags == FLAG_TOMBSTONE and key not in self._index
+                        )
+                if records:
+                    self._append_records(records)
+                # قد تبقى memoryview مصدّرة من هذا المقطع، لذلك لا نغلق الخريطة صراحة
+                os.remove(self._idx_path(segment_id))
+                os.remove(self._seg_path(segment_id))
+                with self._lock:
+                    self._segment_sizes.pop(segment_id, None)
+                    self._idx_consumed.pop(segment_id, None)
+                compacted += 1
+                logger.info(f"🧹 Compacted segment {segment_id}: {len(live)} live records moved")
+            if compacted:
+                self._bump_generation()
+                self._refresh(force=True)
+        return compacted
+
+    def _try_become_maintainer(self) -> bool:
+        if self._maintenance_lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.root_dir, "maintenance.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._maintenance_lock_file = lock_file
+        logger.info(f"📦 Process {os.getpid()} elected packed archive maintainer")
+        return True
+
+    def start_maintenance(
+        self,
+        compaction_interval_seconds: float = 300.0,
+        sync_directory: Optional[str] = None,
+        sync_interval_seconds: float = 30.0
+    ) -> None:
+        """
+        تشغيل الصيانة الدورية (مزامنة المجلد والضغط) في خيط خلفي
+
+        Every worker starts the thread but only the process holding
+        maintenance.lock does the work; if it exits, another one takes over.
+        """
+        if self._maintenance_thread and self._maintenance_thread.is_alive():
+            return
+        self._stop_event.clear()
+        tick = min(compaction_interval_seconds, sync_interval_seconds) if sync_directory else compaction_interval_seconds
+
+        def run():
+            last_compaction = last_sync = 0.0
+            while True:
+                try:
+                    if self._try_become_maintainer():
+                        now = time.monotonic()
+                        if sync_directory and now - last_sync >= sync_interval_seconds:
+                            self.sync_directory(sync_directory)
+                            last_sync = now
+                        if now - last_compaction >= compaction_interval_seconds:
+                            if last_compaction:
+                                self.compact()
+                            last_compaction = now
+                except Exception as e:
+                    logger.error(f"❌ Packed archive maintenance failed: {e}")
+                if self._stop_event.wait(tick):
+                    return
+
+        self._maintenance_thread = threading.Thread(target=run, name="packed-archive-maintenance", daemon=True)
+        self._maintenance_thread.start()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        if self._maintenance_thread and self._maintenance_thread.is_alive():
+            self._maintenance_thread.join(timeout=5)
+        with self._lock:
+            if self._maintenance_lock_file is not None:
+                self._maintenance_lock_file.close()
+                self._maintenance_lock_file = None
+            self._maps.clear()
+
+
+_packed_archive: Optional[PackedArchiveStore] = None
+
+
+def get_packed_archive() -> PackedArchiveStore:
+    """الحصول على نسخة المخزن المشتركة"""
+    global _packed_archive
+    if _packed_archive is None:
+        _packed_archive = PackedArchiveStore()
+    return _packed_archive
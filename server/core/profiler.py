@@ -0,0 +1,421 @@
+"""
+Profiler - أداة التحليل الإحصائي وتتبع الطلبات البطيئة
+On-demand statistical sampler across all threads (including the event loop)
+with collapsed-stack output, plus per-request stage timelines and stack
+samples for slow requests, kept in a bounded ring buffer keyed by trace_id.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import Counter, OrderedDict, deque
+from typing import Dict, Any, List, Optional
+
+from loguru import logger
+
+
+# معرفات التتبع المقبولة (تُعاد في ترويسة X-Trace-Id)
+TRACE_ID_PATTERN = r"^[A-Za-z0-9._:-]{1,128}$"
+MAX_TRACE_ID_LENGTH = 128
+_TRACE_ID_INVALID_CHARS = re.compile(r"[^A-Za-z0-9._:-]")
+
+
+def sanitize_trace_id(value: Optional[str]) -> Optional[str]:
+    """
+    حذف المحارف غير المسموح بها من معرف التتبع
+
+    Keeps letters, digits and "._:-" and truncates to MAX_TRACE_ID_LENGTH,
+    so a client-supplied id can never inject CR/LF or other control bytes
+    into the X-Trace-Id response header. Returns None if nothing is left.
+    """
+    if not value:
+        return None
+    return _TRACE_ID_INVALID_CHARS.sub("", str(value))[:MAX_TRACE_ID_LENGTH] or None
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def _collapse(frame, thread_name: str, max_depth: int = 128) -> str:
+    """تحويل إطار التنفيذ إلى سطر بصيغة collapsed stack (الجذر أولاً)"""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append(thread_name.replace(";", "_").replace(" ", "_"))
+    return ";".join(reversed(names))
+
+
+def _collapse_task(task: "asyncio.Task", thread_frame=None, label: str = "request", max_depth: int = 128) -> Optional[str]:
+    """
+    مكدس مهمة asyncio بصيغة collapsed stack
+
+    Follows the task's coroutine await chain (cr_await / gi_yieldfrom), so a
+    suspended request shows where it is waiting instead of whatever else the
+    event loop happens to run. When the task is executing, the loop thread's
+    frames below its innermost coroutine are appended.
+    """
+    if task.done():
+        return None
+    names = [label]
+    awaited = task.get_coro()
+    last_frame = None
+    while awaited is not None and len(names) < max_depth:
+        frame = getattr(awaited, "cr_frame", None) or getattr(awaited, "gi_frame", None)
+        if frame is None:
+            names.append(f"await:{type(awaited).__name__}")
+            break
+        names.append(_frame_name(frame))
+        last_frame = frame
+        awaited = getattr(awaited, "cr_await", None) if hasattr(awaited, "cr_await") else getattr(awaited, "gi_yieldfrom", None)
+    else:
+        if last_frame is not None and thread_frame is not None:
+            below = []
+            frame = thread_frame
+            while frame is not None and frame is not last_frame:
+                below.append(frame)
+                frame = frame.f_back
+            if frame is last_frame:
+                names.extend(_frame_name(f) for f in reversed(below))
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    """
+    مُحلل إحصائي عند الطلب
+
+    Samples sys._current_frames() from a background thread, so the event loop
+    keeps serving requests while being profiled. Only one session runs at a time.
+    """
+
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, interval_ms: float = 5.0) -> Dict[str, Any]:
+        """
+        تشغيل جلسة تحليل لمدة محددة (استدعاء حاجب - شغّله في خيط منفصل)
+
+        Returns:
+            Dict: collapsed (نص بصيغة flamegraph) وعدد العينات
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profiling session is already running")
+        try:
+            seconds = min(max(seconds, 0.1), self.max_seconds)
+            interval = max(interval_ms, 1.0) / 1000
+            own_id = threading.get_ident()
+            stacks: Counter = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != own_id:
+                        stacks[_collapse(frame, names.get(thread_id, f"thread-{thread_id}"))] += 1
+                samples += 1
+                time.sleep(interval)
+            logger.info(f"🔥 Profiling session finished: {samples} samples over {seconds}s")
+            return {
+                "duration_seconds": seconds,
+                "interval_ms": interval * 1000,
+                "samples": samples,
+                "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+            }
+        finally:
+            self._lock.release()
+
+
+class RequestTimeline:
+    """الخط الزمني لطلب واحد: المراحل وعينات المكدس"""
+
+    def __init__(
+        self,
+        trace_id: str,
+        method: str,
+        path: str,
+        thread_id: int,
+        task: Optional["asyncio.Task"] = None,
+        max_samples: int = 500
+    ):
+        self.trace_id = trace_id
+        self.method = method
+        self.path = path
+        self.thread_id = thread_id
+        self.task = task
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+        self.samples: Counter = Counter()
+        self.max_samples = max_samples
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def mark(self, stage: str) -> None:
+        self.stages.append({"stage": stage, "at_ms": round(self.elapsed_ms(), 2)})
+
+    def to_dict(self, include_samples: bool = True) -> Dict[str, Any]:
+        data = {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status_code": self.status_code,
+            "stages": self.stages,
+            "sample_count": sum(self.samples.values()),
+        }
+        if include_samples:
+            data["collapsed"] = "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+        return data
+
+
+_current_timeline: contextvars.ContextVar = contextvars.ContextVar("current_timeline", default=None)
+
+
+class RequestProfiler:
+    """
+    التقاط الطلبات البطيئة
+
+    A watchdog thread samples every in-flight request once it passes half the
+    slow threshold. For async handlers it walks the request task's coroutine
+    chain, so samples belong to that request even while the event loop serves
+    others; sync callers fall back to their thread's stack. Finished requests
+    over the threshold are kept in a ring buffer and, when storage_dir is set,
+    written there as JSON so any worker process can serve a trace_id lookup.
+    """
+
+    def __init__(
+        self,
+        slow_threshold_ms: Optional[float] = None,
+        buffer_size: Optional[int] = None,
+        sample_interval_ms: float = 10.0,
+        storage_dir: Optional[str] = None
+    ):
+        self.slow_threshold_ms = slow_threshold_ms or float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "10000"))
+        self.buffer_size = buffer_size or int(os.getenv("SLOW_REQUEST_BUFFER_SIZE", "200"))
+        self.sample_interval_ms = sample_interval_ms
+        self.storage_dir = storage_dir
+        self.sampler = SamplingProfiler()
+        self._active: Dict[int, RequestTimeline] = {}
+        self._slow: "OrderedDict[str, RequestTimeline]" = OrderedDict()
+        self._pending_writes: deque = deque()
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    # ------------------------------------------------------------ lifecycle
+
+    def start(self) -> None:
+        if self._watchdog and self._watchdog.is_alive():
+            return
+        self._stop_event.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="slow-request-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._watchdog and self._watchdog.is_alive():
+            self._watchdog.join(timeout=5)
+        self._flush_pending()
+
+    def _watch(self) -> None:
+        interval = self.sample_interval_ms / 1000
+        while not self._stop_event.wait(interval):
+            self._flush_pending()
+            with self._lock:
+                candidates = [
+                    t for t in self._active.values()
+                    if t.elapsed_ms() >= self.slow_threshold_ms / 2 and sum(t.samples.values()) < t.max_samples
+                ]
+            if not candidates:
+                continue
+            frames = sys._current_frames()
+            for timeline in candidates:
+                thread_frame = frames.get(timeline.thread_id)
+                if timeline.task is not None:
+                    stack = _collapse_task(timeline.task, thread_frame)
+                else:
+                    stack = _collapse(thread_frame, "request") if thread_frame is not None else None
+                if stack:
+                    timeline.samples[stack] += 1
+
+    # -------------------------------------------------------------- storage
+
+    def _path(self, trace_id: str) -> str:
+        return os.path.join(self.storage_dir, hashlib.sha256(trace_id.encode("utf-8")).hexdigest()[:32] + ".json")
+
+    def _flush_pending(self) -> None:
+        if not self.storage_dir or not self._pending_writes:
+            return
+        os.makedirs(self.storage_dir, exist_ok=True)
+        while self._pending_writes:
+            data = self._pending_writes.popleft()
+            path = self._path(data["trace_id"])
+            try:
+                with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(f"{path}.{os.getpid()}.tmp", path)
+            except OSError as e:
+                logger.error(f"❌ Failed to persist slow request {data['trace_id']}: {e}")
+        files = self._stored_files()
+        for path in files[self.buffer_size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _stored_files(self) -> List[str]:
+        """ملفات الطلبات البطيئة المحفوظة، الأحدث أولاً"""
+        try:
+            paths = [os.path.join(self.storage_dir, n) for n in os.listdir(self.storage_dir) if n.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        entries = []
+        for path in paths:
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        return [path for _, path in sorted(entries, reverse=True)]
+
+    # ------------------------------------------------------------- requests
+
+    def begin(self, trace_id: str, method: str, path: str) -> RequestTimeline:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        timeline = RequestTimeline(trace_id, method, path, threading.get_ident(), task=task)
+        timeline.mark("received")
+        with self._lock:
+            self._active[id(timeline)] = timeline
+        _current_timeline.set(timeline)
+        return timeline
+
+    def end(self, timeline: RequestTimeline, status_code: Optional[int] = None) -> None:
+        timeline.mark("completed")
+        elapsed_ms = timeline.elapsed_ms()
+        is_slow = elapsed_ms >= self.slow_threshold_ms
+        timeline.duration_ms = round(elapsed_ms, 2)
+        timeline.status_code = status_code
+        timeline.task = None
+        with self._lock:
+            self._active.pop(id(timeline), None)
+            if is_slow:
+                self._slow[timeline.trace_id] = timeline
+                self._slow.move_to_end(timeline.trace_id)
+                while len(self._slow) > self.buffer_size:
+                    self._slow.popitem(last=False)
+        if is_slow:
+            if self.storage_dir:
+                self._pending_writes.append(timeline.to_dict())
+            logger.warning(
+                f"🐢 Slow request {timeline.method} {timeline.path} [trace_id={timeline.trace_id}] "
+                f"took {timeline.duration_ms}ms"
+            )
+
+    def bind_trace_id(self, trace_id: str) -> None:
+        """ربط الطلب الحالي بمعرف التتبع الخاص به (من جسم الطلب)"""
+        timeline = _current_timeline.get()
+        trace_id = sanitize_trace_id(trace_id)
+        if timeline is not None and trace_id is not None:
+            timeline.trace_id = trace_id
+
+    def mark_stage(self, stage: str) -> None:
+        """تسجيل مرحلة في الخط الزمني للطلب الحالي"""
+        timeline = _current_timeline.get()
+        if timeline is not None:
+            timeline.mark(stage)
+
+    # -------------------------------------------------------------- queries
+
+    def get_slow_request(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """الطلب البطيء حسب trace_id، من هذه العملية أو من الملفات المشتركة"""
+        with self._lock:
+            timeline = self._slow.get(trace_id)
+        if timeline:
+            return timeline.to_dict()
+        if not self.storage_dir:
+            return None
+        try:
+            with open(self._path(trace_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list_slow_requests(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """آخر الطلبات البطيئة (من كل العمليات عند تعيين storage_dir)"""
+        if not self.storage_dir:
+            with self._lock:
+                timelines = list(self._slow.values())[-limit:]
+            return [t.to_dict(include_samples=False) for t in reversed(timelines)]
+
+        results = []
+        for path in self._stored_files()[:limit]:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            data.pop("collapsed", None)
+            results.append(data)
+        return results
+
+
+class RequestTimelineMiddleware:
+    """
+    ASGI middleware لتسجيل الخط الزمني لكل طلب
+
+    Implemented as plain ASGI (not BaseHTTPMiddleware) so the route handler
+    runs in the same task that begin() captures, and the watchdog samples
+    that request's own coroutine stack. Adds an X-Trace-Id response header;
+    the incoming X-Trace-Id is passed through sanitize_trace_id first.
+    """
+
+    def __init__(self, app, profiler: "RequestProfiler"):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        trace_id = sanitize_trace_id(headers.get(b"x-trace-id", b"").decode("latin-1")) or str(uuid.uuid4())
+        timeline = self.profiler.begin(trace_id, scope["method"], scope["path"])
+        status_code = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                trace_id = sanitize_trace_id(timeline.trace_id) or str(uuid.uuid4())
+                trace_header = (b"x-trace-id", trace_id.encode("ascii"))
+                message = {**message, "headers": [*message.get("headers", []), trace_header]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            self.profiler.end(timeline, status_code)
+
+
+request_profiler = RequestProfiler(storage_dir=os.getenv("SLOW_REQUEST_DIR", "data/slow_requests"))
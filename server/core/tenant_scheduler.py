@@ -0,0 +1,334 @@
+"""
+Tenant Scheduler - جدولة عادلة وضبط القبول لكل مستأجر
+Weighted fair queueing in front of LLM-backed endpoints: per-tenant queues,
+concurrency caps and rate quotas, with early rejection (HTTP 429 +
+Retry-After) when a tenant's queue deadline cannot be met.
+"""
+import os
+import json
+import math
+import time
+import asyncio
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, AsyncIterator
+
+from loguru import logger
+
+
+DEFAULT_TENANT = "default"
+# نفس حد الطول في نماذج الطلبات (tenant: max_length=50)
+MAX_TENANT_ID_LENGTH = 50
+
+
+class AdmissionRejected(Exception):
+    """رفض الطلب قبل دخوله الطابور أو بعد تجاوز مهلة الانتظار"""
+
+    def __init__(self, tenant: str, reason: str, retry_after: int):
+        super().__init__(f"Tenant {tenant} rejected: {reason}")
+        self.tenant = tenant
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TenantPolicy:
+    """
+    سياسة مستأجر: الوزن، حد التزامن، الحصة، ومهلة الانتظار
+
+    max_concurrency and requests_per_minute are totals for the whole
+    deployment. Scheduler state lives in each worker process, so
+    TenantScheduler enforces per_process(WEB_CONCURRENCY) in every worker.
+    """
+
+    def __init__(
+        self,
+        weight: float = 1.0,
+        max_concurrency: int = 4,
+        requests_per_minute: Optional[float] = None,
+        max_queue_wait_seconds: float = 30.0
+    ):
+        self.weight = max(weight, 0.01)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.requests_per_minute = requests_per_minute
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+
+    def per_process(self, worker_count: int) -> "TenantPolicy":
+        """
+        حصة عملية واحدة من السياسة
+
+        Concurrency is rounded up so every worker can run at least one
+        request; the deployment-wide total may then exceed the cap by up to
+        worker_count - 1.
+        """
+        if worker_count <= 1:
+            return self
+        return TenantPolicy(
+            weight=self.weight,
+            max_concurrency=math.ceil(self.max_concurrency / worker_count),
+            requests_per_minute=self.requests_per_minute / worker_count if self.requests_per_minute else None,
+            max_queue_wait_seconds=self.max_queue_wait_seconds
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": self.requests_per_minute,
+            "max_queue_wait_seconds": self.max_queue_wait_seconds,
+        }
+
+
+class _TenantState:
+    def __init__(self, policy: TenantPolicy):
+        self.policy = policy
+        self.queue: deque = deque()
+        self.running = 0
+        self.last_finish_tag = 0.0
+        self.tokens = policy.requests_per_minute or 0.0
+        self.tokens_updated = time.monotonic()
+        self.waits_ms: deque = deque(maxlen=500)
+        self.admitted = 0
+        self.rejected = 0
+
+
+class TenantScheduler:
+    """
+    مُجدول عادل موزون للطلبات المعتمدة على النماذج اللغوية
+
+    Each waiting request gets a virtual finish tag
+    max(virtual_time, tenant_last_tag) + 1/weight; a free slot always goes to
+    the smallest tag among tenants that are below their concurrency cap, so a
+    bulk tenant cannot push a small tenant's requests behind its backlog.
+
+    Requests without a tenant share the "default" tenant, which gets the
+    global concurrency cap unless a policy is configured for it, so existing
+    clients are not throttled to a per-tenant cap. Idle tenant states are
+    evicted least-recently-used once more than max_tenants are tracked.
+
+    All caps and quotas are configured for the whole deployment and divided
+    by worker_count (WEB_CONCURRENCY, the worker count uvicorn and gunicorn
+    read), because each worker process schedules on its own. Quotas assume
+    the load balancer spreads a tenant's requests evenly across workers.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        default_policy: Optional[TenantPolicy] = None,
+        policies: Optional[Dict[str, TenantPolicy]] = None,
+        default_service_seconds: float = 5.0,
+        max_tenants: Optional[int] = None,
+        worker_count: Optional[int] = None
+    ):
+        self.worker_count = max(1, worker_count or int(os.getenv("WEB_CONCURRENCY", "1")))
+        self.max_concurrency = math.ceil(
+            (max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "16"))) / self.worker_count
+        )
+        self.default_policy = (default_policy or TenantPolicy()).per_process(self.worker_count)
+        policies = policies if policies is not None else self._policies_from_env()
+        self.policies = {tenant: policy.per_process(self.worker_count) for tenant, policy in policies.items()}
+        self.default_service_seconds = default_service_seconds
+        self.max_tenants = max_tenants or int(os.getenv("LLM_SCHEDULER_MAX_TENANTS", "10000"))
+        self._tenants: "OrderedDict[str, _TenantState]" = OrderedDict()
+        self._service_seconds: Dict[str, float] = {}
+        self._running = 0
+        self._virtual_time = 0.0
+
+    @staticmethod
+    def _policies_from_env() -> Dict[str, TenantPolicy]:
+        raw = os.getenv("TENANT_SCHEDULER_POLICIES")
+        if not raw:
+            return {}
+        try:
+            return {tenant: TenantPolicy(**config) for tenant, config in json.loads(raw).items()}
+        except (ValueError, TypeError) as e:
+            logger.error(f"❌ Invalid TENANT_SCHEDULER_POLICIES: {e}")
+            return {}
+
+    @staticmethod
+    def tenant_id(tenant: Any) -> str:
+        """
+        التحقق من معرف المستأجر
+
+        Raises:
+            ValueError: إذا لم يكن نصاً مطبوعاً لا يتجاوز MAX_TENANT_ID_LENGTH حرفاً
+        """
+        if tenant is None or tenant == "":
+            return DEFAULT_TENANT
+        if not isinstance(tenant, str) or len(tenant) > MAX_TENANT_ID_LENGTH or not tenant.isprintable():
+            raise ValueError(f"Invalid tenant id: expected a printable string of at most {MAX_TENANT_ID_LENGTH} characters")
+        return tenant
+
+    def _policy_for(self, tenant: str) -> TenantPolicy:
+        if tenant in self.policies:
+            return self.policies[tenant]
+        if tenant == DEFAULT_TENANT:
+            return TenantPolicy(
+                weight=self.default_policy.weight,
+                max_concurrency=self.max_concurrency,
+                max_queue_wait_seconds=self.default_policy.max_queue_wait_seconds
+            )
+        return self.default_policy
+
+    def _state(self, tenant: str) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            self._evict_idle()
+            state = self._tenants[tenant] = _TenantState(self._policy_for(tenant))
+        else:
+            self._tenants.move_to_end(tenant)
+        return state
+
+    def _evict_idle(self) -> None:
+        # المستأجرون النشطون لا يُحذفون، لذا قد يتجاوز العدد الحد مؤقتاً تحت الضغط
+        excess = len(self._tenants) - self.max_tenants + 1
+        if excess <= 0:
+            return
+        for tenant in [t for t, s in self._tenants.items() if not s.queue and not s.running][:excess]:
+            del self._tenants[tenant]
+
+    # ----------------------------------------------------------- admission
+
+    def _quota_retry_after(self, state: _TenantState) -> Optional[int]:
+        """يرجع None عند توفر الحصة، أو عدد الثواني حتى توفرها (دون استهلاك)"""
+        rate = state.policy.requests_per_minute
+        if not rate:
+            return None
+        now = time.monotonic()
+        state.tokens = min(rate, state.tokens + (now - state.tokens_updated) * rate / 60)
+        state.tokens_updated = now
+        if state.tokens >= 1:
+            return None
+        return max(1, math.ceil((1 - state.tokens) * 60 / rate))
+
+    def estimate_wait_seconds(self, tenant: str, endpoint: str = "default") -> float:
+        """تقدير زمن الانتظار لطلب جديد من هذا المستأجر"""
+        state = self._state(tenant)
+        if self._running < self.max_concurrency and state.running < state.policy.max_concurrency and not state.queue:
+            return 0.0
+        active_weight = sum(s.policy.weight for s in self._tenants.values() if s.queue or s.running) or state.policy.weight
+        if not (state.queue or state.running):
+            active_weight += state.policy.weight
+        share = self.max_concurrency * state.policy.weight / active_weight
+        slots = max(min(share, state.policy.max_concurrency), 1e-6)
+        service = self._service_seconds.get(endpoint, self.default_service_seconds)
+        return (len(state.queue) + 1) * service / slots
+
+    def _admit(self, tenant: str, endpoint: str) -> _TenantState:
+        state = self._state(tenant)
+        retry_after = self._quota_retry_after(state)
+        if retry_after is not None:
+            state.rejected += 1
+            raise AdmissionRejected(tenant, "quota_exceeded", retry_after)
+
+        estimated = self.estimate_wait_seconds(tenant, endpoint)
+        if estimated > state.policy.max_queue_wait_seconds:
+            state.rejected += 1
+            raise AdmissionRejected(
+                tenant, "queue_deadline_exceeded",
+                max(1, math.ceil(estimated - state.policy.max_queue_wait_seconds))
+            )
+        # الحصة تُستهلك فقط بعد قبول الطلب في الطابور
+        if state.policy.requests_per_minute:
+            state.tokens -= 1
+        return state
+
+    # ---------------------------------------------------------- scheduling
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrency:
+            candidates = [
+                s for s in self._tenants.values()
+                if s.queue and s.running < s.policy.max_concurrency
+            ]
+            if not candidates:
+                return
+            state = min(candidates, key=lambda s: s.queue[0][0])
+            tag, future, _ = state.queue.popleft()
+            if future.done():
+                continue
+            self._virtual_time = max(self._virtual_time, tag)
+            state.running += 1
+            self._running += 1
+            future.set_result(True)
+
+    def _release(self, state: _TenantState, endpoint: str, service_seconds: float) -> None:
+        state.running -= 1
+        self._running -= 1
+        previous = self._service_seconds.get(endpoint, service_seconds)
+        self._service_seconds[endpoint] = 0.8 * previous + 0.2 * service_seconds
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tenant: Optional[str], endpoint: str = "default") -> AsyncIterator[None]:
+        """
+        حجز مكان تنفيذ لطلب مستأجر
+
+        Raises:
+            AdmissionRejected: عند تجاوز الحصة أو عدم إمكانية الالتزام بمهلة الطابور
+            ValueError: عند معرف مستأجر غير صالح
+        """
+        tenant = self.tenant_id(tenant)
+        state = self._admit(tenant, endpoint)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tag = max(self._virtual_time, state.last_finish_tag) + 1.0 / state.policy.weight
+        state.last_finish_tag = tag
+        entry = (tag, future, time.monotonic())
+        state.queue.append(entry)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=state.policy.max_queue_wait_seconds)
+        except asyncio.TimeoutError:
+            if future.done():
+                self._release(state, endpoint, self.default_service_seconds)
+            else:
+                future.cancel()
+                if entry in state.queue:
+                    state.queue.remove(entry)
+            state.rejected += 1
+            raise AdmissionRejected(tenant, "queue_wait_timeout", max(1, math.ceil(state.policy.max_queue_wait_seconds / 2)))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(state, endpoint, 0.0)
+            else:
+                future.cancel()
+                if entry in state.queue:
+                    state.queue.remove(entry)
+            raise
+
+        state.admitted += 1
+        state.waits_ms.append((time.monotonic() - entry[2]) * 1000)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(state, endpoint, time.monotonic() - started)
+
+    # ------------------------------------------------------------- metrics
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """مقاييس الانتظار والتنفيذ لكل مستأجر"""
+        tenants = {}
+        for tenant, state in self._tenants.items():
+            waits = sorted(state.waits_ms)
+            tenants[tenant] = {
+                "queued": len(state.queue),
+                "running": state.running,
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "avg_queue_wait_ms": round(sum(waits) / len(waits), 2) if waits else 0.0,
+                "p95_queue_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0.0,
+                "policy": state.policy.to_dict(),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "worker_count": self.worker_count,
+            "running": self._running,
+            "service_seconds": {k: round(v, 3) for k, v in self._service_seconds.items()},
+            "tenants": tenants,
+        }
+
+
+tenant_scheduler = TenantScheduler()
@@ -0,0 +1,738 @@
+"""
+Inbound Pipeline - خط معالجة الرسائل الواردة
+Webhook receipt becomes a durable append plus an immediate ack. Messages are
+deduplicated by provider message ID across worker processes, kept in order
+per conversation, processed by a worker pool in micro-batches, and replies
+are sent in batches.
+"""
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import hashlib
+import inspect
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple, Mapping, Iterator
+
+from loguru import logger
+
+
+InboundHandler = Callable[[List[Dict[str, Any]]], Awaitable[Any]]
+# يرجع نتيجة لكل رسالة بنفس الترتيب؛ النتيجة من نوع Exception تعني فشل تلك الرسالة فقط
+OutboundSender = Callable[[str, List[Dict[str, Any]]], Awaitable[List[Any]]]
+
+
+def verify_webhook(provider: str, headers: Mapping[str, str], raw_body: bytes) -> bool:
+    """
+    التحقق من توقيع أو سر الويب هوك (يرفض عند غياب السر)
+
+    - whatsapp: X-Hub-Signature-256 = sha256 HMAC of the raw body with WHATSAPP_APP_SECRET
+    - telegram: X-Telegram-Bot-Api-Secret-Token equals TELEGRAM_WEBHOOK_SECRET
+    - others:   X-Webhook-Token equals WEBHOOK_SECRET_<PROVIDER> or WEBHOOK_SECRET
+    """
+    headers = {k.lower(): v for k, v in headers.items()}
+    if provider == "whatsapp":
+        secret = os.getenv("WHATSAPP_APP_SECRET")
+        if not secret:
+            return False
+        expected = "sha256=" + hmac.new(secret.encode("utf-8"), raw_body, hashlib.sha256).hexdigest()
+        provided = headers.get("x-hub-signature-256", "")
+    elif provider == "telegram":
+        expected = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+        provided = headers.get("x-telegram-bot-api-secret-token", "")
+    else:
+        expected = (
+            os.getenv(f"WEBHOOK_SECRET_{re.sub(r'[^A-Za-z0-9]', '_', provider).upper()}")
+            or os.getenv("WEBHOOK_SECRET")
+        )
+        provided = headers.get("x-webhook-token", "")
+    if not expected:
+        return False
+    return hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8"))
+
+
+def verify_subscription(provider: str, params: Mapping[str, str]) -> Optional[str]:
+    """
+    التحقق من طلب تسجيل الويب هوك (hub.challenge)
+
+    WhatsApp (Meta) sends GET ?hub.mode=subscribe&hub.verify_token=...&hub.challenge=...
+    when the webhook is configured. Returns the challenge to echo back when
+    the token equals WHATSAPP_VERIFY_TOKEN, otherwise None.
+    """
+    if provider != "whatsapp":
+        return None
+    expected = os.getenv("WHATSAPP_VERIFY_TOKEN")
+    challenge = params.get("hub.challenge")
+    if not expected or params.get("hub.mode") != "subscribe" or not challenge:
+        return None
+    if not hmac.compare_digest(params.get("hub.verify_token", "").encode("utf-8"), expected.encode("utf-8")):
+        return None
+    return challenge
+
+
+def parse_webhook(provider: str, payload: Any) -> List[Dict[str, Any]]:
+    """
+    تحويل حمولة الويب هوك إلى رسائل موحدة
+
+    Supports WhatsApp Cloud API, Telegram updates and a generic
+    {message_id, conversation_id, user_id, text} shape.
+
+    Raises:
+        ValueError: إذا لم تكن الحمولة بالشكل المتوقع للمزود
+    """
+    if not isinstance(payload, dict):
+        raise ValueError(f"{provider} webhook payload must be a JSON object")
+    try:
+        messages = _extract_messages(provider, payload)
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"Malformed {provider} webhook payload: {e}") from e
+
+    received_at = time.time()
+    for msg in messages:
+        msg["provider"] = provider
+        msg["received_at"] = received_at
+    return [m for m in messages if m["conversation_id"]]
+
+
+def _extract_messages(provider: str, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    messages = []
+    if provider == "whatsapp":
+        for entry in payload.get("entry", []):
+            for change in entry.get("changes", []):
+                for msg in change.get("value", {}).get("messages", []):
+                    messages.append({
+                        "message_id": msg.get("id"),
+                        "conversation_id": msg.get("from"),
+                        "user_id": msg.get("from"),
+                        "text": msg.get("text", {}).get("body", ""),
+                        "type": msg.get("type", "text"),
+                    })
+    elif provider == "telegram":
+        msg = payload.get("message") or payload.get("edited_message") or {}
+        if msg:
+            messages.append({
+                "message_id": str(payload.get("update_id") or msg.get("message_id")),
+                "conversation_id": str(msg.get("chat", {}).get("id")),
+                "user_id": str(msg.get("from", {}).get("id")),
+                "text": msg.get("text", ""),
+                "type": "text",
+            })
+    else:
+        for msg in payload.get("messages", [payload]):
+            messages.append({
+                "message_id": msg.get("message_id") or msg.get("id"),
+                "conversation_id": msg.get("conversation_id") or msg.get("user_id"),
+                "user_id": msg.get("user_id"),
+                "text": msg.get("text", ""),
+                "type": msg.get("type", "text"),
+            })
+    return messages
+
+
+class InboundJournal:
+    """
+    سجل الرسائل الواردة المشترك بين العمليات
+
+    An append-only JSON-lines log in a directory shared by all workers.
+    Every write happens under an exclusive flock after replaying the log, so
+    the dedup window and the pending count are global. Accepted messages
+    are fsynced before the webhook is acknowledged. One elected process
+    consumes the log and marks messages done; whatever is not done when it
+    stops or crashes is replayed by the next consumer (at-least-once).
+    compact() rewrites the log with only the pending messages and the
+    dedup window, and bumps GENERATION so readers reload.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dedup_capacity: int = 100_000,
+        dedup_ttl_seconds: float = 24 * 3600,
+        max_pending: int = 100_000,
+        compact_bytes: int = 64 * 1024 * 1024
+    ):
+        self.directory = directory
+        self.dedup_capacity = dedup_capacity
+        self.dedup_ttl_seconds = dedup_ttl_seconds
+        self.max_pending = max_pending
+        self.compact_bytes = compact_bytes
+        self._log_path = os.path.join(directory, "journal.log")
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._fresh: List[Tuple[str, Dict[str, Any]]] = []
+        self._replay = True
+        self._offset = 0
+        self._generation = -1
+        self._lock = threading.Lock()
+        self._consumer_lock_file = None
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(os.path.join(self.directory, "journal.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_generation(self) -> int:
+        try:
+            with open(os.path.join(self.directory, "GENERATION"), "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _refresh(self) -> None:
+        """تطبيق ما أضافته العمليات الأخرى؛ يُستدعى تحت قفل الملف فقط"""
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._seen.clear()
+            self._pending.clear()
+            self._fresh.clear()
+            self._replay = True
+            self._offset = 0
+            self._generation = generation
+        try:
+            with open(self._log_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError):
+                logger.warning("⚠️ Skipping unreadable inbound journal line")
+        self._offset += end
+        if end < len(data):
+            # بقايا كتابة منقطعة (انهيار أثناء الإلحاق)؛ نحن الكاتب الوحيد الآن تحت القفل
+            os.truncate(self._log_path, self._offset)
+
+    def _apply(self, op: Dict[str, Any]) -> None:
+        kind, message_id = op["op"], op["id"]
+        if kind == "enqueue":
+            self._seen[message_id] = op["ts"]
+            self._pending[message_id] = op["message"]
+            if self._consumer_lock_file is not None:
+                self._fresh.append((message_id, op["message"]))
+        elif kind == "seen":
+            self._seen[message_id] = op["ts"]
+        elif kind == "done":
+            self._pending.pop(message_id, None)
+
+    def _is_duplicate(self, message_id: str, now: float) -> bool:
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if len(self._seen) < self.dedup_capacity and now - seen_at < self.dedup_ttl_seconds:
+                break
+            self._seen.pop(oldest_id)
+        return message_id in self._seen
+
+    def _append(self, ops: List[Dict[str, Any]], durable: bool) -> None:
+        with open(self._log_path, "ab") as f:
+            f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops).encode("utf-8"))
+            f.flush()
+            if durable:
+                os.fsync(f.fileno())
+        self._refresh()
+
+    def accept(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """
+        حفظ الرسائل قبل الرد على المزود
+
+        Returns:
+            List[str]: queued أو duplicate أو rejected لكل رسالة بالترتيب
+        """
+        statuses, ops = [], []
+        with self._file_lock():
+            now = time.time()
+            batch_ids = set()
+            for message in messages:
+                if message.get("message_id"):
+                    message_id = f"{message['provider']}:{message['message_id']}"
+                    if message_id in batch_ids or self._is_duplicate(message_id, now):
+                        statuses.append("duplicate")
+                        continue
+                else:
+                    message_id = f"{message['provider']}:~{uuid.uuid4().hex}"
+                if len(self._pending) + len(ops) >= self.max_pending:
+                    statuses.append("rejected")
+                    continue
+                batch_ids.add(message_id)
+                ops.append({"op": "enqueue", "id": message_id, "ts": now, "message": message})
+                statuses.append("queued")
+            if ops:
+                self._append(ops, durable=True)
+        return statuses
+
+    def mark_done(self, message_ids: List[str]) -> None:
+        if not message_ids:
+            return
+        with self._file_lock():
+            self._append([{"op": "done", "id": message_id, "ts": time.time()} for message_id in message_ids], durable=False)
+
+    def take_new(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        الرسائل المعلقة التي لم يستلمها المستهلك بعد، بترتيب السجل
+
+        The first call after election (or after a compaction) returns every
+        pending message, so work left by a crashed consumer is replayed.
+        """
+        with self._file_lock():
+            if self._replay:
+                fresh = list(self._pending.items())
+                self._replay = False
+            else:
+                fresh = [(message_id, message) for message_id, message in self._fresh if message_id in self._pending]
+            self._fresh.clear()
+        return fresh
+
+    def needs_compaction(self) -> bool:
+        try:
+            return os.path.getsize(self._log_path) > self.compact_bytes
+        except FileNotFoundError:
+            return False
+
+    def compact(self) -> None:
+        """إعادة كتابة السجل بالرسائل المعلقة ونافذة إزالة التكرار فقط"""
+        with self._file_lock():
+            self._is_duplicate("", time.time())
+            ops = [
+                {"op": "seen", "id": message_id, "ts": ts}
+                for message_id, ts in self._seen.items() if message_id not in self._pending
+            ]
+            ops.extend(
+                {"op": "enqueue", "id": message_id, "ts": self._seen.get(message_id, time.time()), "message": message}
+                for message_id, message in self._pending.items()
+            )
+            tmp_path = f"{self._log_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._log_path)
+            gen_path = os.path.join(self.directory, "GENERATION")
+            with open(f"{gen_path}.tmp", "w") as f:
+                f.write(str(self._generation + 1))
+            os.replace(f"{gen_path}.tmp", gen_path)
+            self._refresh()
+        logger.info(f"🧹 Inbound journal compacted: {len(self._pending)} pending, {len(self._seen)} ids in dedup window")
+
+    def try_become_consumer(self) -> bool:
+        """انتخاب عملية واحدة تستهلك السجل (قفل غير حاجز)"""
+        if self._consumer_lock_file is not None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, "consumer.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        with self._lock:
+            self._consumer_lock_file = lock_file
+            self._replay = True
+        return True
+
+    def release_consumer(self) -> None:
+        with self._lock:
+            if self._consumer_lock_file is not None:
+                self._consumer_lock_file.close()
+                self._consumer_lock_file = None
+            self._fresh.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "dedup_window": len(self._seen),
+                "consumer": self._consumer_lock_file is not None,
+            }
+
+
+class InboundPipeline:
+    """
+    خط استقبال الرسائل عالي الإنتاجية
+
+    A conversation is owned by at most one worker at a time, which preserves
+    per-conversation order while different conversations run in parallel.
+    A worker that picks up a conversation waits batch_window_ms for the rest
+    of a burst, then hands up to max_batch_size messages to the handler.
+
+    With a journal, accept() only appends to it. The elected consumer
+    process feeds the journal into its own queues and marks batches done,
+    so dedup and per-conversation order hold across worker processes.
+    Without one (tests, single process) accept() queues in memory.
+    """
+
+    def __init__(
+        self,
+        handler: Optional[InboundHandler] = None,
+        num_workers: int = 8,
+        max_batch_size: int = 10,
+        batch_window_ms: float = 50.0,
+        dedup_capacity: int = 100_000,
+        dedup_ttl_seconds: float = 24 * 3600,
+        max_pending: int = 100_000,
+        max_retries: int = 2,
+        journal: Optional[InboundJournal] = None,
+        poll_interval_ms: float = 50.0
+    ):
+        self.handler = handler
+        self.journal = journal
+        self.poll_interval_ms = poll_interval_ms
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.batch_window_ms = batch_window_ms
+        self.dedup_capacity = dedup_capacity
+        self.dedup_ttl_seconds = dedup_ttl_seconds
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self._seen: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._conversations: Dict[Tuple[str, str], deque] = {}
+        self._scheduled: set = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._consumer: Optional[asyncio.Task] = None
+        self._journal_ids: set = set()
+        self._pending = 0
+        self.dead_letters: deque = deque(maxlen=1000)
+        self.stats = {
+            "received": 0, "duplicates": 0, "rejected": 0,
+            "processed": 0, "batches": 0, "failed_batches": 0,
+        }
+
+    def set_handler(self, handler: InboundHandler) -> None:
+        self.handler = handler
+
+    # ------------------------------------------------------------ lifecycle
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        for key in self._scheduled:
+            self._ready.put_nowait(key)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        if self.journal is not None:
+            self._consumer = asyncio.create_task(self._consume_journal())
+        logger.info(f"📨 Inbound pipeline started with {self.num_workers} workers")
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """
+        إيقاف العمال بعد تفريغ الطوابير (بحد أقصى drain_timeout)
+
+        With a journal, messages still pending afterwards stay in it and are
+        replayed by the next consumer.
+        """
+        if self._consumer is not None:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+            self._consumer = None
+        deadline = time.monotonic() + drain_timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self.journal is not None:
+            self.journal.release_consumer()
+        logger.info(f"📨 Inbound pipeline stopped ({self._pending} messages still pending)")
+
+    async def _consume_journal(self) -> None:
+        while True:
+            try:
+                if not await asyncio.to_thread(self.journal.try_become_consumer):
+                    await asyncio.sleep(2.0)
+                    continue
+                for message_id, message in await asyncio.to_thread(self.journal.take_new):
+                    if message_id not in self._journal_ids:
+                        self._journal_ids.add(message_id)
+                        self._enqueue(dict(message, journal_id=message_id))
+                if self.journal.needs_compaction():
+                    await asyncio.to_thread(self.journal.compact)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Inbound journal consumer failed: {e}")
+            await asyncio.sleep(self.poll_interval_ms / 1000)
+
+    # -------------------------------------------------------------- intake
+
+    def _is_duplicate(self, key: Tuple[str, str]) -> bool:
+        now = time.time()
+        while self._seen:
+            oldest_key, seen_at = next(iter(self._seen.items()))
+            if len(self._seen) < self.dedup_capacity and now - seen_at < self.dedup_ttl_seconds:
+                break
+            self._seen.pop(oldest_key)
+        return key in self._seen
+
+    def accept(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """
+        استلام رسائل ويب هوك واحد
+
+        With a journal this does blocking file I/O, so call it off the event
+        loop (asyncio.to_thread). Returns queued/duplicate/rejected per message.
+        """
+        if self.journal is None:
+            return [self.submit(message) for message in messages]
+        statuses = self.journal.accept(messages)
+        self.stats["received"] += len(statuses)
+        self.stats["duplicates"] += statuses.count("duplicate")
+        self.stats["rejected"] += statuses.count("rejected")
+        return statuses
+
+    def submit(self, message: Dict[str, Any]) -> str:
+        """
+        إدخال رسالة دون انتظار معالجتها
+
+        The message ID is remembered only once the message is queued, so a
+        redelivery after a "rejected" answer is accepted rather than dropped.
+
+        Returns:
+            str: queued أو duplicate أو rejected (عند امتلاء الطابور)
+        """
+        self.stats["received"] += 1
+        dedup_key = (message["provider"], str(message["message_id"])) if message.get("message_id") else None
+        if dedup_key and self._is_duplicate(dedup_key):
+            self.stats["duplicates"] += 1
+            return "duplicate"
+        if self._pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            return "rejected"
+
+        self._enqueue(message)
+        if dedup_key:
+            self._seen[dedup_key] = time.time()
+        return "queued"
+
+    def _enqueue(self, message: Dict[str, Any]) -> None:
+        key = (message["provider"], str(message["conversation_id"]))
+        self._conversations.setdefault(key, deque()).append(message)
+        self._pending += 1
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            if self._ready is not None:
+                self._ready.put_nowait(key)
+
+    # ------------------------------------------------------------- workers
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._conversations[key]
+            if len(queue) < self.max_batch_size and self.batch_window_ms > 0:
+                await asyncio.sleep(self.batch_window_ms / 1000)
+
+            batch = [queue.popleft() for _ in range(min(self.max_batch_size, len(queue)))]
+            try:
+                await self._handle_batch(batch)
+                await self._mark_done(batch)
+            finally:
+                self._pending -= len(batch)
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._conversations[key]
+                    self._scheduled.discard(key)
+
+    async def _mark_done(self, batch: List[Dict[str, Any]]) -> None:
+        """تعليم الدفعة كمنتهية في السجل (بما فيها الرسائل الميتة)"""
+        journal_ids = [message["journal_id"] for message in batch if "journal_id" in message]
+        if not journal_ids:
+            return
+        try:
+            await asyncio.to_thread(self.journal.mark_done, journal_ids)
+        except Exception as e:
+            # تبقى معلقة وتُعاد عند تغيير المستهلك (at-least-once)
+            logger.error(f"❌ Failed to mark {len(journal_ids)} inbound messages done: {e}")
+        finally:
+            self._journal_ids.difference_update(journal_ids)
+
+    async def _handle_batch(self, batch: List[Dict[str, Any]]) -> None:
+        if self.handler is None:
+            logger.warning(f"⚠️ No inbound handler registered, dropping batch of {len(batch)}")
+            return
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.handler(batch)
+                self.stats["processed"] += len(batch)
+                self.stats["batches"] += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.stats["failed_batches"] += 1
+                    self.dead_letters.append({"batch": batch, "error": str(e), "failed_at": time.time()})
+                    logger.error(f"❌ Inbound batch failed after {attempt + 1} attempts: {e}")
+                else:
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "pending": self._pending,
+            "active_conversations": len(self._conversations),
+            "avg_batch_size": round(self.stats["processed"] / self.stats["batches"], 2) if self.stats["batches"] else 0.0,
+            "dead_letters": len(self.dead_letters),
+            "workers": len(self._workers),
+            **({"journal": self.journal.get_stats()} if self.journal is not None else {}),
+        }
+
+
+class OutboundBatcher:
+    """تجميع الرسائل الصادرة وإرسالها دفعات لكل مزود"""
+
+    def __init__(
+        self,
+        sender: Optional[OutboundSender] = None,
+        max_batch_size: int = 50,
+        flush_interval_ms: float = 100.0
+    ):
+        self.sender = sender
+        self.max_batch_size = max_batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self._buffers: Dict[str, List[Tuple[Dict[str, Any], asyncio.Future]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "sent": 0, "batches": 0, "failed": 0}
+
+    def set_sender(self, sender: OutboundSender) -> None:
+        self.sender = sender
+
+    async def start(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    def send(self, provider: str, message: Dict[str, Any]) -> asyncio.Future:
+        """إضافة رسالة صادرة؛ المستقبل يكتمل عند إرسال الدفعة"""
+        future = asyncio.get_running_loop().create_future()
+        # المرسل قد لا ينتظر النتيجة؛ الأخطاء تُسجل في _flush_provider
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        buffer = self._buffers.setdefault(provider, [])
+        buffer.append((message, future))
+        self.stats["queued"] += 1
+        if len(buffer) >= self.max_batch_size:
+            asyncio.create_task(self._flush_provider(provider))
+        return future
+
+    async def _flush_provider(self, provider: str) -> None:
+        items = self._buffers.pop(provider, [])
+        if not items:
+            return
+        try:
+            if self.sender is None:
+                raise RuntimeError("No outbound sender registered")
+            results = await self.sender(provider, [message for message, _ in items])
+            if not isinstance(results, list) or len(results) != len(items):
+                raise TypeError(f"Outbound sender must return one result per message, got {type(results).__name__}")
+        except Exception as e:
+            self.stats["failed"] += len(items)
+            logger.error(f"❌ Outbound batch to {provider} failed: {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        failed = 0
+        for (_, future), result in zip(items, results):
+            if isinstance(result, Exception):
+                failed += 1
+                if not future.done():
+                    future.set_exception(result)
+            elif not future.done():
+                future.set_result(result)
+        self.stats["sent"] += len(items) - failed
+        self.stats["failed"] += failed
+        if failed:
+            logger.warning(f"⚠️ {failed} of {len(items)} messages to {provider} failed")
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(self._flush_provider(p) for p in list(self._buffers)))
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_ms / 1000)
+            await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "buffered": sum(len(b) for b in self._buffers.values())}
+
+
+def per_message_sender(send_one: Callable[[str, Dict[str, Any]], Awaitable[Any]]) -> OutboundSender:
+    """
+    مرسل دفعات لمزود لا يدعم الإرسال المجمّع
+
+    Sends the batch's messages concurrently; a failure is returned in that
+    message's slot instead of failing the rest of the batch.
+    """
+    async def send_batch(provider: str, messages: List[Dict[str, Any]]) -> List[Any]:
+        return list(await asyncio.gather(*(send_one(provider, m) for m in messages), return_exceptions=True))
+    return send_batch
+
+
+def bind_messaging_hub(hub: Any, pipeline: InboundPipeline, batcher: OutboundBatcher) -> bool:
+    """
+    ربط messaging_hub بخط الرسائل بعد التحقق من واجهته
+
+    The hub must provide:
+        async handle_inbound_batch(batch: List[dict]) -> Optional[dict]
+            one conversation's messages in order; a {"reply": str} result is
+            sent back to that conversation through the batcher
+        async send_batch(provider: str, messages: List[dict]) -> List[Any]
+            one result per message, an Exception instance for a failed one;
+            or, without batch support, async send_message(provider, message)
+
+    Returns False and leaves the pipeline without a handler when the hub
+    does not match, so the webhook refuses deliveries (and providers retry)
+    instead of dead-lettering every batch.
+    """
+    def _async_method(name: str) -> Optional[Callable]:
+        method = getattr(hub, name, None)
+        return method if inspect.iscoroutinefunction(method) else None
+
+    handle_batch = _async_method("handle_inbound_batch")
+    send_batch = _async_method("send_batch")
+    send_one = _async_method("send_message")
+    if handle_batch is None or (send_batch is None and send_one is None):
+        logger.error(
+            "❌ messaging_hub does not implement the inbound pipeline contract "
+            "(async handle_inbound_batch and send_batch/send_message); webhooks will be refused"
+        )
+        return False
+
+    async def handle(batch: List[Dict[str, Any]]) -> None:
+        result = await handle_batch(batch)
+        if isinstance(result, dict) and result.get("reply"):
+            first = batch[0]
+            batcher.send(first["provider"], {"to": first["conversation_id"], "text": result["reply"]})
+
+    if send_batch is None:
+        logger.info("📨 messaging_hub has no send_batch, outbound replies are sent one request per message")
+    pipeline.set_handler(handle)
+    batcher.set_sender(send_batch or per_message_sender(send_one))
+    return True
+
+
+inbound_pipeline = InboundPipeline(
+    journal=InboundJournal(os.getenv("INBOUND_JOURNAL_DIR", "data/inbound"))
+)
+outbound_batcher = OutboundBatcher()
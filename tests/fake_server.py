@@ -0,0 +1,22 @@
+"""
+Surooh Academy app wired to the local fakes, for load tests
+
+    uvicorn tests.fake_server:app --port 5000    (or `make load-server`)
+
+The instructor, trainers and semantic search are replaced by the seeded
+stand-ins from tests/fakes.py, and every on-disk store is redirected to
+FAKE_SERVER_DATA_DIR (a fresh temporary directory by default), so a Locust
+run costs nothing and leaves no state in the working tree.
+"""
+import os
+import tempfile
+
+import main
+from tests.fakes import fake_backends
+
+DATA_DIR = os.getenv("FAKE_SERVER_DATA_DIR") or tempfile.mkdtemp(prefix="surooh-fake-server-")
+
+for _name, _value in fake_backends(DATA_DIR).items():
+    setattr(main, _name, _value)
+
+app = main.app
@@ -0,0 +1,164 @@
+"""
+Deterministic local stand-ins for Vertex AI, OpenAI and external integrations
+
+Every fake draws latency from a seeded log-normal distribution described by
+its median and p99, and fails with a configurable error rate, so benchmarks
+and load scenarios are reproducible and cost nothing.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+from typing import Any, Dict, List, Optional
+
+
+class FakeServiceError(Exception):
+    """Error raised by a fake service to simulate a provider failure."""
+
+
+class LatencyProfile:
+    """Seeded latency and error distribution for a fake service."""
+
+    def __init__(self, median_ms: float = 20.0, p99_ms: float = 100.0, error_rate: float = 0.0, seed: int = 0):
+        self.median_ms = median_ms
+        self.p99_ms = max(p99_ms, median_ms)
+        self.error_rate = error_rate
+        self._mu = math.log(median_ms) if median_ms > 0 else 0.0
+        self._sigma = math.log(self.p99_ms / median_ms) / 2.326 if median_ms > 0 else 0.0
+        self._rng = random.Random(seed)
+
+    def sample_ms(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self._rng.lognormvariate(self._mu, self._sigma)
+
+    async def wait(self) -> float:
+        """Sleep for one latency sample, then maybe raise FakeServiceError."""
+        latency_ms = self.sample_ms()
+        await asyncio.sleep(latency_ms / 1000)
+        if self._rng.random() < self.error_rate:
+            raise FakeServiceError(f"simulated failure after {latency_ms:.1f}ms")
+        return latency_ms
+
+
+class FakeGenerationResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeVertexModel:
+    """Stand-in for vertexai GenerativeModel."""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None, response: Optional[Dict[str, Any]] = None, name: str = "fake-gemini"):
+        self.latency = latency or LatencyProfile()
+        self.response = response or {"status": "ok"}
+        self.name = name
+        self.calls = 0
+
+    async def generate_content_async(self, prompt: Any, **kwargs: Any) -> FakeGenerationResponse:
+        self.calls += 1
+        await self.latency.wait()
+        return FakeGenerationResponse(json.dumps(self.response, ensure_ascii=False))
+
+
+class FakeOpenAIEmbeddings:
+    """Stand-in for openai.embeddings with deterministic hash-based vectors."""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None, dimensions: int = 64):
+        self.latency = latency or LatencyProfile(median_ms=10, p99_ms=40)
+        self.dimensions = dimensions
+
+    def _vector(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [(digest[i % len(digest)] - 128) / 128 for i in range(self.dimensions)]
+
+    async def create(self, input: Any, model: str = "text-embedding-3-small") -> Dict[str, Any]:
+        await self.latency.wait()
+        texts = [input] if isinstance(input, str) else list(input)
+        return {"data": [{"index": i, "embedding": self._vector(t)} for i, t in enumerate(texts)], "model": model}
+
+
+class FakeIntegration:
+    """Stand-in for messaging/email/e-commerce providers that records sent payloads."""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None):
+        self.latency = latency or LatencyProfile(median_ms=5, p99_ms=30)
+        self.sent: List[Any] = []
+
+    async def send(self, payload: Any) -> Dict[str, Any]:
+        await self.latency.wait()
+        self.sent.append(payload)
+        return {"status": "sent", "id": len(self.sent)}
+
+
+class FakeInstructor:
+    """Stand-in for server.academy.instructor.instructor."""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None):
+        self.latency = latency or LatencyProfile()
+
+    async def propose_bots(self, project_description: str, trace_id: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        await self.latency.wait()
+        return {
+            "bots": [
+                {"name": "customer_support_bot", "type": "customer_support", "capabilities": ["order_tracking", "faq"]},
+                {"name": "pricing_bot", "type": "pricing_engine", "capabilities": ["competitor_tracking"]},
+            ],
+            "total_bots": 2,
+            "trace_id": trace_id,
+        }
+
+
+class FakeTrainer:
+    """Stand-in for server.academy.trainers.customer_support_trainer.trainer."""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None):
+        self.latency = latency or LatencyProfile()
+
+    async def generate_training_plan(self, bot_config: Dict[str, Any], sample_conversations: Optional[List[str]] = None, trace_id: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        await self.latency.wait()
+        return {
+            "bot_name": bot_config.get("name", "bot"),
+            "training_steps": [{"step": i, "title": f"step {i}"} for i in range(1, 6)],
+        }
+
+
+class FakeSemanticSearchEngine:
+    """Stand-in for server.core.semantic_search.get_search_engine()."""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None, corpus_size: int = 50):
+        self.latency = latency or LatencyProfile(median_ms=15, p99_ms=60)
+        self.corpus = [{"id": f"doc-{i}", "text": f"مستند رقم {i}"} for i in range(corpus_size)]
+
+    async def search(self, query: str, top_k: int = 10, **kwargs: Any) -> List[Dict[str, Any]]:
+        await self.latency.wait()
+        start = int(hashlib.md5(query.encode("utf-8")).hexdigest(), 16) % len(self.corpus)
+        return [dict(self.corpus[(start + i) % len(self.corpus)], score=1.0 / (i + 1)) for i in range(top_k)]
+
+
+def fake_backends(data_dir: str) -> Dict[str, Any]:
+    """Replacements for main's LLM clients and on-disk stores, keyed by attribute name."""
+    from server.academy.specialization_cache import SpecializationCompiler
+    from server.academy.trainers.support_fast_path import SupportFastPathRegistry
+    from server.core.hybrid_search import HybridSearchEngine
+    from server.core.packed_archive import PackedArchiveStore
+
+    instructor = FakeInstructor(LatencyProfile(median_ms=5, p99_ms=25, seed=1))
+    trainer = FakeTrainer(LatencyProfile(median_ms=5, p99_ms=25, seed=2))
+    search_engine = FakeSemanticSearchEngine(LatencyProfile(median_ms=3, p99_ms=15, seed=3))
+    hybrid_engine = HybridSearchEngine(storage_path=os.path.join(data_dir, "hybrid_index", "postings.json"))
+    packed_archive = PackedArchiveStore(root_dir=os.path.join(data_dir, "packed_archive"))
+    return {
+        "instructor": instructor,
+        "backup_instructor": instructor,
+        "trainer": trainer,
+        "backup_trainer": trainer,
+        "get_search_engine": lambda: search_engine,
+        "get_hybrid_search_engine": lambda: hybrid_engine,
+        "get_packed_archive": lambda: packed_archive,
+        "specialization_compiler": SpecializationCompiler(storage_dir=os.path.join(data_dir, "specializations")),
+        "support_fast_path": SupportFastPathRegistry(storage_dir=os.path.join(data_dir, "fast_path")),
+        "ARCHIVE_DIR": os.path.join(data_dir, "archive"),
+    }
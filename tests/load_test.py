@@ -0,0 +1,55 @@
+"""
+Locust load test for a running Surooh Academy server
+
+    make load-server    # app with the LLM fakes from tests/fakes.py on :5000
+    locust -f tests/load_test.py --host=http://localhost:5000
+
+Against a server started normally (`make run`) or a staging deployment,
+every intake/train request reaches Vertex AI.
+"""
+import random
+import uuid
+
+from locust import HttpUser, between, task
+
+DESCRIPTIONS = [
+    "نريد بناء متجر إلكتروني في هولندا يحتاج دعم عملاء ذكي ومحرك تسعير ديناميكي",
+    "منصة حجوزات فنادق تحتاج بوت دعم متعدد اللغات وتحليلات يومية",
+    "شركة شحن تحتاج تتبع الطلبات وإدارة المرتجعات",
+]
+
+QUERIES = ["سياسة الإرجاع", "تتبع الطلب", "أسعار الشحن إلى هولندا", "refund policy"]
+
+
+class AcademyUser(HttpUser):
+    wait_time = between(0.1, 0.5)
+
+    def on_start(self):
+        self.tenant = f"load-tenant-{random.randint(1, 10)}"
+
+    @task(3)
+    def semantic_search(self):
+        self.client.post(
+            "/core/hybrid_search",
+            json={"query": random.choice(QUERIES), "top_k": 10},
+            name="/core/hybrid_search",
+        )
+
+    @task(2)
+    def intake(self):
+        self.client.post(
+            "/academy/intake",
+            json={"description": random.choice(DESCRIPTIONS), "tenant": self.tenant, "trace_id": f"load-{uuid.uuid4()}"},
+            name="/academy/intake",
+        )
+
+    @task(1)
+    def train(self):
+        self.client.post(
+            "/academy/train",
+            json={
+                "bot_config": {"name": "support_bot", "type": "customer_support", "tenant": self.tenant, "capabilities": ["faq"]},
+                "sample_conversations": ["العميل: ما هي سياسة الإرجاع؟", "البوت: يمكنك الإرجاع خلال 14 يوماً."],
+            },
+            name="/academy/train",
+        )
@@ -0,0 +1,174 @@
+"""
+Load scenario runner and latency-regression baseline for Surooh Academy
+
+The baseline stores no absolute milliseconds. Every run measures all
+scenarios back to back for a few rounds, takes the per-scenario median of
+the rounds, and divides each metric by its geometric mean across the
+scenarios of that run. Machine speed scales every scenario
+alike and cancels out, so the committed tests/perf_baseline.json holds on
+any machine. A scenario that gets slower relative to the others is
+reported as a regression.
+
+`make perf-baseline` records PERF_BASELINE_RUNS runs (8 by default). It
+stores the median profile and a tolerance for each scenario and metric,
+derived from the spread it observed. `make perf` fails when a scenario leaves that band or
+returns errors.
+"""
+import asyncio
+import json
+import math
+import os
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_baseline.json")
+
+# المقاييس التي تُقارن نسبياً بين السيناريوهات
+# Tail percentiles of a few hundred requests on one shared event loop
+# swing 1.5-3x between runs even after taking medians, so only the median
+# latency and throughput are gated; p95/p99 stay in the printed results.
+RELATIVE_METRICS = ("p50_ms", "throughput_rps")
+# tolerance = max(MIN_TOLERANCE, observed spread ** SPREAD_MARGIN), as a factor
+MIN_TOLERANCE = 1.25
+SPREAD_MARGIN = 2.0
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies_ms: List[float], errors: int, elapsed_s: float) -> Dict[str, Any]:
+    ordered = sorted(latencies_ms)
+    total = len(latencies_ms) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed_s, 2) if elapsed_s else 0.0,
+        "p50_ms": round(percentile(ordered, 50), 2),
+        "p95_ms": round(percentile(ordered, 95), 2),
+        "p99_ms": round(percentile(ordered, 99), 2),
+    }
+
+
+async def run_load(
+    send: Callable[[int], Awaitable[bool]],
+    total_requests: int = 200,
+    concurrency: int = 20
+) -> Dict[str, Any]:
+    """
+    Fire total_requests calls of send(i) with bounded concurrency.
+
+    send must return True on success; exceptions and False count as errors.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies_ms: List[float] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await send(i)
+            except Exception:
+                ok = False
+            if ok:
+                latencies_ms.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total_requests)))
+    return summarize(latencies_ms, errors, time.perf_counter() - start)
+
+
+def median_result(rounds: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Per-scenario median of several rounds of the same scenarios."""
+    return {
+        scenario: {
+            **{
+                metric: statistics.median(r[scenario][metric] for r in rounds)
+                for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+            },
+            "requests": sum(r[scenario]["requests"] for r in rounds),
+            "errors": sum(r[scenario]["errors"] for r in rounds),
+        }
+        for scenario in rounds[0]
+    }
+
+
+def relative_profile(results: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Divide each metric by its geometric mean over the scenarios of one run."""
+    profile: Dict[str, Dict[str, float]] = {scenario: {} for scenario in results}
+    for metric in RELATIVE_METRICS:
+        values = {scenario: max(result[metric], 1e-9) for scenario, result in results.items()}
+        reference = math.exp(statistics.fmean(math.log(v) for v in values.values()))
+        for scenario, value in values.items():
+            profile[scenario][metric] = value / reference
+    return profile
+
+
+def build_baseline(runs: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Median relative profile of several runs, with a tolerance per metric.
+
+    A tolerance is the widest factor by which any run strayed from the
+    median, widened by SPREAD_MARGIN (in log space) and never below
+    MIN_TOLERANCE.
+    """
+    profiles = [relative_profile(run) for run in runs]
+    scenarios: Dict[str, Any] = {}
+    for scenario in sorted(runs[0]):
+        entry: Dict[str, Any] = {"tolerance": {}}
+        for metric in RELATIVE_METRICS:
+            ratios = [profile[scenario][metric] for profile in profiles]
+            median = statistics.median(ratios)
+            spread = max(abs(math.log(r / median)) for r in ratios)
+            entry[metric] = round(median, 4)
+            entry["tolerance"][metric] = round(max(MIN_TOLERANCE, math.exp(spread * SPREAD_MARGIN)), 3)
+        entry["errors"] = max(run[scenario]["errors"] for run in runs)
+        scenarios[scenario] = entry
+    return {
+        "note": "metrics relative to the geometric mean of all scenarios in the same run",
+        "runs": len(runs),
+        "scenarios": scenarios,
+    }
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(baseline: Dict[str, Any], path: str = BASELINE_PATH) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    """Compare one run of every scenario against the relative baseline."""
+    expected = baseline.get("scenarios", {})
+    measured = {scenario: result for scenario, result in results.items() if scenario in expected}
+    if len(measured) < 2:
+        return []
+    profile = relative_profile(measured)
+    problems = []
+    for scenario, ratios in profile.items():
+        entry = expected[scenario]
+        tolerance = entry["tolerance"]
+        limit = entry["p50_ms"] * tolerance["p50_ms"]
+        if ratios["p50_ms"] > limit:
+            problems.append(f"{scenario}: relative p50_ms {ratios['p50_ms']:.3f} > {limit:.3f}")
+        floor = entry["throughput_rps"] / tolerance["throughput_rps"]
+        if ratios["throughput_rps"] < floor:
+            problems.append(f"{scenario}: relative throughput_rps {ratios['throughput_rps']:.3f} < {floor:.3f}")
+        if measured[scenario]["errors"] > entry.get("errors", 0):
+            problems.append(f"{scenario}: errors {measured[scenario]['errors']} > {entry.get('errors', 0)}")
+    return problems
@@ -0,0 +1,99 @@
+"""
+Micro-benchmarks for hot paths (pytest-benchmark)
+
+Run with `make bench`; results are saved and compared against the previous
+saved run, failing when the mean regresses by more than 25%.
+"""
+import pytest
+
+from server.academy.specialization_cache import SpecializationCompiler
+from server.academy.trainers.support_fast_path import SupportFastPath, extract_slots
+from server.core.arabic_text import tokenize
+from server.core.hybrid_search import InvertedIndex
+from server.core.packed_archive import PackedArchiveStore
+from tests.fakes import FakeOpenAIEmbeddings
+
+ARABIC_TEXT = "نريد بناء متجر إلكتروني في هولندا يحتاج دعم عملاء ذكي ومحرك تسعير ديناميكي وتحليلات يومية"
+
+BOT_CONFIG = {
+    "name": "support_bot_v2",
+    "type": "customer_support",
+    "capabilities": ["order_tracking", "product_info", "returns", "escalation"],
+    "language": "arabic",
+    "tone": "friendly_professional",
+    "kpis": {"accuracy": 0.92, "response_time_seconds": 3},
+}
+
+
+@pytest.fixture(scope="module")
+def search_index():
+    index = InvertedIndex()
+    for i in range(5000):
+        index.add(f"doc-{i}", f"{ARABIC_TEXT} مستند {i} الطلب {i % 97} الإرجاع {i % 13}")
+    return index
+
+
+@pytest.fixture(scope="module")
+def fast_path():
+    faqs = [{"question": f"سؤال شائع رقم {i} عن الشحن والإرجاع", "answer": f"إجابة {i}"} for i in range(500)]
+    faqs.append({"question": "أريد تتبع طلبي رقم 12345", "answer": "جاري تتبع الطلب 12345"})
+    return SupportFastPath.build(faqs=faqs)
+
+
+@pytest.fixture
+def packed_store(tmp_path):
+    store = PackedArchiveStore(root_dir=str(tmp_path))
+    for i in range(2000):
+        store.put(f"archive/{i % 20}/file-{i}.txt", ARABIC_TEXT.encode("utf-8"))
+    yield store
+    store.close()
+
+
+@pytest.mark.benchmark(group="search")
+def test_bm25_search(benchmark, search_index):
+    results = benchmark(search_index.search, "الإرجاع والطلب", 10)
+    assert results
+
+
+@pytest.mark.benchmark(group="extraction")
+def test_arabic_tokenize(benchmark):
+    assert benchmark(tokenize, ARABIC_TEXT)
+
+
+@pytest.mark.benchmark(group="extraction")
+def test_slot_extraction(benchmark):
+    assert benchmark(extract_slots, "أريد تتبع طلبي رقم ORD-98765 وبريدي test@example.com")["order_number"]
+
+
+@pytest.mark.benchmark(group="support")
+def test_fast_path_match(benchmark, fast_path):
+    assert benchmark(fast_path.match, "أريد تتبع طلبي رقم ORD-55555")
+
+
+@pytest.mark.benchmark(group="caching")
+def test_specialization_cache_hit(benchmark, tmp_path):
+    compiler = SpecializationCompiler(storage_dir=str(tmp_path))
+    compiler.get_or_compile("ecommerce-nl", BOT_CONFIG)
+    assert benchmark(compiler.get_or_compile, "ecommerce-nl", BOT_CONFIG)["version"] == 1
+
+
+@pytest.mark.benchmark(group="caching")
+def test_specialization_compile(benchmark, tmp_path):
+    compiler = SpecializationCompiler(storage_dir=str(tmp_path))
+    assert benchmark(compiler.compile, "ecommerce-nl", BOT_CONFIG)["config_hash"]
+
+
+@pytest.mark.benchmark(group="archive")
+def test_packed_archive_read(benchmark, packed_store):
+    assert len(benchmark(packed_store.read, "archive/7/file-1007.txt")) > 0
+
+
+@pytest.mark.benchmark(group="archive")
+def test_packed_archive_stats(benchmark, packed_store):
+    assert benchmark(packed_store.get_stats)["total_files"] == 2000
+
+
+@pytest.mark.benchmark(group="fakes")
+def test_fake_embedding_vector(benchmark):
+    embeddings = FakeOpenAIEmbeddings(dimensions=256)
+    assert len(benchmark(embeddings._vector, ARABIC_TEXT)) == 256
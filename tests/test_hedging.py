@@ -0,0 +1,193 @@
+"""
+Tests for hedged LLM requests against fake endpoints with skewed latency
+"""
+import asyncio
+
+import pytest
+
+from server.academy.hedging import HedgedExecutor, LatencyTracker, vertex_regional_client
+from tests.fakes import FakeServiceError, FakeVertexModel, LatencyProfile
+from tests.perf import percentile
+
+
+class TestLatencyTracker:
+    """Test the sliding-window percentile."""
+
+    def test_percentile_needs_min_samples(self):
+        tracker = LatencyTracker(min_samples=3)
+        tracker.record(10)
+        assert tracker.percentile(95) is None
+        for value in (20, 30, 40):
+            tracker.record(value)
+        assert tracker.percentile(50) == 30
+
+
+class TestHedgedExecutor:
+    """Test hedging, cancellation and the budget cap."""
+
+    @pytest.mark.asyncio
+    async def test_backup_wins_when_primary_is_slow(self):
+        executor = HedgedExecutor(default_delay_ms=20, min_delay_ms=1)
+        cancelled = asyncio.Event()
+
+        async def slow_primary():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "primary"
+
+        async def fast_backup():
+            return "backup"
+
+        assert await executor.call(slow_primary, fast_backup) == "backup"
+        await asyncio.sleep(0)
+        assert cancelled.is_set()
+        metrics = executor.get_metrics()
+        assert metrics["hedged"] == 1
+        assert metrics["backup_win_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self):
+        executor = HedgedExecutor(default_delay_ms=100)
+        backup_calls = 0
+
+        async def backup():
+            nonlocal backup_calls
+            backup_calls += 1
+            return "backup"
+
+        async def primary():
+            return "primary"
+
+        assert await executor.call(primary, backup) == "primary"
+        assert backup_calls == 0
+
+    @pytest.mark.asyncio
+    async def test_primary_failure_fails_over(self):
+        executor = HedgedExecutor(default_delay_ms=100)
+
+        async def failing():
+            raise FakeServiceError("region down")
+
+        async def backup():
+            return "backup"
+
+        assert await executor.call(failing, backup) == "backup"
+        assert executor.get_metrics()["failovers"] == 1
+
+    @pytest.mark.asyncio
+    async def test_backup_win_records_censored_primary_latency(self):
+        executor = HedgedExecutor(default_delay_ms=30, min_delay_ms=1)
+
+        async def slow_primary():
+            await asyncio.sleep(1)
+            return "primary"
+
+        async def instant_backup():
+            return "backup"
+
+        await executor.call(slow_primary, instant_backup, name="generate")
+        [sample] = executor.trackers["generate"]._samples
+        assert sample >= 30
+        assert executor.get_metrics()["censored_samples"] == 1
+
+    @pytest.mark.asyncio
+    async def test_budget_caps_hedge_rate(self):
+        executor = HedgedExecutor(default_delay_ms=1, min_delay_ms=1, budget_ratio=0.1, max_tokens=1)
+
+        async def slow():
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        for _ in range(50):
+            await executor.call(slow, slow)
+        metrics = executor.get_metrics()
+        assert metrics["hedged"] <= 1 + 50 * 0.1
+        assert metrics["budget_exhausted"] > 0
+
+    def test_backup_client_uses_registered_factory(self):
+        executor = HedgedExecutor()
+        executor.register_backup_factory("trainer", lambda primary, location: f"{primary}@{location}")
+        assert executor.backup_client("trainer", "client", location="europe-west1") == "client@europe-west1"
+        assert executor.get_metrics()["backup_clients"]["trainer"] == {"location": "europe-west1", "same_region": False}
+
+    def test_backup_client_falls_back_to_primary_region(self, monkeypatch):
+        monkeypatch.delenv("GCP_HEDGE_LOCATION", raising=False)
+        executor = HedgedExecutor()
+
+        def broken(primary, location):
+            raise TypeError("unexpected keyword argument 'location'")
+
+        executor.register_backup_factory("instructor", broken)
+        assert executor.backup_client("instructor", "client", location="europe-west1") == "client"
+        assert executor.backup_client("trainer", "client", location="europe-west1") == "client"
+        assert executor.backup_client("search", "client") == "client"
+        backups = executor.get_metrics()["backup_clients"]
+        assert all(backups[name]["same_region"] for name in ("instructor", "trainer", "search"))
+
+    def test_vertex_regional_client_moves_models_only(self, monkeypatch):
+        generative_models = pytest.importorskip("vertexai.generative_models")
+        from google.cloud.aiplatform import initializer
+
+        monkeypatch.setenv("GCP_PROJECT", "surooh-test")
+        monkeypatch.setattr(initializer.global_config, "_project", "surooh-test")
+        monkeypatch.setattr(initializer.global_config, "_location", "europe-west4")
+
+        class Trainer:
+            def __init__(self):
+                self.model = generative_models.GenerativeModel(
+                    "gemini-1.5-pro", system_instruction="أنت مدرب", generation_config={"temperature": 0.2}
+                )
+                self.name = "trainer"
+
+        primary = Trainer()
+        backup = vertex_regional_client(primary, "europe-west1")
+        assert backup is not primary and backup.name == "trainer"
+        assert backup.model._location == "europe-west1"
+        assert backup.model._prediction_resource_name == (
+            "projects/surooh-test/locations/europe-west1/publishers/google/models/gemini-1.5-pro"
+        )
+        assert backup.model._system_instruction == "أنت مدرب"
+        assert primary.model._location == "europe-west4"
+
+        with pytest.raises(TypeError):
+            vertex_regional_client(object(), "europe-west1")
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_cuts_p99_with_skewed_fake_regions(self):
+        primary_region = FakeVertexModel(LatencyProfile(median_ms=5, p99_ms=300, seed=11), name="europe-west4")
+        backup_region = FakeVertexModel(LatencyProfile(median_ms=5, p99_ms=300, seed=12), name="europe-west1")
+
+        async def timed(call):
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await call()
+            return (loop.time() - start) * 1000
+
+        unhedged = sorted(await asyncio.gather(*(
+            timed(lambda: primary_region.generate_content_async("prompt")) for _ in range(200)
+        )))
+
+        primary_region.latency = LatencyProfile(median_ms=5, p99_ms=300, seed=11)
+        executor = HedgedExecutor(percentile=90, budget_ratio=0.2, min_samples=20)
+        for _ in range(20):
+            await executor.call(
+                lambda: primary_region.generate_content_async("warmup"),
+                lambda: backup_region.generate_content_async("warmup"),
+                name="generate",
+            )
+        hedged = sorted(await asyncio.gather(*(
+            timed(lambda: executor.call(
+                lambda: primary_region.generate_content_async("prompt"),
+                lambda: backup_region.generate_content_async("prompt"),
+                name="generate",
+            ))
+            for _ in range(200)
+        )))
+
+        assert percentile(hedged, 99) < percentile(unhedged, 99)
+        metrics = executor.get_metrics()
+        assert metrics["hedged"] <= executor.max_tokens + metrics["requests"] * 0.2
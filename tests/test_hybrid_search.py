@@ -0,0 +1,170 @@
+"""
+Tests for hybrid BM25 + vector retrieval
+"""
+import os
+import time
+
+import pytest
+
+from server.core.arabic_text import normalize_arabic, tokenize
+from server.core.hybrid_search import HybridSearchEngine, InvertedIndex, reciprocal_rank_fusion
+from server.core.packed_archive import PackedArchiveStore
+
+DOCUMENTS = [
+    {"id": "returns", "text": "سياسة الإرجاع والاستبدال خلال أربعة عشر يوماً"},
+    {"id": "shipping", "text": "تتبع الطلبات والشحن إلى هولندا"},
+    {"id": "pricing", "text": "أسعار المنتجات الإلكترونية والعروض"},
+]
+
+
+class TestArabicText:
+    """Test Arabic normalization and tokenization."""
+
+    def test_normalizes_variants(self):
+        assert normalize_arabic("إِسْبَانْيَا") == "اسبانيا"
+        assert normalize_arabic("مدرسة كبرى") == "مدرسه كبري"
+        assert normalize_arabic("٢٠٢٤") == "2024"
+
+    def test_strips_article_and_stopwords(self):
+        assert tokenize("في المكتبة") == ["مكتبه"]
+
+
+class TestInvertedIndex:
+    """Test BM25 scoring and incremental updates."""
+
+    def test_bm25_ranks_matching_document_first(self):
+        index = InvertedIndex()
+        for doc in DOCUMENTS:
+            index.add(doc["id"], doc["text"])
+        assert index.search("الارجاع")[0]["id"] == "returns"
+
+    def test_remove_updates_postings(self):
+        index = InvertedIndex()
+        index.add("a", "تتبع الطلب")
+        index.remove("a")
+        assert index.search("تتبع") == []
+        assert index.postings == {}
+
+
+class TestHybridSearchEngine:
+    """Test fusion, persistence and fallbacks."""
+
+    def test_rrf_rewards_agreement(self):
+        fused = reciprocal_rank_fusion([[{"id": "a"}, {"id": "b"}], [{"id": "b"}, {"id": "c"}]])
+        assert fused[0]["id"] == "b"
+
+    @pytest.mark.asyncio
+    async def test_search_fuses_vector_results(self, tmp_path):
+        engine = HybridSearchEngine(storage_path=str(tmp_path / "index.json"))
+        engine.index_documents(DOCUMENTS)
+
+        async def vector_search(query, top_k):
+            return [{"file": "pricing"}, {"file": "external", "content": "نتيجة دلالية"}]
+
+        result = await engine.search("الإرجاع", vector_search=vector_search)
+        ids = [r["id"] for r in result["results"]]
+        assert set(ids) == {"returns", "pricing", "external"}
+        assert result["vector_hits"] == 2
+
+    @pytest.mark.asyncio
+    async def test_vector_failure_falls_back_to_keywords(self):
+        engine = HybridSearchEngine()
+        engine.index_documents(DOCUMENTS)
+
+        async def broken(query, top_k):
+            raise RuntimeError("embedding service down")
+
+        result = await engine.search("الشحن", vector_search=broken)
+        assert result["results"][0]["id"] == "shipping"
+
+    def test_log_and_snapshot_are_replayed(self, tmp_path):
+        path = str(tmp_path / "index.json")
+        engine = HybridSearchEngine(storage_path=path)
+        engine.index_documents(DOCUMENTS)
+        engine.remove_document("shipping")
+        assert len(HybridSearchEngine(storage_path=path).index) == 2
+
+        engine.snapshot()
+        assert len(HybridSearchEngine(storage_path=path).index) == 2
+
+
+class TestSharedPersistence:
+    """Test that workers sharing one storage path keep each other's documents."""
+
+    def _engine(self, path):
+        return HybridSearchEngine(storage_path=path, refresh_interval_seconds=0)
+
+    def test_snapshot_keeps_other_workers_documents(self, tmp_path):
+        path = str(tmp_path / "index.json")
+        first, second = self._engine(path), self._engine(path)
+        first.index_document("returns", DOCUMENTS[0]["text"])
+        second.index_document("shipping", DOCUMENTS[1]["text"])
+
+        second.snapshot()
+        first.index_document("pricing", DOCUMENTS[2]["text"])
+        first.snapshot()
+
+        assert self._engine(path).get_stats()["documents"] == 3
+        assert second.get_stats()["documents"] == 3
+
+    @pytest.mark.asyncio
+    async def test_search_sees_other_workers_updates(self, tmp_path):
+        path = str(tmp_path / "index.json")
+        writer, reader = self._engine(path), self._engine(path)
+        writer.index_documents(DOCUMENTS)
+        result = await reader.search("الشحن")
+        assert result["results"][0]["id"] == "shipping"
+
+        writer.remove_document("shipping")
+        assert (await reader.search("الشحن"))["results"] == []
+
+    def test_reload_swaps_in_a_new_index(self, tmp_path):
+        path = str(tmp_path / "index.json")
+        writer, reader = self._engine(path), self._engine(path)
+        writer.index_documents(DOCUMENTS[:2])
+        reader.get_stats()
+        serving = reader.index
+
+        writer.index_document("pricing", DOCUMENTS[2]["text"])
+        writer.snapshot()
+        assert reader.get_stats()["documents"] == 3
+        assert reader.index is not serving
+        assert len(serving) == 2
+
+    def test_snapshot_skips_small_log(self, tmp_path):
+        engine = self._engine(str(tmp_path / "index.json"))
+        engine.index_documents(DOCUMENTS)
+        assert not engine.snapshot(min_log_bytes=1024 * 1024)
+        assert engine.snapshot(min_log_bytes=1)
+        assert not engine.snapshot(min_log_bytes=1)
+
+    def test_maintenance_snapshots_in_background(self, tmp_path):
+        path = str(tmp_path / "index.json")
+        engine = HybridSearchEngine(storage_path=path, refresh_interval_seconds=0.01)
+        engine.index_documents(DOCUMENTS)
+        engine.start_maintenance(snapshot_interval_seconds=0.01, snapshot_min_log_bytes=1)
+        try:
+            for _ in range(200):
+                if os.path.getsize(f"{path}.log") == 0:
+                    break
+                time.sleep(0.01)
+            assert os.path.getsize(f"{path}.log") == 0
+        finally:
+            engine.close()
+        assert len(HybridSearchEngine(storage_path=path).index) == 3
+
+    def test_archive_writes_feed_the_index(self, tmp_path):
+        store = PackedArchiveStore(root_dir=str(tmp_path / "archive"), refresh_interval_seconds=0)
+        engine = self._engine(str(tmp_path / "index.json"))
+        store.put("faq/old.md", "سياسة الإرجاع القديمة".encode("utf-8"))
+        store.add_listener(engine.index_archive_file)
+
+        store.put("faq/returns.md", DOCUMENTS[0]["text"].encode("utf-8"))
+        store.put("images/logo.png", b"\x89PNG")
+        assert set(engine.index.documents) == {"faq/returns.md"}
+        store.delete("faq/returns.md")
+        assert len(engine.index) == 0
+
+        assert engine.reindex_archive(store) == 1
+        assert engine.index.documents["faq/old.md"]["metadata"] == {"source": "archive", "file": "faq/old.md"}
+        store.close()
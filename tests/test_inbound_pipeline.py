@@ -0,0 +1,358 @@
+"""
+Tests for the inbound messaging pipeline
+"""
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+
+from server.integrations.inbound_pipeline import (
+    InboundJournal, InboundPipeline, OutboundBatcher, bind_messaging_hub, parse_webhook,
+    verify_subscription, verify_webhook
+)
+
+
+def _message(message_id, conversation_id="c1", text="مرحبا"):
+    return {
+        "provider": "whatsapp",
+        "message_id": message_id,
+        "conversation_id": conversation_id,
+        "user_id": conversation_id,
+        "text": text,
+    }
+
+
+async def _drain(pipeline, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if not pipeline.get_stats()["pending"]:
+            return
+        await asyncio.sleep(0.01)
+
+
+async def _drain_journal(journal, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        journal.accept([])
+        if not journal.get_stats()["pending"]:
+            return
+        await asyncio.sleep(0.01)
+
+
+class TestParseWebhook:
+    """Test provider payload normalization."""
+
+    def test_whatsapp_payload(self):
+        payload = {"entry": [{"changes": [{"value": {"messages": [
+            {"id": "wamid.1", "from": "31612345678", "type": "text", "text": {"body": "أين طلبي؟"}}
+        ]}}]}]}
+        [message] = parse_webhook("whatsapp", payload)
+        assert message["message_id"] == "wamid.1"
+        assert message["conversation_id"] == "31612345678"
+        assert message["text"] == "أين طلبي؟"
+
+    def test_telegram_payload(self):
+        payload = {"update_id": 99, "message": {"message_id": 5, "chat": {"id": 42}, "from": {"id": 7}, "text": "hi"}}
+        [message] = parse_webhook("telegram", payload)
+        assert message["message_id"] == "99"
+        assert message["conversation_id"] == "42"
+
+    @pytest.mark.parametrize("provider, payload", [
+        ("whatsapp", [{"id": "x"}]),
+        ("whatsapp", {"entry": ["not-an-object"]}),
+        ("telegram", {"message": "hi"}),
+        ("generic", {"messages": "hi"}),
+    ])
+    def test_malformed_payload_raises_value_error(self, provider, payload):
+        with pytest.raises(ValueError):
+            parse_webhook(provider, payload)
+
+
+class TestVerifyWebhook:
+    """Test provider signature and shared-secret checks."""
+
+    def test_whatsapp_signature(self, monkeypatch):
+        monkeypatch.setenv("WHATSAPP_APP_SECRET", "app-secret")
+        body = b'{"entry": []}'
+        signature = "sha256=" + hmac.new(b"app-secret", body, hashlib.sha256).hexdigest()
+        assert verify_webhook("whatsapp", {"X-Hub-Signature-256": signature}, body)
+        assert not verify_webhook("whatsapp", {"X-Hub-Signature-256": signature}, body + b" ")
+
+    def test_fails_closed_without_secret(self, monkeypatch):
+        for name in ("TELEGRAM_WEBHOOK_SECRET", "WEBHOOK_SECRET", "WEBHOOK_SECRET_SHOP"):
+            monkeypatch.delenv(name, raising=False)
+        assert not verify_webhook("telegram", {"X-Telegram-Bot-Api-Secret-Token": ""}, b"{}")
+        assert not verify_webhook("shop", {}, b"{}")
+
+    def test_generic_provider_token(self, monkeypatch):
+        monkeypatch.setenv("WEBHOOK_SECRET", "shared")
+        monkeypatch.setenv("WEBHOOK_SECRET_SHOP", "shop-only")
+        assert verify_webhook("shop", {"x-webhook-token": "shop-only"}, b"{}")
+        assert not verify_webhook("shop", {"x-webhook-token": "shared"}, b"{}")
+        assert verify_webhook("crm", {"x-webhook-token": "shared"}, b"{}")
+
+    def test_whatsapp_subscription_challenge(self, monkeypatch):
+        params = {"hub.mode": "subscribe", "hub.verify_token": "verify-me", "hub.challenge": "1158201444"}
+        monkeypatch.delenv("WHATSAPP_VERIFY_TOKEN", raising=False)
+        assert verify_subscription("whatsapp", params) is None
+        monkeypatch.setenv("WHATSAPP_VERIFY_TOKEN", "verify-me")
+        assert verify_subscription("whatsapp", params) == "1158201444"
+        assert verify_subscription("whatsapp", {**params, "hub.verify_token": "wrong"}) is None
+        assert verify_subscription("telegram", params) is None
+
+
+class TestInboundPipeline:
+    """Test dedup, ordering and micro-batching."""
+
+    @pytest.mark.asyncio
+    async def test_duplicates_are_dropped(self):
+        handled = []
+
+        async def handler(batch):
+            handled.extend(m["message_id"] for m in batch)
+
+        pipeline = InboundPipeline(handler=handler, batch_window_ms=0)
+        await pipeline.start()
+        assert pipeline.submit(_message("m1")) == "queued"
+        assert pipeline.submit(_message("m1")) == "duplicate"
+        await _drain(pipeline)
+        await pipeline.stop()
+        assert handled == ["m1"]
+
+    @pytest.mark.asyncio
+    async def test_burst_is_batched_in_order(self):
+        batches = []
+
+        async def handler(batch):
+            batches.append([m["message_id"] for m in batch])
+
+        pipeline = InboundPipeline(handler=handler, num_workers=4, max_batch_size=10, batch_window_ms=30)
+        await pipeline.start()
+        for i in range(5):
+            pipeline.submit(_message(f"a{i}", "alice"))
+        pipeline.submit(_message("b0", "bob"))
+        await _drain(pipeline)
+        await pipeline.stop()
+
+        assert ["a0", "a1", "a2", "a3", "a4"] in batches
+        assert ["b0"] in batches
+        assert pipeline.get_stats()["batches"] == 2
+
+    @pytest.mark.asyncio
+    async def test_conversation_order_preserved_across_batches(self):
+        seen = []
+
+        async def handler(batch):
+            await asyncio.sleep(0.005)
+            seen.extend(m["message_id"] for m in batch)
+
+        pipeline = InboundPipeline(handler=handler, num_workers=8, max_batch_size=3, batch_window_ms=0)
+        await pipeline.start()
+        for i in range(20):
+            pipeline.submit(_message(f"m{i:02d}"))
+        await _drain(pipeline)
+        await pipeline.stop()
+        assert seen == [f"m{i:02d}" for i in range(20)]
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_goes_to_dead_letters(self):
+        async def handler(batch):
+            raise RuntimeError("provider down")
+
+        pipeline = InboundPipeline(handler=handler, batch_window_ms=0, max_retries=1)
+        await pipeline.start()
+        pipeline.submit(_message("m1"))
+        await _drain(pipeline)
+        await pipeline.stop()
+        assert pipeline.get_stats()["dead_letters"] == 1
+
+    def test_rejects_when_full(self):
+        pipeline = InboundPipeline(max_pending=1)
+        assert pipeline.submit(_message("m1")) == "queued"
+        assert pipeline.submit(_message("m2")) == "rejected"
+
+    @pytest.mark.asyncio
+    async def test_rejected_message_is_accepted_on_redelivery(self):
+        handled = []
+
+        async def handler(batch):
+            handled.extend(m["message_id"] for m in batch)
+
+        pipeline = InboundPipeline(handler=handler, batch_window_ms=0, max_pending=1)
+        assert pipeline.submit(_message("m1")) == "queued"
+        assert pipeline.submit(_message("m2")) == "rejected"
+        await pipeline.start()
+        await _drain(pipeline)
+        assert pipeline.submit(_message("m2")) == "queued"
+        assert pipeline.submit(_message("m1")) == "duplicate"
+        await _drain(pipeline)
+        await pipeline.stop()
+        assert handled == ["m1", "m2"]
+
+
+class TestInboundJournal:
+    """Test the shared journal that makes dedup and ordering hold across workers."""
+
+    def test_dedup_is_shared_between_processes(self, tmp_path):
+        worker_a, worker_b = InboundJournal(str(tmp_path)), InboundJournal(str(tmp_path))
+        assert worker_a.accept([_message("m1")]) == ["queued"]
+        assert worker_b.accept([_message("m1"), _message("m2"), _message("m2")]) == ["duplicate", "queued", "duplicate"]
+        assert worker_a.get_stats()["pending"] == 1
+        worker_a.accept([])
+        assert worker_a.get_stats()["pending"] == 2
+
+    def test_max_pending_is_global(self, tmp_path):
+        worker_a, worker_b = InboundJournal(str(tmp_path), max_pending=2), InboundJournal(str(tmp_path), max_pending=2)
+        assert worker_a.accept([_message("m1")]) == ["queued"]
+        assert worker_b.accept([_message("m2"), _message("m3")]) == ["queued", "rejected"]
+
+    def test_single_consumer_is_elected(self, tmp_path):
+        worker_a, worker_b = InboundJournal(str(tmp_path)), InboundJournal(str(tmp_path))
+        assert worker_a.try_become_consumer()
+        assert not worker_b.try_become_consumer()
+        worker_a.release_consumer()
+        assert worker_b.try_become_consumer()
+        worker_b.release_consumer()
+
+    def test_torn_tail_is_discarded(self, tmp_path):
+        journal = InboundJournal(str(tmp_path))
+        journal.accept([_message("m1")])
+        with open(tmp_path / "journal.log", "ab") as f:
+            f.write(b'{"op": "enqueue", "id": "whatsapp:m2"')
+        assert InboundJournal(str(tmp_path)).accept([_message("m2")]) == ["queued"]
+        assert [message_id for message_id, _ in InboundJournal(str(tmp_path)).take_new()] == ["whatsapp:m1", "whatsapp:m2"]
+
+    def test_compaction_keeps_pending_and_dedup_window(self, tmp_path):
+        journal = InboundJournal(str(tmp_path))
+        journal.accept([_message(f"m{i}") for i in range(5)])
+        journal.mark_done(["whatsapp:m0", "whatsapp:m1"])
+        reader = InboundJournal(str(tmp_path))
+        reader.accept([])
+        journal.compact()
+        assert reader.accept([_message("m0"), _message("m4")]) == ["duplicate", "duplicate"]
+        assert [message_id for message_id, _ in reader.take_new()] == ["whatsapp:m2", "whatsapp:m3", "whatsapp:m4"]
+
+    @pytest.mark.asyncio
+    async def test_order_kept_with_two_accepting_workers(self, tmp_path):
+        seen = []
+
+        async def handler(batch):
+            await asyncio.sleep(0.002)
+            seen.extend(m["message_id"] for m in batch)
+
+        consumer = InboundPipeline(
+            handler=handler, num_workers=8, max_batch_size=3, batch_window_ms=0,
+            journal=InboundJournal(str(tmp_path)), poll_interval_ms=5
+        )
+        other_worker = InboundPipeline(handler=handler, journal=InboundJournal(str(tmp_path)))
+        await consumer.start()
+        for i in range(20):
+            (consumer if i % 2 else other_worker).accept([_message(f"m{i:02d}")])
+        await _drain_journal(consumer.journal)
+        await consumer.stop()
+        assert seen == [f"m{i:02d}" for i in range(20)]
+        assert other_worker.accept([_message("m05")]) == ["duplicate"]
+
+    @pytest.mark.asyncio
+    async def test_unfinished_messages_are_replayed_by_next_consumer(self, tmp_path):
+        release = asyncio.Event()
+        handled = []
+
+        async def stuck_handler(batch):
+            await release.wait()
+
+        async def handler(batch):
+            handled.extend(m["message_id"] for m in batch)
+
+        crashed = InboundPipeline(handler=stuck_handler, batch_window_ms=0, journal=InboundJournal(str(tmp_path)), poll_interval_ms=5)
+        await crashed.start()
+        crashed.accept([_message("m1"), _message("m2", "c2")])
+        await asyncio.sleep(0.1)
+        await crashed.stop(drain_timeout=0)
+
+        successor = InboundPipeline(handler=handler, batch_window_ms=0, journal=InboundJournal(str(tmp_path)), poll_interval_ms=5)
+        await successor.start()
+        await _drain_journal(successor.journal)
+        await successor.stop()
+        assert sorted(handled) == ["m1", "m2"]
+        assert successor.accept([_message("m1")]) == ["duplicate"]
+
+
+class TestOutboundBatcher:
+    """Test batched outbound sends."""
+
+    @pytest.mark.asyncio
+    async def test_sends_grouped_by_provider(self):
+        calls = []
+
+        async def sender(provider, messages):
+            calls.append((provider, len(messages)))
+            return [{"status": "sent"} for _ in messages]
+
+        batcher = OutboundBatcher(sender=sender, max_batch_size=100, flush_interval_ms=10)
+        await batcher.start()
+        futures = [batcher.send("whatsapp", {"to": str(i), "text": "ok"}) for i in range(5)]
+        futures.append(batcher.send("telegram", {"to": "1", "text": "ok"}))
+        await asyncio.gather(*futures)
+        await batcher.stop()
+        assert sorted(calls) == [("telegram", 1), ("whatsapp", 5)]
+
+    @pytest.mark.asyncio
+    async def test_failed_message_does_not_fail_the_batch(self):
+        async def sender(provider, messages):
+            return [RuntimeError("blocked") if m["to"] == "2" else {"status": "sent"} for m in messages]
+
+        batcher = OutboundBatcher(sender=sender, max_batch_size=100, flush_interval_ms=10)
+        await batcher.start()
+        results = await asyncio.gather(
+            *[batcher.send("whatsapp", {"to": str(i), "text": "ok"}) for i in range(3)],
+            return_exceptions=True
+        )
+        await batcher.stop()
+        assert isinstance(results[2], RuntimeError)
+        assert results[0] == results[1] == {"status": "sent"}
+        assert batcher.get_stats()["sent"] == 2 and batcher.get_stats()["failed"] == 1
+
+
+class _Hub:
+    def __init__(self):
+        self.sent = []
+
+    async def handle_inbound_batch(self, batch):
+        return {"reply": f"received {len(batch)}"}
+
+    async def send_message(self, provider, message):
+        if message["to"] == "bad":
+            raise RuntimeError("unknown recipient")
+        self.sent.append((provider, message))
+        return {"status": "sent"}
+
+
+class TestBindMessagingHub:
+    """Test the messaging_hub contract check."""
+
+    def test_incompatible_hub_leaves_pipeline_unbound(self):
+        class LegacyHub:
+            async def handle_incoming_message(self, **kwargs):
+                return None
+
+        pipeline, batcher = InboundPipeline(), OutboundBatcher()
+        assert bind_messaging_hub(LegacyHub(), pipeline, batcher) is False
+        assert pipeline.handler is None
+
+    @pytest.mark.asyncio
+    async def test_replies_go_through_the_batcher(self):
+        hub = _Hub()
+        pipeline = InboundPipeline(batch_window_ms=0)
+        batcher = OutboundBatcher(flush_interval_ms=10)
+        assert bind_messaging_hub(hub, pipeline, batcher) is True
+
+        await pipeline.start()
+        await batcher.start()
+        pipeline.submit(_message("m1", "alice"))
+        pipeline.submit(_message("m2", "bad"))
+        await _drain(pipeline)
+        await batcher.stop()
+        await pipeline.stop()
+
+        assert hub.sent == [("whatsapp", {"to": "alice", "text": "received 1"})]
+        assert batcher.get_stats()["failed"] == 1
@@ -0,0 +1,91 @@
+"""
+End-to-end load scenarios with LLM stand-ins and a stored relative baseline
+"""
+import os
+
+import httpx
+import pytest
+
+import main
+from tests.fakes import fake_backends as make_fake_backends
+from tests.perf import build_baseline, find_regressions, load_baseline, median_result, run_load, save_baseline
+
+UPDATE_BASELINE = os.getenv("UPDATE_PERF_BASELINE") == "1"
+BASELINE_RUNS = int(os.getenv("PERF_BASELINE_RUNS", "8"))
+ROUNDS = int(os.getenv("PERF_ROUNDS", "5"))
+TOTAL_REQUESTS = int(os.getenv("PERF_TOTAL_REQUESTS", "300"))
+CONCURRENCY = int(os.getenv("PERF_CONCURRENCY", "20"))
+
+SCENARIOS = {
+    "academy_intake": (
+        "/academy/intake",
+        lambda i: {"description": f"متجر إلكتروني رقم {i} يحتاج دعم عملاء ذكي", "tenant": f"tenant-{i % 5}"},
+    ),
+    "academy_train": (
+        "/academy/train",
+        lambda i: {
+            "bot_config": {"name": f"support_bot_{i % 3}", "type": "customer_support", "capabilities": ["faq"]},
+            "sample_conversations": ["العميل: ما هي سياسة الإرجاع؟", "البوت: يمكنك الإرجاع خلال 14 يوماً."],
+        },
+    ),
+    # /core/semantic_search is served by the hybrid endpoint in this tree
+    "core_semantic_search": (
+        "/core/hybrid_search",
+        lambda i: {"query": f"سياسة الإرجاع {i % 10}", "top_k": 10},
+    ),
+}
+
+
+@pytest.fixture
+def fake_backends(monkeypatch, tmp_path):
+    for name, value in make_fake_backends(str(tmp_path)).items():
+        monkeypatch.setattr(main, name, value)
+
+
+@pytest.fixture
+async def client():
+    """ASGI client for the load suite (httpx >= 0.28 has no AsyncClient(app=...))."""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as ac:
+        yield ac
+
+
+async def _run_scenarios(client: httpx.AsyncClient, total_requests: int, rounds: int = 1):
+    """Run every scenario once per round, interleaved so drift hits them alike."""
+    all_rounds = []
+    for _ in range(rounds):
+        results = {}
+        for scenario in sorted(SCENARIOS):
+            path, make_payload = SCENARIOS[scenario]
+
+            async def send(i: int) -> bool:
+                response = await client.post(path, json=make_payload(i))
+                return response.status_code == 200
+
+            results[scenario] = await run_load(send, total_requests=total_requests, concurrency=CONCURRENCY)
+        all_rounds.append(results)
+    return median_result(all_rounds)
+
+
+@pytest.mark.slow
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_load_scenarios_against_baseline(client: httpx.AsyncClient, fake_backends):
+    """Run every load scenario and fail if one regressed relative to the others."""
+    await _run_scenarios(client, total_requests=CONCURRENCY)
+
+    if UPDATE_BASELINE:
+        runs = [await _run_scenarios(client, TOTAL_REQUESTS, ROUNDS) for _ in range(BASELINE_RUNS)]
+        for scenario in sorted(SCENARIOS):
+            print(f"\n{scenario}: {[run[scenario] for run in runs]}")
+        save_baseline(build_baseline(runs))
+        pytest.skip(f"baseline updated from {BASELINE_RUNS} runs")
+
+    results = await _run_scenarios(client, TOTAL_REQUESTS, ROUNDS)
+    for scenario, result in results.items():
+        print(f"\n{scenario}: {result}")
+
+    baseline = load_baseline()
+    if not baseline.get("scenarios"):
+        pytest.skip("no baseline recorded; run `make perf-baseline`")
+
+    assert find_regressions(results, baseline) == []
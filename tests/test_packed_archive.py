@@ -0,0 +1,185 @@
+"""
+Tests for the packed, mmap-backed archive store
+"""
+import multiprocessing
+import os
+
+import pytest
+
+from server.core.packed_archive import PackedArchiveStore
+
+
+def _open(root, **kwargs):
+    return PackedArchiveStore(root_dir=str(root), segment_max_bytes=256, refresh_interval_seconds=0, **kwargs)
+
+
+def _worker_puts(root, worker_id, count):
+    store = _open(root)
+    for i in range(count):
+        store.put(f"w{worker_id}/f{i}.txt", f"worker-{worker_id}-file-{i}".encode() * 3)
+    store.close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    archive = _open(tmp_path)
+    yield archive
+    archive.close()
+
+
+class TestPackedArchiveStore:
+    """Test writes, zero-copy reads, catalog and compaction."""
+
+    def test_read_returns_memoryview(self, store):
+        store.put("docs/report.pdf", b"%PDF-data")
+        data = store.read("docs/report.pdf")
+        assert isinstance(data, memoryview)
+        assert bytes(data) == b"%PDF-data"
+        assert store.read("missing.txt") is None
+
+    def test_catalog_tracks_overwrites_and_deletes(self, store):
+        store.put("a.txt", b"12345")
+        store.put("b.pdf", b"123")
+        store.put("a.txt", b"12")
+        store.delete("b.pdf")
+        stats = store.get_stats()
+        assert stats["total_files"] == 1
+        assert stats["total_bytes"] == 2
+        assert stats["by_extension"] == {".txt": {"files": 1, "bytes": 2}}
+
+    def test_list_files_by_prefix(self, store):
+        for name in ["docs/b.txt", "docs/a.txt", "img/x.png"]:
+            store.put(name, b"x")
+        listing = store.list_files(prefix="docs/")
+        assert [f["name"] for f in listing["files"]] == ["docs/a.txt", "docs/b.txt"]
+        assert listing["total_files"] == 3
+
+    def test_reopen_restores_index(self, store, tmp_path):
+        store.put("a.txt", b"hello")
+        store.put("gone.txt", b"bye")
+        store.delete("gone.txt")
+        store.close()
+
+        reopened = _open(tmp_path)
+        assert bytes(reopened.read("a.txt")) == b"hello"
+        assert not reopened.exists("gone.txt")
+        reopened.close()
+
+    def test_compaction_keeps_live_data_and_deletes(self, store, tmp_path):
+        for i in range(20):
+            store.put(f"f{i}.txt", b"x" * 40)
+        for i in range(15):
+            store.delete(f"f{i}.txt")
+        segments_before = store.get_stats()["segments"]
+
+        assert store.compact() > 0
+        assert store.get_stats()["segments"] < segments_before
+        assert bytes(store.read("f19.txt")) == b"x" * 40
+        store.close()
+
+        reopened = _open(tmp_path)
+        assert reopened.get_stats()["total_files"] == 5
+        assert not reopened.exists("f3.txt")
+        reopened.close()
+
+    def test_compaction_after_reading_active_segment(self, store, tmp_path):
+        store.put("a.txt", b"a" * 30)
+        assert bytes(store.read("a.txt")) == b"a" * 30
+        for i in range(6):
+            store.put(f"k{i}.txt", f"content-{i}".encode() * 3)
+        for i in range(6):
+            store.put(f"next{i}.txt", b"n" * 40)
+        store.delete("a.txt")
+        store.delete("k0.txt")
+        store.delete("k1.txt")
+
+        assert store.compact() > 0
+        store.close()
+
+        reopened = _open(tmp_path)
+        for i in range(2, 6):
+            assert bytes(reopened.read(f"k{i}.txt")) == f"content-{i}".encode() * 3
+        reopened.close()
+
+    def test_sync_directory_is_incremental(self, store, tmp_path_factory):
+        source = tmp_path_factory.mktemp("archive")
+        (source / "sub").mkdir()
+        (source / "sub" / "note.txt").write_bytes(b"note")
+        (source / "old.txt").write_bytes(b"old")
+        assert store.sync_directory(str(source)) == {"updated": 2, "removed": 0}
+        assert bytes(store.read("sub/note.txt")) == b"note"
+
+        assert store.sync_directory(str(source)) == {"updated": 0, "removed": 0}
+        (source / "old.txt").unlink()
+        (source / "sub" / "note.txt").write_bytes(b"note v2")
+        assert store.sync_directory(str(source)) == {"updated": 1, "removed": 1}
+        assert bytes(store.read("sub/note.txt")) == b"note v2"
+        assert not store.exists("old.txt")
+
+    def test_listener_receives_writes(self, store):
+        events = []
+        store.add_listener(lambda key, data: events.append((key, data)))
+        store.put("a.txt", b"hello")
+        store.delete("a.txt")
+        assert events == [("a.txt", b"hello"), ("a.txt", None)]
+
+
+class TestPackedArchiveMultiProcess:
+    """Test that workers sharing one root see consistent data."""
+
+    def test_concurrent_writers_do_not_corrupt_records(self, tmp_path):
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=_worker_puts, args=(tmp_path, w, 40)) for w in range(4)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join(timeout=60)
+            assert p.exitcode == 0
+
+        reader = _open(tmp_path)
+        assert reader.get_stats()["total_files"] == 160
+        for w in range(4):
+            for i in range(40):
+                assert bytes(reader.read(f"w{w}/f{i}.txt")) == f"worker-{w}-file-{i}".encode() * 3
+        reader.close()
+
+    def test_other_instance_sees_writes_and_compaction(self, tmp_path):
+        writer, reader = _open(tmp_path), _open(tmp_path)
+        for i in range(20):
+            writer.put(f"f{i}.txt", bytes([65 + i]) * 40)
+        assert bytes(reader.read("f2.txt")) == b"C" * 40
+
+        for i in range(15):
+            writer.delete(f"f{i}.txt")
+        assert writer.compact() > 0
+        assert reader.read("f3.txt") is None
+        assert bytes(reader.read("f19.txt")) == b"T" * 40
+        assert reader.get_stats()["total_files"] == 5
+        writer.close()
+        reader.close()
+
+    def test_torn_index_tail_is_ignored_and_truncated(self, store, tmp_path):
+        store.put("a.txt", b"hello")
+        idx_path = os.path.join(str(tmp_path), "segment-000001.idx")
+        intact_size = os.path.getsize(idx_path)
+        with open(idx_path, "ab") as f:
+            f.write(b"\x01\x02\x03\x04\x00\x07")
+
+        reopened = _open(tmp_path)
+        assert bytes(reopened.read("a.txt")) == b"hello"
+        reopened.put("b.txt", b"world")
+        assert os.path.getsize(idx_path) > intact_size
+
+        fresh = _open(tmp_path)
+        assert bytes(fresh.read("a.txt")) == b"hello"
+        assert bytes(fresh.read("b.txt")) == b"world"
+        reopened.close()
+        fresh.close()
+
+    def test_single_maintainer_is_elected(self, tmp_path):
+        first, second = _open(tmp_path), _open(tmp_path)
+        assert first._try_become_maintainer()
+        assert not second._try_become_maintainer()
+        first.close()
+        assert second._try_become_maintainer()
+        second.close()
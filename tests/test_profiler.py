@@ -0,0 +1,140 @@
+"""
+Tests for the sampling profiler and slow-request capture
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from server.core.profiler import RequestProfiler, RequestTimelineMiddleware, SamplingProfiler, sanitize_trace_id
+
+
+def _busy_worker(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+
+
+async def _slow_handler(profiler):
+    timeline = profiler.begin("trace-task", "POST", "/academy/train")
+    await asyncio.sleep(0.15)
+    profiler.end(timeline, 200)
+
+
+async def _other_request(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+        await asyncio.sleep(0)
+
+
+class TestSamplingProfiler:
+    """Test on-demand collapsed-stack profiling."""
+
+    def test_profile_samples_other_threads(self):
+        stop_event = threading.Event()
+        worker = threading.Thread(target=_busy_worker, args=(stop_event,), name="busy-worker")
+        worker.start()
+        try:
+            result = SamplingProfiler().profile(seconds=0.2, interval_ms=2)
+        finally:
+            stop_event.set()
+            worker.join()
+
+        assert result["samples"] > 0
+        lines = result["collapsed"].splitlines()
+        assert any(line.startswith("busy-worker;") and "_busy_worker" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+class TestRequestProfiler:
+    """Test per-request timelines and the slow-request ring buffer."""
+
+    def test_slow_request_is_captured_with_stages_and_samples(self):
+        profiler = RequestProfiler(slow_threshold_ms=40, buffer_size=10, sample_interval_ms=2)
+        profiler.start()
+        try:
+            timeline = profiler.begin("generated", "POST", "/academy/intake")
+            profiler.bind_trace_id("trace-slow")
+            profiler.mark_stage("llm_call")
+            time.sleep(0.1)
+            profiler.end(timeline, 200)
+        finally:
+            profiler.stop()
+
+        captured = profiler.get_slow_request("trace-slow")
+        assert captured is not None
+        assert [s["stage"] for s in captured["stages"]] == ["received", "llm_call", "completed"]
+        assert captured["sample_count"] > 0
+
+    def test_fast_request_is_not_kept(self):
+        profiler = RequestProfiler(slow_threshold_ms=10000)
+        profiler.end(profiler.begin("trace-fast", "GET", "/health"), 200)
+        assert profiler.get_slow_request("trace-fast") is None
+
+    def test_ring_buffer_is_bounded(self):
+        profiler = RequestProfiler(slow_threshold_ms=0.001, buffer_size=3)
+        for i in range(5):
+            profiler.end(profiler.begin(f"trace-{i}", "GET", "/x"), 200)
+        assert [r["trace_id"] for r in profiler.list_slow_requests()] == ["trace-4", "trace-3", "trace-2"]
+
+    @pytest.mark.asyncio
+    async def test_samples_follow_the_request_task(self):
+        profiler = RequestProfiler(slow_threshold_ms=40, buffer_size=10, sample_interval_ms=2)
+        stop_event = asyncio.Event()
+        profiler.start()
+        try:
+            other = asyncio.create_task(_other_request(stop_event))
+            await _slow_handler(profiler)
+            stop_event.set()
+            await other
+        finally:
+            profiler.stop()
+
+        collapsed = profiler.get_slow_request("trace-task")["collapsed"].splitlines()
+        assert collapsed
+        assert all("_slow_handler" in line and "_other_request" not in line for line in collapsed)
+
+    def test_slow_requests_are_shared_through_storage(self, tmp_path):
+        worker_a = RequestProfiler(slow_threshold_ms=0.001, buffer_size=2, storage_dir=str(tmp_path))
+        worker_b = RequestProfiler(slow_threshold_ms=0.001, buffer_size=2, storage_dir=str(tmp_path))
+        for i in range(3):
+            worker_a.end(worker_a.begin(f"trace-{i}", "GET", "/x"), 200)
+            time.sleep(0.01)
+        worker_a.stop()
+
+        assert worker_b.get_slow_request("trace-2")["status_code"] == 200
+        assert worker_b.get_slow_request("trace-0") is None
+        assert [r["trace_id"] for r in worker_b.list_slow_requests()] == ["trace-2", "trace-1"]
+
+
+class TestTraceIdHeader:
+    """Test that client-supplied trace ids cannot break the response headers."""
+
+    def test_sanitize_trace_id(self):
+        assert sanitize_trace_id("trace-12345-abc") == "trace-12345-abc"
+        assert sanitize_trace_id("abc\r\nSet-Cookie: x=1") == "abcSet-Cookie:x1"
+        assert sanitize_trace_id("x" * 500) == "x" * 128
+        assert sanitize_trace_id("\r\n") is None
+        assert sanitize_trace_id(None) is None
+
+    @pytest.mark.asyncio
+    async def test_middleware_echoes_only_safe_trace_ids(self):
+        profiler = RequestProfiler()
+
+        async def app(scope, receive, send):
+            profiler.bind_trace_id("body\x00id\n")
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        middleware = RequestTimelineMiddleware(app, profiler)
+        scope = {"type": "http", "method": "GET", "path": "/x", "headers": [(b"x-trace-id", b"abc\r\nX-Evil: 1")]}
+        await middleware(scope, receive, send)
+        assert dict(sent[0]["headers"])[b"x-trace-id"] == b"bodyid"
@@ -0,0 +1,117 @@
+"""
+Tests for compiled bot specialization artifacts
+"""
+import json
+import os
+import threading
+
+import pytest
+
+from server.academy.specialization_cache import SpecializationCompiler, _dir_name, config_hash
+
+BOT_CONFIG = {
+    "name": "support_bot_v2",
+    "type": "customer_support",
+    "capabilities": ["order_tracking", "returns", "escalation"],
+    "language": "arabic",
+    "tone": "friendly_professional",
+    "kpis": {"accuracy": 0.92, "response_time_seconds": 3},
+}
+
+
+@pytest.fixture
+def compiler(tmp_path):
+    return SpecializationCompiler(storage_dir=str(tmp_path))
+
+
+class TestSpecializationCompiler:
+    """Test compilation, caching and versioning."""
+
+    def test_hash_is_stable_across_key_order(self):
+        reordered = dict(reversed(list(BOT_CONFIG.items())))
+        assert config_hash("t1", BOT_CONFIG) == config_hash("t1", reordered)
+        assert config_hash("t1", BOT_CONFIG) != config_hash("t2", BOT_CONFIG)
+
+    def test_compiles_once_per_config(self, compiler):
+        first = compiler.get_or_compile("ecommerce-nl", BOT_CONFIG)
+        second = compiler.get_or_compile("ecommerce-nl", dict(BOT_CONFIG))
+        assert first is second
+        assert compiler.stats["compilations"] == 1
+        assert first["version"] == 1
+
+    def test_artifact_contents(self, compiler):
+        artifact = compiler.get_or_compile("ecommerce-nl", BOT_CONFIG)
+        assert "support_bot_v2" in artifact["prompt_templates"]["system"]
+        assert artifact["capability_schema"]["properties"]["capability"]["enum"] == [
+            "escalation", "order_tracking", "returns"
+        ]
+        rules = {r["metric"]: r["operator"] for r in artifact["validation_rules"]}
+        assert rules["accuracy"] == ">="
+        assert rules["response_time_seconds"] == "<="
+
+    def test_changed_config_bumps_version(self, compiler):
+        compiler.get_or_compile("ecommerce-nl", BOT_CONFIG)
+        artifact = compiler.get_or_compile("ecommerce-nl", {**BOT_CONFIG, "tone": "formal"})
+        assert artifact["version"] == 2
+        assert [v["version"] for v in compiler.list_versions("ecommerce-nl", "customer_support")] == [1, 2]
+
+    def test_reloads_from_disk(self, compiler, tmp_path):
+        artifact = compiler.get_or_compile("ecommerce-nl", BOT_CONFIG)
+        path = os.path.join(str(tmp_path), "ecommerce-nl", "customer_support", f"{artifact['config_hash']}.json")
+        with open(path, encoding="utf-8") as f:
+            assert json.load(f)["config_hash"] == artifact["config_hash"]
+
+        fresh = SpecializationCompiler(storage_dir=str(tmp_path))
+        reloaded = fresh.get_or_compile("ecommerce-nl", BOT_CONFIG)
+        assert fresh.stats == {"hits": 0, "disk_hits": 1, "compilations": 0}
+        assert reloaded["version"] == 1
+
+    @pytest.mark.parametrize("tenant,bot_type", [("..", ".."), (".", "customer_support"), ("ok", "...")])
+    def test_rejects_dot_segments(self, compiler, tmp_path, tenant, bot_type):
+        with pytest.raises(ValueError):
+            compiler.get_or_compile(tenant, {**BOT_CONFIG, "type": bot_type})
+        with pytest.raises(ValueError):
+            compiler.list_versions(tenant, bot_type)
+        assert not os.path.exists(os.path.join(os.path.dirname(str(tmp_path)), "manifest.json"))
+
+    def test_tolerates_loose_config_shapes(self, compiler):
+        loose = {
+            **BOT_CONFIG,
+            "capabilities": ["returns", 7, None],
+            "kpis": [{"metric": "accuracy", "target": 0.9}, "ignored"],
+        }
+        artifact = compiler.get_or_compile("ecommerce-nl", loose)
+        assert artifact["capability_schema"]["properties"]["capability"]["enum"] == ["7", "returns"]
+        assert {"metric": "accuracy", "operator": ">=", "threshold": 0.9} in artifact["validation_rules"]
+        assert artifact["inputs"] == loose
+
+    def test_similar_names_get_separate_directories(self, compiler):
+        slash = compiler.get_or_compile("acme/eu", BOT_CONFIG)
+        underscore = compiler.get_or_compile("acme_eu", BOT_CONFIG)
+        assert slash["version"] == underscore["version"] == 1
+        assert compiler._bot_dir("acme/eu", "customer_support") != compiler._bot_dir("acme_eu", "customer_support")
+        assert len(compiler.list_versions("acme/eu", "customer_support")) == 1
+
+    def test_long_names_are_bounded_and_distinct(self):
+        long_a, long_b = "متجر" * 100 + "a", "متجر" * 100 + "b"
+        assert len(_dir_name(long_a)) <= 120
+        assert _dir_name(long_a) != _dir_name(long_b)
+        assert _dir_name("ecommerce-nl") == "ecommerce-nl"
+
+    def test_memory_cache_is_bounded(self, tmp_path):
+        compiler = SpecializationCompiler(storage_dir=str(tmp_path), max_cached=2)
+        for tone in ("formal", "friendly", "friendly_professional"):
+            compiler.get_or_compile("ecommerce-nl", {**BOT_CONFIG, "tone": tone})
+        assert compiler.get_stats()["cached_artifacts"] == 2
+        assert compiler.get_stats()["evictions"] == 1
+        compiler.get_or_compile("ecommerce-nl", {**BOT_CONFIG, "tone": "formal"})
+        assert compiler.stats["disk_hits"] == 1
+
+    def test_other_tenants_not_blocked_by_busy_tenant(self, compiler):
+        with compiler._key_lock("slow-tenant", "customer_support"):
+            worker = threading.Thread(target=compiler.get_or_compile, args=("fast-tenant", BOT_CONFIG))
+            worker.start()
+            worker.join(timeout=2)
+            assert not worker.is_alive()
+        assert compiler.stats["compilations"] == 1
+        assert compiler._key_locks == {}
@@ -0,0 +1,161 @@
+"""
+Tests for the customer support fast path index
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from server.academy.trainers.support_fast_path import (
+    SupportFastPath,
+    SupportFastPathRegistry,
+    extract_slots,
+    llm_fallback_from_trainer,
+    load_archive_faqs,
+    parse_conversation_pairs,
+)
+from server.core.packed_archive import PackedArchiveStore
+from tests.fakes import FakeGenerationResponse
+
+SAMPLE_CONVERSATIONS = [
+    "العميل: أريد تتبع طلبي رقم 12345",
+    "البوت: جاري تتبع الطلب 12345، ستصلك رسالة بالتفاصيل.",
+    "العميل: كيف أغير عنوان التوصيل؟",
+    "البوت: يمكنك تغيير العنوان من صفحة حسابي قبل شحن الطلب.",
+]
+
+FAQS = [
+    {"question": "ما هي سياسة الإرجاع؟", "answer": "يمكنك إرجاع المنتج خلال 14 يوماً."},
+]
+
+
+@pytest.fixture
+def fast_path():
+    return SupportFastPath.build(SAMPLE_CONVERSATIONS, FAQS)
+
+
+class TestSupportFastPath:
+    """Test fast path matching and slot filling."""
+
+    def test_parse_conversation_pairs(self):
+        pairs = parse_conversation_pairs(SAMPLE_CONVERSATIONS)
+        assert len(pairs) == 2
+        assert pairs[0][0] == "أريد تتبع طلبي رقم 12345"
+
+    def test_extract_slots(self):
+        assert extract_slots("رقم الطلب ORD-12345")["order_number"] == "ORD-12345"
+
+    def test_slot_filled_answer(self, fast_path):
+        hit = fast_path.match("أريد تتبع طلبي رقم ORD-99881")
+        assert hit is not None
+        assert "ORD-99881" in hit["answer"]
+        assert "12345" not in hit["answer"]
+
+    def test_normalized_faq_match(self, fast_path):
+        hit = fast_path.match("ما هي سياسة الارجاع")
+        assert hit is not None
+        assert hit["source"] == "faq"
+
+    def test_plain_numbers_are_not_order_slots(self):
+        assert extract_slots("هل الشحن مجاني للطلبات فوق 1000 ريال؟") == {}
+        assert extract_slots("أريد تتبع طلبي رقم 12345")["order_number"] == "12345"
+
+    def test_literal_numbers_must_match(self):
+        index = SupportFastPath.build(faqs=[
+            {"question": "هل الشحن مجاني للطلبات فوق 1000 ريال؟", "answer": "نعم، الشحن مجاني للطلبات فوق 1000 ريال."}
+        ])
+        assert index.match("هل الشحن مجاني للطلبات فوق 9999 ريال؟") is None
+        assert "1000" in index.match("هل الشحن مجاني للطلبات فوق 1000 ريال؟")["answer"]
+
+    def test_missing_slot_falls_back(self, fast_path):
+        assert fast_path.match("أريد تتبع طلبي") is None
+
+    def test_unrelated_query_falls_back(self, fast_path):
+        assert fast_path.match("كيف حال الطقس اليوم") is None
+
+    @pytest.mark.asyncio
+    async def test_respond_uses_llm_below_threshold(self, fast_path):
+        async def llm(query):
+            return "llm answer"
+
+        result = await fast_path.respond("كيف حال الطقس اليوم", llm_fallback=llm)
+        assert result["source"] == "llm"
+        assert result["answer"] == "llm answer"
+
+    def test_stats_report_hit_rate(self, fast_path):
+        fast_path.match("ما هي سياسة الارجاع")
+        fast_path.match("كيف حال الطقس اليوم")
+        stats = fast_path.get_stats()
+        assert stats["lookups"] == 2
+        assert stats["hit_rate"] == 0.5
+        assert stats["avg_latency_ms"] >= 0
+
+
+class TestSupportFastPathRegistry:
+    """Test persistence and lazy loading across registry instances."""
+
+    def test_index_is_shared_through_disk(self, tmp_path):
+        builder = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        builder.build_for_bot("acme", "support_bot", SAMPLE_CONVERSATIONS, FAQS, system_prompt="أنت بوت دعم")
+
+        other_worker = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        index = other_worker.get("acme", "support_bot")
+        assert index is not None
+        assert index.system_prompt == "أنت بوت دعم"
+        assert "ORD-99881" in index.match("أريد تتبع طلبي رقم ORD-99881")["answer"]
+        assert other_worker.get("acme", "unknown_bot") is None
+
+    def test_rebuild_is_picked_up(self, tmp_path):
+        builder = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        reader = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        builder.build_for_bot("acme", "support_bot", faqs=FAQS)
+        assert len(reader.get("acme", "support_bot").entries) == 1
+
+        builder.build_for_bot("acme", "support_bot", SAMPLE_CONVERSATIONS, FAQS)
+        path = builder._path("acme", "support_bot")
+        os.utime(path, (time.time() + 5, time.time() + 5))
+        assert len(reader.get("acme", "support_bot").entries) == 3
+
+    def test_concurrent_builds_of_one_bot(self, tmp_path):
+        registry = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: registry.build_for_bot("acme", "support_bot", SAMPLE_CONVERSATIONS, FAQS), range(32)))
+        assert len(SupportFastPathRegistry(storage_dir=str(tmp_path)).get("acme", "support_bot").entries) == 3
+        assert os.listdir(tmp_path) == [os.path.basename(registry._path("acme", "support_bot"))]
+
+    def test_tenants_with_same_bot_name_are_isolated(self, tmp_path):
+        registry = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        registry.build_for_bot("acme", "support_bot", faqs=FAQS)
+        registry.build_for_bot("globex", "support_bot", faqs=[{"question": "ما هي سياسة الإرجاع؟", "answer": "لا نقبل الإرجاع."}])
+
+        reader = SupportFastPathRegistry(storage_dir=str(tmp_path))
+        assert reader.get("acme", "support_bot").match("ما هي سياسة الإرجاع؟")["answer"] == FAQS[0]["answer"]
+        assert reader.get("globex", "support_bot").match("ما هي سياسة الإرجاع؟")["answer"] == "لا نقبل الإرجاع."
+
+    def test_archive_faqs_are_scoped_to_tenant_and_bot(self, tmp_path):
+        store = PackedArchiveStore(root_dir=str(tmp_path / "archive"), refresh_interval_seconds=0)
+        store.put("faqs/acme/general.json", json.dumps(FAQS).encode("utf-8"))
+        store.put("faqs/acme/support_bot/orders.json", json.dumps({"faqs": [{"question": "متى يصل طلبي؟", "answer": "خلال 3 أيام."}]}).encode("utf-8"))
+        store.put("faqs/acme/sales_bot/offers.json", json.dumps([{"question": "هل يوجد خصم؟", "answer": "نعم"}]).encode("utf-8"))
+        store.put("faqs/globex/general.json", json.dumps([{"question": "سؤال", "answer": "جواب"}]).encode("utf-8"))
+        store.put("faqs/acme/broken.json", b"{not json")
+
+        faqs = load_archive_faqs(store, "acme", "support_bot")
+        assert sorted(f["question"] for f in faqs) == ["ما هي سياسة الإرجاع؟", "متى يصل طلبي؟"]
+        assert all(f["source"] == "archive" for f in faqs)
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_llm_fallback_from_trainer(self):
+        class Model:
+            async def generate_content_async(self, prompt):
+                return FakeGenerationResponse(prompt)
+
+        class Trainer:
+            model = Model()
+
+        fallback = llm_fallback_from_trainer(Trainer(), system_prompt="SYSTEM")
+        assert await fallback("سؤال") == "SYSTEM\n\nسؤال"
+        assert llm_fallback_from_trainer(object()) is None
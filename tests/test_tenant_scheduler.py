@@ -0,0 +1,141 @@
+"""
+Tests for per-tenant weighted fair scheduling and admission control
+"""
+import asyncio
+
+import pytest
+
+from server.core.tenant_scheduler import AdmissionRejected, TenantPolicy, TenantScheduler
+
+
+async def _run(scheduler, tenant, order, hold=0.01):
+    async with scheduler.slot(tenant, "intake"):
+        order.append(tenant)
+        await asyncio.sleep(hold)
+
+
+class TestTenantScheduler:
+    """Test fairness, caps, quotas and early rejection."""
+
+    @pytest.mark.asyncio
+    async def test_small_tenant_not_starved_by_bulk_tenant(self):
+        scheduler = TenantScheduler(max_concurrency=1, default_policy=TenantPolicy(max_queue_wait_seconds=60))
+        order = []
+        bulk = [asyncio.create_task(_run(scheduler, "bulk", order)) for _ in range(10)]
+        await asyncio.sleep(0)
+        small = asyncio.create_task(_run(scheduler, "small", order))
+        await asyncio.gather(*bulk, small)
+        assert order.index("small") <= 2
+
+    @pytest.mark.asyncio
+    async def test_weights_shift_share(self):
+        scheduler = TenantScheduler(
+            max_concurrency=1,
+            default_policy=TenantPolicy(max_queue_wait_seconds=60),
+            policies={"gold": TenantPolicy(weight=3.0, max_queue_wait_seconds=60)},
+        )
+        order = []
+        tasks = [asyncio.create_task(_run(scheduler, t, order, hold=0)) for t in ["basic"] * 8 + ["gold"] * 8]
+        await asyncio.gather(*tasks)
+        assert order[:8].count("gold") >= 5
+
+    @pytest.mark.asyncio
+    async def test_per_tenant_concurrency_cap(self):
+        scheduler = TenantScheduler(max_concurrency=8, default_policy=TenantPolicy(max_concurrency=2))
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with scheduler.slot("t1"):
+                peak = max(peak, scheduler.get_metrics()["tenants"]["t1"]["running"])
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_quota_rejects_with_retry_after(self):
+        scheduler = TenantScheduler(policies={"t1": TenantPolicy(requests_per_minute=2)})
+        for _ in range(2):
+            async with scheduler.slot("t1"):
+                pass
+        with pytest.raises(AdmissionRejected) as exc_info:
+            async with scheduler.slot("t1"):
+                pass
+        assert exc_info.value.reason == "quota_exceeded"
+        assert exc_info.value.retry_after >= 1
+
+    @pytest.mark.asyncio
+    async def test_rejects_early_when_deadline_cannot_be_met(self):
+        scheduler = TenantScheduler(
+            max_concurrency=1,
+            default_policy=TenantPolicy(max_queue_wait_seconds=1.0),
+            default_service_seconds=5.0,
+        )
+        holder = asyncio.create_task(_run(scheduler, "t1", [], hold=0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            async with scheduler.slot("t2"):
+                pass
+        assert exc_info.value.reason == "queue_deadline_exceeded"
+        await holder
+        assert scheduler.get_metrics()["tenants"]["t2"]["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_default_tenant_gets_global_cap(self):
+        scheduler = TenantScheduler(max_concurrency=8, default_policy=TenantPolicy(max_concurrency=2))
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with scheduler.slot(None):
+                peak = max(peak, scheduler.get_metrics()["tenants"]["default"]["running"])
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(work() for _ in range(8)))
+        assert peak == 8
+
+    @pytest.mark.asyncio
+    async def test_deadline_rejection_keeps_quota_token(self):
+        scheduler = TenantScheduler(
+            max_concurrency=1,
+            default_policy=TenantPolicy(max_queue_wait_seconds=1.0),
+            policies={"t2": TenantPolicy(requests_per_minute=1, max_queue_wait_seconds=1.0)},
+            default_service_seconds=5.0,
+        )
+        holder = asyncio.create_task(_run(scheduler, "t1", [], hold=0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            async with scheduler.slot("t2"):
+                pass
+        assert exc_info.value.reason == "queue_deadline_exceeded"
+        await holder
+        async with scheduler.slot("t2"):
+            pass
+
+    @pytest.mark.parametrize("tenant", [123, "x" * 51, "bad\ntenant"])
+    def test_rejects_invalid_tenant_ids(self, tenant):
+        with pytest.raises(ValueError):
+            TenantScheduler.tenant_id(tenant)
+        assert TenantScheduler.tenant_id(None) == "default"
+
+    @pytest.mark.asyncio
+    async def test_idle_tenants_are_evicted(self):
+        scheduler = TenantScheduler(max_concurrency=4, max_tenants=3)
+        for i in range(10):
+            async with scheduler.slot(f"t{i}"):
+                pass
+        assert list(scheduler.get_metrics()["tenants"]) == ["t7", "t8", "t9"]
+
+    def test_caps_are_divided_across_workers(self, monkeypatch):
+        monkeypatch.setenv("WEB_CONCURRENCY", "4")
+        scheduler = TenantScheduler(
+            max_concurrency=16,
+            default_policy=TenantPolicy(max_concurrency=4),
+            policies={"bulk": TenantPolicy(max_concurrency=10, requests_per_minute=120)}
+        )
+        assert scheduler.max_concurrency == 4
+        assert scheduler._policy_for("small").max_concurrency == 1
+        bulk = scheduler._policy_for("bulk")
+        assert (bulk.max_concurrency, bulk.requests_per_minute) == (3, 30)
+        assert TenantScheduler(max_concurrency=16, worker_count=1).max_concurrency == 16